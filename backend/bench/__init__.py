@@ -0,0 +1,22 @@
+# backend/bench/__init__.py
+"""
+Benchmarks and load tests for the backend.
+
+Run from backend/:
+
+    python -m bench micro                      # per-stage timings, every size/preset
+    python -m bench micro --sizes 2mp --presets strong
+    python -m bench load --route enhance --concurrency 8 --requests 200
+    python -m bench load --route smile --latency 2 --failure-rate 0.1
+    python -m bench load --route enhance --workers 4    # through serve.py
+    python -m bench load --route enhance,smile,video --max-loop-lag-ms 50
+    python -m bench coldstart --workers 2,4             # import + launch times
+    python -m bench compare bench/results/A.json bench/results/B.json
+
+Every run is saved as JSON under bench/results/ (named by time and git
+revision) so a change can be compared against an earlier revision.
+
+The load driver starts the API with uvicorn in a subprocess, with a local
+Replicate stub (bench/replicate_stub.py) standing in for the real service,
+and a throwaway RESULTS_DIR so runs never touch the real result cache.
+"""
@@ -0,0 +1,143 @@
+# backend/bench/__main__.py
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench  # noqa: E402
+from bench import images, metrics  # noqa: E402
+
+
+def _list(value: str) -> list:
+    return [item for item in value.split(",") if item]
+
+
+def _env_pairs(pairs: list) -> dict:
+    return dict(pair.split("=", 1) for pair in pairs)
+
+
+def micro_command(args):
+    from bench import micro
+
+    results = micro.run(args.sizes, args.presets, args.repeats,
+                        stages=not args.whole_only, whole=not args.stages_only)
+    config = {"sizes": args.sizes, "presets": args.presets, "repeats": args.repeats, **micro.CONFIG}
+    print(f"\nSaved {metrics.save('micro', config, results)}")
+
+
+def load_command(args):
+    from bench import load
+
+    stub_env = {
+        "STUB_LATENCY":      str(args.latency),
+        "STUB_JITTER":       str(args.jitter),
+        "STUB_FAILURE_RATE": str(args.failure_rate),
+        "STUB_ERROR_RATE":   str(args.error_rate),
+        "STUB_VIDEO_MB":     str(args.video_mb),
+    }
+    concurrency = [int(c) for c in args.concurrency]
+    results = load.run(args.route, args.size, concurrency, args.requests, args.warmup,
+                       unique=not args.repeat_input, stub_env=stub_env,
+                       server_env=_env_pairs(args.server_env), workers=args.workers,
+                       max_loop_lag_ms=args.max_loop_lag_ms)
+    config = {"routes": args.route, "size": args.size, "concurrency": concurrency, "workers": args.workers,
+              "requests": args.requests, "unique": not args.repeat_input,
+              "stub": stub_env, "server_env": _env_pairs(args.server_env),
+              "max_loop_lag_ms": args.max_loop_lag_ms}
+    print(f"\nSaved {metrics.save('load', config, results)}")
+    if any(row.get("loop_lag_ok") is False for row in results):
+        print(f"Event loop blocked for more than {args.max_loop_lag_ms:g} ms")
+        sys.exit(1)
+
+
+def coldstart_command(args):
+    from bench import coldstart
+
+    workers = [int(count) for count in args.workers]
+    results = coldstart.run(workers, args.repeats)
+    print(f"\nSaved {metrics.save('coldstart', {'workers': workers, 'repeats': args.repeats}, results)}")
+
+
+def compare_command(args):
+    kind = metrics.load(args.new)["kind"]
+    metric = args.metric or ("p95" if kind == "load" else "median_ms")
+    rows = metrics.compare(args.base, args.new, metric, args.threshold)
+    if not rows:
+        print("No results in common")
+        return
+
+    print(f"{'name':<44} {'base':>10} {'new':>10} {'change':>8}   ({metric})")
+    for name, old, new, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<44} {old:>10.2f} {new:>10.2f} {change:>+8.1%}{flag}")
+    if any(row[4] for row in rows) and args.fail_on_regression:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench", description=bench.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    micro = commands.add_parser("micro", help="per-stage pipeline timings")
+    micro.add_argument("--sizes", type=_list, default=list(images.DEFAULT_SIZES),
+                       help=f"comma-separated, from {', '.join(images.SIZES)}")
+    micro.add_argument("--presets", type=_list, default=list(images.DEFAULT_PRESETS),
+                       help=f"comma-separated, from {', '.join(images.PRESETS)}")
+    micro.add_argument("--repeats", type=int, default=3)
+    micro.add_argument("--stages-only", action="store_true")
+    micro.add_argument("--whole-only", action="store_true")
+    micro.set_defaults(func=micro_command)
+
+    load = commands.add_parser("load", help="end-to-end load test against a local server")
+    load.add_argument("--route", type=_list, default=["enhance"],
+                      help="comma-separated: enhance, preview, smile, video")
+    load.add_argument("--size", default="2mp", choices=images.SIZES)
+    load.add_argument("--concurrency", type=_list, default=["8"], help="comma-separated client counts")
+    load.add_argument("--requests", type=int, default=100, help="per route and concurrency level")
+    load.add_argument("--warmup", type=int, default=2)
+    load.add_argument("--repeat-input", action="store_true",
+                      help="send the identical image every time (measures cache hits)")
+    load.add_argument("--latency", type=float, default=1.0, help="stub prediction seconds")
+    load.add_argument("--jitter", type=float, default=0.2)
+    load.add_argument("--failure-rate", type=float, default=0.0, help="stub predictions that fail")
+    load.add_argument("--error-rate", type=float, default=0.0, help="stub creates answered with 503")
+    load.add_argument("--video-mb", type=float, default=2.0)
+    load.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                      help="extra environment for the API server, e.g. ENHANCE_POOL_WORKERS=4")
+    load.add_argument("--workers", type=int, default=0,
+                      help="run the API through serve.py with this many worker processes")
+    load.add_argument("--max-loop-lag-ms", type=float, default=None,
+                      help="fail (exit 1) when the event loop was blocked longer than this in any run")
+    load.set_defaults(func=load_command)
+
+    coldstart = commands.add_parser("coldstart", help="app import and server launch times")
+    coldstart.add_argument("--workers", type=_list, default=["2", "4"],
+                           help="comma-separated serve.py worker counts")
+    coldstart.add_argument("--repeats", type=int, default=5)
+    coldstart.set_defaults(func=coldstart_command)
+
+    compare = commands.add_parser("compare", help="compare two saved runs")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--metric", help="default: p95 (load) / median_ms (others)")
+    compare.add_argument("--threshold", type=float, default=0.1, help="relative slowdown flagged")
+    compare.add_argument("--fail-on-regression", action="store_true")
+    compare.set_defaults(func=compare_command)
+
+    args = parser.parse_args()
+    for route in getattr(args, "route", []):
+        if route not in ("enhance", "preview", "smile", "video"):
+            parser.error(f"unknown route: {route}")
+    for size in getattr(args, "sizes", []):
+        if size not in images.SIZES:
+            parser.error(f"unknown size: {size}")
+    for preset in getattr(args, "presets", []):
+        if preset not in images.PRESETS:
+            parser.error(f"unknown preset: {preset}")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
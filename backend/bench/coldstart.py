@@ -0,0 +1,79 @@
+# backend/bench/coldstart.py
+"""
+Cold-start timings.
+
+  * import — a fresh interpreter importing the app (main.py), measured inside
+    the child, plus which heavy clients that import pulled in
+  * launch — from starting a server process to its first answered request:
+    plain uvicorn, and serve.py with N workers, preloaded and not
+"""
+import os
+import sys
+import json
+import tempfile
+import statistics
+import subprocess
+
+from bench.load import Server, BACKEND_DIR
+
+_IMPORT_PROBE = (
+    "import sys, time, json; start = time.perf_counter(); import main; "
+    "print(json.dumps({'seconds': time.perf_counter() - start, 'modules': len(sys.modules), "
+    "'replicate': 'replicate' in sys.modules, 'httpx': 'httpx' in sys.modules}))"
+)
+
+
+def _row(name: str, timings: list, **extra) -> dict:
+    return {
+        "name":      name,
+        "median_ms": round(statistics.median(timings) * 1000, 1),
+        "min_ms":    round(min(timings) * 1000, 1),
+        "repeats":   len(timings),
+        **extra,
+    }
+
+
+def import_time(env: dict, repeats: int) -> dict:
+    probes = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", _IMPORT_PROBE], cwd=BACKEND_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        probes.append(json.loads(output.strip().splitlines()[-1]))
+    return _row("coldstart.import", [probe["seconds"] for probe in probes],
+                modules=probes[-1]["modules"], replicate_loaded=probes[-1]["replicate"],
+                httpx_loaded=probes[-1]["httpx"])
+
+
+def launch_time(env: dict, workers: int, preload: bool, repeats: int, log_path: str) -> dict:
+    timings = []
+    for _ in range(repeats):
+        with Server("main:app", {**env, "WEB_PRELOAD": str(int(preload))}, log_path, workers) as server:
+            timings.append(server.startup_seconds)
+    if not workers:
+        name = "coldstart.launch/uvicorn"
+    else:
+        name = f"coldstart.launch/serve_w{workers}{'' if preload else '_nopreload'}"
+    return _row(name, timings)
+
+
+def run(workers=(2, 4), repeats: int = 5, log=print) -> list:
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    env = {
+        **os.environ,
+        "RESULTS_DIR":  os.path.join(workdir, "results"),
+        "JOBS_DB_PATH": os.path.join(workdir, "results", "jobs", "jobs.db"),
+    }
+    log_path = os.path.join(workdir, "api.log")
+    log(f"Logs and results under {workdir}")
+
+    results = [import_time(env, repeats)]
+    row = results[0]
+    log(f"{row['name']:<36} {row['median_ms']:>8.1f} ms  ({row['modules']} modules, "
+        f"replicate {'loaded' if row['replicate_loaded'] else 'deferred'}, "
+        f"httpx {'loaded' if row['httpx_loaded'] else 'deferred'})")
+
+    launches = [(0, False)] + [(count, preload) for count in workers for preload in (True, False)]
+    for count, preload in launches:
+        results.append(launch_time(env, count, preload, repeats, log_path))
+        log(f"{results[-1]['name']:<36} {results[-1]['median_ms']:>8.1f} ms")
+    return results
@@ -0,0 +1,43 @@
+# backend/bench/images.py
+"""Synthetic, photo-like test images and slider presets."""
+import io
+
+import numpy as np
+from PIL import Image
+
+
+# name -> (width, height)
+SIZES = {
+    "vga":  (640, 480),
+    "2mp":  (1920, 1080),
+    "12mp": (4000, 3000),
+    "48mp": (8000, 6000),
+}
+DEFAULT_SIZES = ("vga", "2mp", "12mp")
+
+# name -> (enh, sharp, clarity)
+PRESETS = {
+    "neutral": (50, 50, 50),
+    "typical": (65, 60, 60),
+    "strong":  (85, 80, 90),
+}
+DEFAULT_PRESETS = ("typical", "strong")
+
+
+def photo(width: int, height: int, seed: int = 0) -> Image.Image:
+    """
+    Smooth colour regions plus sensor-like noise. Compresses and filters
+    roughly like a real photo, unlike pure noise or flat colour.
+    """
+    rng   = np.random.default_rng(seed)
+    base  = Image.fromarray(rng.integers(0, 256, (12, 16, 3), dtype=np.uint8))
+    image = np.asarray(base.resize((width, height), Image.BICUBIC), dtype=np.int16)
+    image = image + rng.integers(-6, 7, (height, width, 1), dtype=np.int16)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+
+def encoded(size: str, fmt: str = "JPEG", seed: int = 0) -> bytes:
+    """A SIZES image encoded as an upload would arrive."""
+    buffer = io.BytesIO()
+    photo(*SIZES[size], seed=seed).save(buffer, format=fmt, quality=90)
+    return buffer.getvalue()
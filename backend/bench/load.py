@@ -0,0 +1,233 @@
+# backend/bench/load.py
+"""
+End-to-end load driver.
+
+Starts the Replicate stub and the API (uvicorn, one process each — or the
+API through serve.py with several workers) on free local ports, then fires
+requests at one route from `concurrency` parallel clients and reports
+latency percentiles, throughput, status codes and the API's peak resident
+memory (its whole process tree, pool workers included).
+
+It also reports how long the API's event loop was blocked during each run,
+from the imagify_event_loop_lag_seconds histogram on /metrics (so the
+figures are bucket bounds: "max 10 ms" means the longest stall was between 5
+and 10 ms). With max_loop_lag_ms set, a run whose longest stall may have
+exceeded it is marked failed. Single-process runs only: with several workers
+each scrape reaches a different one. Lag is wall time, so it includes time
+the loop spent waiting for the GIL (in-process threads such as session
+renders) or for a CPU: on a machine with fewer cores than the driver, the
+stub, the API and its pool need, an overrun may be contention rather than a
+blocking call. The benchmark in tests/test_loop_lag.py (BENCHMARKS=1) asserts
+on these figures.
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import tempfile
+import itertools
+import subprocess
+from collections import Counter
+
+import httpx
+
+from bench import images
+from bench.metrics import PeakRSS, summarize
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> path (query included); every route takes a multipart "file"
+ROUTES = {
+    "enhance": "/api/enhance/?enh=65&sharp=60&clarity=60&binary=true",
+    "preview": "/api/enhance/?enh=65&sharp=60&clarity=60&binary=true&preview=true&format=jpeg&quality=85",
+    "smile":   "/api/animate/smile",
+    "video":   "/api/animate/video",
+}
+
+
+LOOP_LAG_BUCKET = "imagify_event_loop_lag_seconds_bucket"
+
+
+def loop_lag_counts(url: str) -> dict:
+    """{bucket bound in seconds: cumulative probes} from the API's /metrics."""
+    counts = {}
+    for line in httpx.get(url + "/metrics", timeout=10).text.splitlines():
+        if line.startswith(LOOP_LAG_BUCKET):
+            bound = line.split('le="', 1)[1].split('"', 1)[0]
+            counts[float(bound)] = float(line.rsplit(" ", 1)[1])
+    return counts
+
+
+def loop_lag(before: dict, after: dict) -> dict:
+    """p99 and max event-loop stall (bucket upper bounds, ms) between two scrapes."""
+    bounds = sorted(after)
+    deltas = [after[bound] - before.get(bound, 0) for bound in bounds]
+    probes = deltas[-1] if deltas else 0
+
+    def bound_ms(fraction: float):
+        for bound, count in zip(bounds, deltas):
+            if count >= fraction * probes:
+                return None if bound == float("inf") else round(bound * 1000, 1)
+        return None
+
+    return {
+        "loop_lag_probes": int(probes),
+        "loop_lag_p99_ms": bound_ms(0.99) if probes else 0.0,
+        "loop_lag_max_ms": bound_ms(1.0) if probes else 0.0,  # None: past the largest bucket
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """
+    A uvicorn app in a subprocess, for the duration of a with-block.
+    workers > 0 runs the API through serve.py with that many worker processes.
+    startup_seconds is the time from launch to the first answered request.
+    """
+
+    def __init__(self, app: str, env: dict, log_path: str, workers: int = 0):
+        self.app      = app
+        self.port     = free_port()
+        self.url      = f"http://127.0.0.1:{self.port}"
+        self.env      = {**os.environ, **env}
+        self.log_path = log_path
+        self.workers  = workers
+        self.process  = None
+        self.startup_seconds = None
+
+    def command(self) -> list:
+        if self.workers:
+            return [sys.executable, "serve.py", "--workers", str(self.workers), "--host", "127.0.0.1",
+                    "--port", str(self.port), "--log-level", "warning"]
+        return [sys.executable, "-m", "uvicorn", self.app, "--port", str(self.port), "--log-level", "warning"]
+
+    def __enter__(self):
+        self._log = open(self.log_path, "ab")
+        start = time.perf_counter()
+        self.process = subprocess.Popen(
+            self.command(), cwd=BACKEND_DIR, env=self.env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.app} exited at startup, see {self.log_path}")
+            try:
+                httpx.get(self.url + "/", timeout=1)
+                self.startup_seconds = time.perf_counter() - start
+                return self
+            except httpx.HTTPError:
+                time.sleep(0.02)
+        self.__exit__()
+        raise RuntimeError(f"{self.app} did not start within 30s, see {self.log_path}")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+
+
+async def drive(url: str, path: str, payload: bytes, concurrency: int, requests: int,
+                unique: bool = True, timeout: float = 300) -> dict:
+    """Send `requests` uploads with `concurrency` in flight; collect latencies."""
+    latencies, statuses = [], Counter()
+    counter = itertools.count()
+    nonce   = os.urandom(8)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        async def worker():
+            while (i := next(counter)) < requests:
+                # Trailing bytes after the JPEG end marker change the cache key
+                # without changing the image, so every request is a cache miss
+                data = payload + nonce + i.to_bytes(8, "big") if unique else payload
+                start = time.perf_counter()
+                try:
+                    response = await client.post(path, files={"file": ("image.jpg", data, "image/jpeg")})
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                elapsed = time.perf_counter() - start
+                statuses[status] += 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    return {
+        "latency_ms":     summarize(latencies),
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "wall_s":         round(wall, 2),
+        "statuses":       {str(status): count for status, count in statuses.items()},
+    }
+
+
+def run(routes=("enhance",), size: str = "2mp", concurrency=(8,), requests: int = 100,
+        warmup: int = 2, unique: bool = True, stub_env: dict = None, server_env: dict = None,
+        workers: int = 0, max_loop_lag_ms: float = None, workdir: str = None, log=print) -> list:
+    payload = images.encoded(size)
+    workdir = workdir or tempfile.mkdtemp(prefix="bench-")
+    log(f"Logs and results under {workdir}")
+
+    stub = Server("bench.replicate_stub:app", stub_env or {}, os.path.join(workdir, "stub.log"))
+    results = []
+    with stub:
+        api_env = {
+            "REPLICATE_BASE_URL":      stub.url,
+            "REPLICATE_API_TOKEN":     "bench",
+            "REPLICATE_POLL_INTERVAL": "0.2",
+            "RESULTS_DIR":             os.path.join(workdir, "results"),
+            "JOBS_DB_PATH":            os.path.join(workdir, "results", "jobs", "jobs.db"),
+            # Every simulated client shares one address: no per-client rate limit
+            "ADMISSION_SMILE_RATE":    "0",
+            "ADMISSION_VIDEO_RATE":    "0",
+            **(server_env or {}),
+        }
+        with Server("main:app", api_env, os.path.join(workdir, "api.log"), workers) as api:
+            for route in routes:
+                path = ROUTES[route]
+                if warmup:
+                    asyncio.run(drive(api.url, path, payload, 1, warmup, unique=True))
+                for clients in concurrency:
+                    lag_before = loop_lag_counts(api.url) if not workers else None
+                    with PeakRSS(api.process.pid, interval=0.05) as rss:
+                        stats = asyncio.run(drive(api.url, path, payload, clients, requests, unique))
+                    if lag_before is not None:
+                        stats.update(loop_lag(lag_before, loop_lag_counts(api.url)))
+                    row = {
+                        "name":        f"load.{route}/{size}/c{clients}",
+                        "requests":    requests,
+                        **stats,
+                        # flattened for `bench compare`
+                        "p50":         stats["latency_ms"]["p50"],
+                        "p95":         stats["latency_ms"]["p95"],
+                        "p99":         stats["latency_ms"]["p99"],
+                        "peak_rss_mb": round(rss.peak_mb, 1),
+                    }
+                    if max_loop_lag_ms is not None and "loop_lag_max_ms" in row:
+                        worst = row["loop_lag_max_ms"]
+                        row["loop_lag_ok"] = worst is not None and worst <= max_loop_lag_ms
+                    results.append(row)
+                    log(f"{row['name']:<28} p50 {row['p50']:>8.1f}  p95 {row['p95']:>8.1f}  "
+                        f"p99 {row['p99']:>8.1f} ms  {row['throughput_rps']:>7.2f} req/s  "
+                        f"peak RSS {row['peak_rss_mb']:>7.1f} MB  {row['statuses']}")
+                    if "loop_lag_max_ms" in row:
+                        worst = row["loop_lag_max_ms"]
+                        flag = "" if row.get("loop_lag_ok", True) else f"  OVER {max_loop_lag_ms:g} ms"
+                        log(f"{'':<28} loop lag p99 <= {row['loop_lag_p99_ms']} ms, "
+                            f"max <= {worst if worst is not None else '>2500'} ms{flag}")
+        try:
+            log(f"Replicate stub: {httpx.get(stub.url + '/stats').json()}")
+        except httpx.HTTPError:
+            pass
+    return results
@@ -0,0 +1,150 @@
+# backend/bench/metrics.py
+"""Latency summaries, peak-RSS sampling and result files."""
+import os
+import json
+import time
+import platform
+import threading
+import subprocess
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of an unsorted list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank    = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies: list) -> dict:
+    """Latency stats in milliseconds."""
+    return {
+        "count": len(latencies),
+        "min":   round(min(latencies) * 1000, 2) if latencies else 0.0,
+        "p50":   round(percentile(latencies, 50) * 1000, 2),
+        "p95":   round(percentile(latencies, 95) * 1000, 2),
+        "p99":   round(percentile(latencies, 99) * 1000, 2),
+        "max":   round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+# ─── Resident memory ──────────────────────────────────────────────────────────
+
+def _rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid: int) -> list:
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def tree_rss_mb(pid: int) -> float:
+    """Resident memory of a process and all its descendants (Linux /proc)."""
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total  += _rss_kb(current)
+        stack.extend(_children(current))
+    return total / 1024
+
+
+class PeakRSS:
+    """Samples a process tree's RSS in a background thread; peak_mb after exit."""
+
+    def __init__(self, pid: int = None, interval: float = 0.005):
+        self.pid      = pid or os.getpid()
+        self.interval = interval
+        self.baseline_mb = 0.0
+        self.peak_mb     = 0.0
+        self._stop       = threading.Event()
+        self._thread     = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, tree_rss_mb(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.baseline_mb = self.peak_mb = tree_rss_mb(self.pid)
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, tree_rss_mb(self.pid))
+
+
+# ─── Result files ─────────────────────────────────────────────────────────────
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(__file__), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save(kind: str, config: dict, results: list) -> str:
+    """Write a run to bench/results/<time>-<rev>-<kind>.json and return the path."""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    revision = git_revision()
+    stamp    = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path     = os.path.join(RESULTS_DIR, f"{stamp}-{revision}-{kind}.json")
+    with open(path, "w") as f:
+        json.dump({
+            "kind":      kind,
+            "revision":  revision,
+            "timestamp": time.time(),
+            "host":      {"python": platform.python_version(), "machine": platform.machine(),
+                          "cpus": os.cpu_count()},
+            "config":    config,
+            "results":   results,
+        }, f, indent=2)
+    return path
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(base_path: str, new_path: str, metric: str, threshold: float = 0.1) -> list:
+    """
+    Rows of (name, base, new, change, regressed) for results present in
+    both runs; change is the relative difference of `metric`. A change for
+    the worse beyond threshold counts as a regression (throughput metrics
+    regress downwards, everything else upwards).
+    """
+    sign = -1 if metric.endswith("_rps") else 1
+    base = {row["name"]: row for row in load(base_path)["results"]}
+    new  = {row["name"]: row for row in load(new_path)["results"]}
+    rows = []
+    for name in base.keys() & new.keys():
+        old_value, new_value = base[name].get(metric), new[name].get(metric)
+        if not old_value or new_value is None:
+            continue
+        change = (new_value - old_value) / old_value
+        rows.append((name, old_value, new_value, change, sign * change > threshold))
+    return sorted(rows)
@@ -0,0 +1,122 @@
+# backend/bench/micro.py
+"""
+Per-stage micro-benchmarks of the enhance pipeline and the smile
+pre-processing, across image sizes and slider presets.
+
+Each stage gets the previous stage's output as input, as in a real request.
+Times are per call; peak_rss_mb is the growth of this process's resident
+memory while the stage ran.
+"""
+import io
+import time
+import statistics
+
+from PIL import Image
+
+from bench import images
+from bench.metrics import PeakRSS
+from services import animator, enhancer, pipeline, tiling
+
+
+def _time(fn, repeats: int):
+    """(result, [seconds per call], peak RSS growth in MB)"""
+    timings = []
+    with PeakRSS() as rss:
+        for _ in range(repeats):
+            start  = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - start)
+    return result, timings, round(rss.peak_mb - rss.baseline_mb, 1)
+
+
+def _row(name: str, timings: list, rss_mb: float, **extra) -> dict:
+    return {
+        "name":        name,
+        "median_ms":   round(statistics.median(timings) * 1000, 2),
+        "min_ms":      round(min(timings) * 1000, 2),
+        "repeats":     len(timings),
+        "peak_rss_mb": rss_mb,
+        **extra,
+    }
+
+
+def _encode(image: Image.Image, fmt: str, **kwargs) -> int:
+    buffer = io.BytesIO()
+    pipeline.encode(image, buffer, fmt, **kwargs)
+    return buffer.tell()
+
+
+def stage_cases(data: bytes, enh: float, sharp: float, clarity: float):
+    """(stage name, fn(previous image) -> image or size) in pipeline order."""
+    return [
+        ("decode",        lambda _: Image.open(io.BytesIO(data)).convert("RGB")),
+        ("tone",          lambda image: pipeline.apply_tone(image, enh)),
+        ("sharpness",     lambda image: pipeline.apply_sharpness(image, sharp)),
+        ("clarity",       lambda image: pipeline.apply_clarity(image, clarity)),
+        ("denoise",       lambda image: pipeline.apply_denoise(image, enh, sharp, clarity)),
+        ("encode_png",    lambda image: _encode(image, "png")),
+        ("encode_jpeg",   lambda image: _encode(image, "jpeg")),
+        ("encode_webp",   lambda image: _encode(image, "webp")),
+    ]
+
+
+def whole_cases(data: bytes, enh: float, sharp: float, clarity: float):
+    """End-to-end entry points, each starting from the encoded upload."""
+    return [
+        ("enhance_bytes", lambda: len(pipeline.enhance_bytes(data, enh, sharp, clarity, tiled=False))),
+        ("enhance_tiled", lambda: len(pipeline.enhance_bytes(data, enh, sharp, clarity, tiled=True))),
+        ("preview_bytes", lambda: len(pipeline.preview_bytes(io.BytesIO(data), enh, sharp, clarity, "jpeg", 85))),
+    ]
+
+
+def run(sizes=images.DEFAULT_SIZES, presets=images.DEFAULT_PRESETS, repeats: int = 3,
+        stages: bool = True, whole: bool = True, log=print) -> list:
+    results = []
+    for size in sizes:
+        data = images.encoded(size)
+        megapixels = round(images.SIZES[size][0] * images.SIZES[size][1] / 1e6, 1)
+        log(f"── {size} ({megapixels} MP, {len(data) // 1024} KB JPEG)")
+
+        # Per-size entry points that don't depend on the sliders
+        for name, fn in (
+            ("compress_image", lambda: len(animator.compress_bytes(data, animator.COMPRESS_MAX_SIZE))),
+            ("upscale_2x_lanczos", lambda: len(enhancer.enhance_image(data, 2.0, "lanczos"))),
+            ("upscale_2x_edge", lambda: len(enhancer.enhance_image(data, 2.0, "edge"))),
+            ("upscale_2x_edge_1thread", lambda: len(enhancer.enhance_image(data, 2.0, "edge", workers=1))),
+        ):
+            if name.startswith("upscale") and size == "48mp":
+                continue  # a 192 MP output frame
+            _, timings, rss = _time(fn, repeats)
+            results.append(_row(f"{name}/{size}", timings, rss, megapixels=megapixels))
+            log(f"   {name:<24} {results[-1]['median_ms']:>9.1f} ms")
+
+        for preset in presets:
+            enh, sharp, clarity = images.PRESETS[preset]
+
+            if stages:
+                image = None
+                for name, fn in stage_cases(data, enh, sharp, clarity):
+                    output, timings, rss = _time(lambda: fn(image), repeats)
+                    if isinstance(output, Image.Image):
+                        image = output
+                    results.append(_row(f"stage.{name}/{size}/{preset}", timings, rss, megapixels=megapixels))
+                    log(f"   {preset:<8} {name:<15} {results[-1]['median_ms']:>9.1f} ms")
+
+            if whole:
+                for name, fn in whole_cases(data, enh, sharp, clarity):
+                    if name == "enhance_tiled" and size == "vga":
+                        continue  # a single strip; identical to enhance_bytes
+                    output, timings, rss = _time(fn, repeats)
+                    results.append(_row(f"{name}/{size}/{preset}", timings, rss,
+                                        megapixels=megapixels, output_bytes=output))
+                    log(f"   {preset:<8} {name:<15} {results[-1]['median_ms']:>9.1f} ms"
+                        f"  peak +{rss} MB")
+    return results
+
+
+CONFIG = {
+    "tile_budget_mb": tiling.TILE_BUDGET_MB,
+    "preview_max_size": pipeline.PREVIEW_MAX_SIZE,
+    "upscale_tile_budget_mb": enhancer.UPSCALE_TILE_BUDGET_MB,
+    "upscale_threads": enhancer.UPSCALE_THREADS,
+}
@@ -0,0 +1,149 @@
+# backend/bench/replicate_stub.py
+"""
+Local stand-in for the Replicate HTTP API, for load tests.
+
+Implements the endpoints the replicate client uses — file upload, prediction
+create (by version or by model), get and cancel — plus the output downloads.
+Behaviour is set through environment variables:
+
+    STUB_LATENCY        mean seconds a prediction takes (default 1.0)
+    STUB_JITTER         ± uniform jitter on that, in seconds (default 0.2)
+    STUB_FAILURE_RATE   fraction of predictions that end "failed" (default 0)
+    STUB_ERROR_RATE     fraction of create calls answered with HTTP 503 (default 0)
+    STUB_VIDEO_MB       size of the generated "video" (default 2)
+
+Run with: uvicorn bench.replicate_stub:app --port 8100
+"""
+import os
+import time
+import uuid
+import random
+
+from fastapi import FastAPI, Request, UploadFile, File
+from fastapi.responses import JSONResponse, Response
+
+LATENCY      = float(os.getenv("STUB_LATENCY", 1.0))
+JITTER       = float(os.getenv("STUB_JITTER", 0.2))
+FAILURE_RATE = float(os.getenv("STUB_FAILURE_RATE", 0))
+ERROR_RATE   = float(os.getenv("STUB_ERROR_RATE", 0))
+VIDEO_BYTES  = int(float(os.getenv("STUB_VIDEO_MB", 2)) * 1024 * 1024)
+
+# A tiny valid WebP (1x1), returned as the "smiling" image
+SMILE_WEBP = bytes.fromhex(
+    "524946461e000000574542505650384c110000002f000000000750cb2217afff8188e87f0000"
+)
+
+app = FastAPI()
+
+_predictions = {}  # id -> dict
+_stats = {"created": 0, "canceled": 0, "failed": 0, "errors": 0}
+
+
+def _view(request: Request, prediction: dict) -> dict:
+    base = str(request.base_url).rstrip("/")
+    if prediction["status"] == "starting" and time.time() >= prediction["done_at"]:
+        if prediction["fail"]:
+            prediction["status"] = "failed"
+            prediction["error"]  = "Stub failure"
+            _stats["failed"] += 1
+        else:
+            prediction["status"] = "succeeded"
+            if prediction["kind"] == "video":
+                prediction["output"] = f"{base}/outputs/{prediction['id']}.mp4"
+            else:
+                prediction["output"] = [f"{base}/outputs/{prediction['id']}.webp"]
+    return {
+        "id":           prediction["id"],
+        "model":        prediction["model"],
+        "version":      prediction["version"],
+        "status":       prediction["status"],
+        "input":        {},
+        "output":       prediction["output"],
+        "logs":         "",
+        "error":        prediction["error"],
+        "metrics":      {},
+        "created_at":   "2024-01-01T00:00:00Z",
+        "started_at":   None,
+        "completed_at": None,
+        "urls": {
+            "get":    f"{base}/v1/predictions/{prediction['id']}",
+            "cancel": f"{base}/v1/predictions/{prediction['id']}/cancel",
+        },
+    }
+
+
+def _create(request: Request, model: str, version: str):
+    if random.random() < ERROR_RATE:
+        _stats["errors"] += 1
+        return JSONResponse({"title": "Service Unavailable", "detail": "Stub error", "status": 503},
+                            status_code=503)
+
+    _stats["created"] += 1
+    prediction = {
+        "id":      uuid.uuid4().hex,
+        "model":   model,
+        "version": version,
+        "kind":    "video" if "video" in model else "image",
+        "status":  "starting",
+        "output":  None,
+        "error":   None,
+        "fail":    random.random() < FAILURE_RATE,
+        "done_at": time.time() + max(0.0, LATENCY + random.uniform(-JITTER, JITTER)),
+    }
+    _predictions[prediction["id"]] = prediction
+    return JSONResponse(_view(request, prediction), status_code=201)
+
+
+@app.post("/v1/predictions")
+async def create_by_version(request: Request):
+    body = await request.json()
+    return _create(request, "stub/versioned", body.get("version", ""))
+
+
+@app.post("/v1/models/{owner}/{name}/predictions")
+async def create_by_model(owner: str, name: str, request: Request):
+    return _create(request, f"{owner}/{name}", "latest")
+
+
+@app.get("/v1/predictions/{prediction_id}")
+async def get_prediction(prediction_id: str, request: Request):
+    prediction = _predictions.get(prediction_id)
+    if prediction is None:
+        return JSONResponse({"detail": "Not found", "status": 404}, status_code=404)
+    return _view(request, prediction)
+
+
+@app.post("/v1/predictions/{prediction_id}/cancel")
+async def cancel_prediction(prediction_id: str, request: Request):
+    prediction = _predictions.get(prediction_id)
+    if prediction is None:
+        return JSONResponse({"detail": "Not found", "status": 404}, status_code=404)
+    if prediction["status"] == "starting":
+        prediction["status"] = "canceled"
+        _stats["canceled"] += 1
+    return _view(request, prediction)
+
+
+@app.post("/v1/files")
+async def upload_file(request: Request, content: UploadFile = File(...)):
+    data = await content.read()
+    file_id = uuid.uuid4().hex
+    base = str(request.base_url).rstrip("/")
+    return JSONResponse({
+        "id": file_id, "name": content.filename or "file", "content_type": content.content_type or "",
+        "size": len(data), "etag": file_id, "checksums": {}, "metadata": {},
+        "created_at": "2024-01-01T00:00:00Z", "expires_at": None,
+        "urls": {"get": f"{base}/files/{file_id}"},
+    }, status_code=201)
+
+
+@app.get("/outputs/{name}")
+async def output(name: str):
+    if name.endswith(".mp4"):
+        return Response(b"\0" * VIDEO_BYTES, media_type="video/mp4")
+    return Response(SMILE_WEBP, media_type="image/webp")
+
+
+@app.get("/stats")
+async def stats():
+    return _stats
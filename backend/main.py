@@ -1,19 +1,72 @@
 # backend/main.py
 import sys
 import os
+import time
+import asyncio
+
+_boot = time.perf_counter()
 
 # Fix imports for both local and Railway
 sys.path.insert(0, os.path.dirname(__file__))
 
-from fastapi import FastAPI
+# backend/.env, before any module reads its config from the environment
+from dotenv import load_dotenv
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"), override=True)
+
+import logging
+# uvicorn configures only its own loggers; routers.* would otherwise drop INFO
+logging.basicConfig(format="%(message)s")
+logging.getLogger("routers").setLevel(logging.INFO)
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import PlainTextResponse
 
 from routers import enhance
 from routers import animate
 from routers import video
+from routers import jobs
+from services.pool import enhance_pool, video_pool, thumbnail_pool, session_pool
+from services.store import STORES, file_store, sweeper, file_response
+from services.resilience import BREAKERS
+from services.admission import GATES
+from services.singleflight import FLIGHTS
+from services.jobs import job_queue
+from services.sessions import enhance_sessions
+from services import fileio, http_client, replicate_client, metrics, shared
+
+# ─── Cold start (seconds) ─────────────────────────────────────────────────────
+# import: loading this module and everything it pulls in. ready: from boot to
+# the end of lifespan startup; serve.py resets "boot" in each forked worker,
+# whose import was paid once by the parent.
+startup = {"boot": _boot, "import": time.perf_counter() - _boot, "ready": None}
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await metrics.loop_monitor.start()
+    await job_queue.start()
+    await sweeper.start()
+    startup["ready"] = time.perf_counter() - startup["boot"]
+    print(f" Worker {os.getpid()} ready in {startup['ready'] * 1000:.0f} ms"
+          f" (app import {startup['import'] * 1000:.0f} ms)")
+    warm_up = asyncio.create_task(replicate_client.warm_up())
+    yield
+    warm_up.cancel()
+    await sweeper.stop()
+    await job_queue.stop()
+    await replicate_client.close()
+    await http_client.close()
+    enhance_pool.shutdown()
+    video_pool.shutdown()
+    thumbnail_pool.shutdown()
+    fileio.shutdown()
+    shared.shutdown()
+    await metrics.loop_monitor.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,24 +74,182 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Enhance-Settings", "X-Queue-Time", "Retry-After"],
+)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# ─── Scrape-time gauges ───────────────────────────────────────────────────────
+# cache.stats() runs SQLite queries, so /metrics takes it once per cache and the
+# cache gauges below all read that one snapshot.
+scrape = {"caches": {}}
+
+metrics.Gauge(
+    "imagify_pool_jobs", "Enhance pool jobs by state; capacity is the admission limit.",
+    ("state",),
+    collect=lambda: {
+        ("running",):  enhance_pool.in_flight - enhance_pool.queued,
+        ("queued",):   enhance_pool.queued,
+        ("capacity",): enhance_pool.capacity,
+    },
+)
+metrics.Gauge(
+    "imagify_thumbnail_pool_jobs", "Preview and smile-compress jobs by state; capacity is the admission limit.",
+    ("state",),
+    collect=lambda: {
+        ("running",):  thumbnail_pool.in_flight - thumbnail_pool.queued,
+        ("queued",):   thumbnail_pool.queued,
+        ("capacity",): thumbnail_pool.capacity,
+    },
+)
+metrics.Gauge(
+    "imagify_session_render_jobs", "Enhance session renders by state; capacity is the admission limit.",
+    ("state",),
+    collect=lambda: {
+        ("running",):  session_pool.in_flight - session_pool.queued,
+        ("queued",):   session_pool.queued,
+        ("capacity",): session_pool.capacity,
+    },
+)
+metrics.Gauge(
+    "imagify_video_pool_jobs", "Video variant transcodes by state; capacity is the admission limit.",
+    ("state",),
+    collect=lambda: {
+        ("running",):  video_pool.in_flight - video_pool.queued,
+        ("queued",):   video_pool.queued,
+        ("capacity",): video_pool.capacity,
+    },
+)
+metrics.Gauge(
+    "imagify_admission_requests", "Animate requests past admission control by state; limit is the slot count.",
+    ("route", "state"),
+    collect=lambda: {
+        key: value for gate in GATES for key, value in (
+            ((gate.name, "running"), gate.in_flight),
+            ((gate.name, "queued"),  gate.queued),
+            ((gate.name, "limit"),   gate.concurrency),
+        )
+    },
+)
+metrics.Counter(
+    "imagify_admission_decisions_total", "Admission decisions: admitted, or the reason for a 429.",
+    ("route", "result"),
+    collect=lambda: {(gate.name, result): count for gate in GATES for result, count in gate.counters.items()},
+)
+metrics.Gauge(
+    "imagify_singleflight_requests", "Distinct generations in flight, and requests attached to one another started.",
+    ("op", "state"),
+    collect=lambda: {
+        key: value for flight in FLIGHTS for key, value in (
+            ((flight.name, "in_flight"), flight.in_flight),
+            ((flight.name, "waiters"),   flight.waiters),
+        )
+    },
+)
+metrics.Counter(
+    "imagify_singleflight_total", "Uncached generations by role: started one (leader) or joined one (follower).",
+    ("op", "role"),
+    collect=lambda: {(flight.name, role): count for flight in FLIGHTS for role, count in flight.counters.items()},
+)
+metrics.Gauge(
+    "imagify_replicate_in_flight", "Replicate predictions holding a concurrency slot.",
+    collect=lambda: {(): replicate_client.in_flight()},
+)
+metrics.Gauge(
+    "imagify_job_queue_depth", "Background jobs waiting for a worker.",
+    collect=lambda: {(): job_queue.depth},
+)
+metrics.Counter(
+    "imagify_cache_lookups_total", "Result cache lookups by outcome.",
+    ("cache", "result"),
+    collect=lambda: {
+        key: value for cache in STORES for key, value in (
+            ((cache.name, "memory_hit"), cache.memory_hits),
+            ((cache.name, "disk_hit"),   cache.disk_hits),
+            ((cache.name, "miss"),       cache.misses),
+        )
+    },
+)
+metrics.Gauge(
+    "imagify_cache_hit_ratio", "Result cache hits / lookups since start.",
+    ("cache",),
+    collect=lambda: {(name,): stats["hit_rate"] for name, stats in scrape["caches"].items()},
+)
+metrics.Gauge(
+    "imagify_cache_bytes", "Result cache size by tier.",
+    ("cache", "tier"),
+    collect=lambda: {
+        key: value for name, stats in scrape["caches"].items() for key, value in (
+            ((name, "memory"), stats["memory_bytes"]),
+            ((name, "disk"),   stats["disk_bytes"]),
+        )
+    },
+)
+metrics.Gauge(
+    "imagify_enhance_sessions", "Live enhance sessions and the memory they hold.",
+    ("measure",),
+    collect=lambda: {
+        ("sessions",): enhance_sessions.stats()["sessions"],
+        ("bytes",):    enhance_sessions.nbytes,
+    },
+)
+metrics.Counter(
+    "imagify_enhance_session_stages_total", "Session render stages reused from the memo vs computed.",
+    ("result",),
+    collect=lambda: {
+        ("reused",):   enhance_sessions.counters["reused"],
+        ("computed",): enhance_sessions.counters["computed"],
+    },
+)
+metrics.Gauge(
+    "imagify_event_loop_lag_max_seconds", "Longest the event loop has been blocked since this worker started.",
+    collect=lambda: {(): metrics.loop_monitor.max_lag},
+)
+metrics.Gauge(
+    "imagify_startup_seconds", "Cold start of this worker: app import, and boot until ready to serve.",
+    ("phase",),
+    collect=lambda: {(phase,): startup[phase] for phase in ("import", "ready") if startup[phase] is not None},
+)
+metrics.Gauge(
+    "imagify_breaker_open", "1 while a circuit breaker rejects calls (open), 0.5 half-open, 0 closed.",
+    ("breaker",),
+    collect=lambda: {
+        (breaker.name,): {"open": 1, "half_open": 0.5}.get(breaker.state, 0) for breaker in BREAKERS
+    },
 )
 
 @app.get("/")
 def root():
     return {"message": "Imagify-Pro API running"}
 
+@app.get("/api/cache/stats")
+def cache_stats():
+    return {cache.name: cache.stats() for cache in STORES}
+
+@app.get("/api/breakers/stats")
+def breaker_stats():
+    return {breaker.name: breaker.stats() for breaker in BREAKERS}
+
+@app.get("/api/admission/stats")
+def admission_stats():
+    return {gate.name: gate.stats() for gate in GATES}
+
+@app.get("/metrics")
+def prometheus_metrics():
+    scrape["caches"] = cache_stats()
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 app.include_router(enhance.router)
 app.include_router(animate.router)
 app.include_router(video.router)
-
-RESULTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "results"))
+app.include_router(jobs.router)
 
 @app.get("/results/{filename}")
-def get_result(filename: str):
-    path = os.path.join(RESULTS_DIR, filename)
-    if not os.path.exists(path):
-        return {"detail": "file not found"}
-    return FileResponse(path)
+async def get_result(filename: str, request: Request):
+    key  = filename.split(".", 1)[0]
+    path = await file_store.apath(key) if key.isalnum() else None
+    if not path:
+        raise HTTPException(status_code=404, detail="file not found")
+    return await file_response(request, path, etag=key)
 
 if __name__ == "__main__":
     import uvicorn
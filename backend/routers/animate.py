@@ -1,51 +1,63 @@
 # backend/routers/animate.py
-import sys, os
-sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from typing import List
 import os
-import shutil
+import re
+import json
+import time
+import asyncio
+import zipfile
 from pathlib import Path
 
-from services import animator
+from services import animator, ingest, metrics
+from services.admission import smile_admission, queue_header, client_id
+from services.cache import smile_cache
+from services.store import file_response
 
 router = APIRouter()
 
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.jfif'}
+
+# Batch limits (env overrides)
+BATCH_MAX_ITEMS   = int(os.getenv("SMILE_BATCH_MAX_ITEMS", 100))
+BATCH_MAX_MB      = float(os.getenv("SMILE_BATCH_MAX_MB", 300))
+BATCH_CONCURRENCY = int(os.getenv("SMILE_BATCH_CONCURRENCY", 4))
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
 
 @router.post("/api/animate/smile")
-async def generate_smile(file: UploadFile = File(...)):
+async def generate_smile(request: Request, file: UploadFile = File(...)):
     
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided")
 
     # Validate file type
-    allowed_extensions = {'.jpg', '.jpeg', '.png', '.webp', '.jfif'}
     file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext not in allowed_extensions:
+    if file_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"
+            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
         )
 
-    # Save uploaded file
-    temp_dir = os.path.join(os.path.dirname(__file__), "..", "temp")
-    temp_dir = os.path.abspath(temp_dir)
-    os.makedirs(temp_dir, exist_ok=True)
-    input_path = os.path.join(temp_dir, file.filename)
-
     try:
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
         name, ext = os.path.splitext(file.filename)
         out_filename = f"smile_{name}"
 
         print(f" Processing: {file.filename}")
 
-        # ── ALWAYS call Replicate AI first (with retry) ──────────────────────
-        out_path = await animator.generate_smile_animation(
-            input_path, out_filename
-        )
+        # ── Rate limit, then wait for a slot (429 + Retry-After when full) ───
+        async with smile_admission.admit(request):
+            # ── Read the upload in place — no copy to temp/ and back ─────────
+            start = time.perf_counter()
+            with ingest.upload_buffer(file) as data:
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - start, op="smile", stage="upload_read")
+                with metrics.stage("smile", "probe"):
+                    ingest.probe(data)
+
+                # ── ALWAYS call Replicate AI first (with retry) ──────────────
+                out_path = await animator.generate_smile(data, out_filename)
 
         # ── Detect output format (Replicate returns webp,jpg) 
         out_ext = Path(out_path).suffix.lower()
@@ -57,17 +69,139 @@ async def generate_smile(file: UploadFile = File(...)):
         return FileResponse(
             out_path,
             media_type=media_type,
-            filename=download_name
+            filename=download_name,
+            headers=queue_header(request)
         )
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         print(f" Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-    finally:
-        # Clean up input file
-        if os.path.exists(input_path):
+
+@router.post("/api/animate/smile/batch")
+async def generate_smile_batch(request: Request, files: List[UploadFile] = File(...)):
+    """
+    Smile a whole album: any number of image files and/or .zip archives of
+    images. Items run concurrently (at most SMILE_BATCH_CONCURRENCY at a time)
+    and results stream back as NDJSON, one line per item in completion order:
+
+        {"index": 0, "filename": "a.jpg", "status": "succeeded", "result_url": "..."}
+        {"index": 1, "filename": "b.png", "status": "failed", "error": "..."}
+
+    followed by a final {"status": "done", ...} summary line. A failed item
+    does not fail the batch.
+
+    The batch goes through the smile route's admission gate: starting it
+    takes one of the client's tokens (429 when there is none), every further
+    item waits for a token of its own, and each item holds a smile slot
+    while it runs — an item that can't get one fails with the gate's reason.
+    """
+    client = client_id(request)
+    await smile_admission.check_rate(client)
+
+    # Limits are checked against the spooled (and declared zip entry) sizes
+    # before anything is read into memory
+    max_bytes = BATCH_MAX_MB * 1024 * 1024
+    items, total = [], 0
+    for file in files:
+        if os.path.splitext(file.filename or "")[1].lower() == ".zip":
+            entries, size = await asyncio.to_thread(
+                _read_zip, file.file, BATCH_MAX_ITEMS - len(items), max_bytes - total
+            )
+            items.extend(entries)
+            total += size
+            continue
+
+        total += ingest.upload_size(file)
+        if len(items) >= BATCH_MAX_ITEMS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Too many images ({len(items) + 1}+). Max per batch: {BATCH_MAX_ITEMS}"
+            )
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Batch larger than {BATCH_MAX_MB:.0f}MB")
+        items.append((file.filename or "", await file.read()))
+
+    if not items:
+        raise HTTPException(status_code=400, detail="No images in upload")
+
+    print(f" Batch of {len(items)} image(s)")
+    return StreamingResponse(_run_batch(items, client), media_type="application/x-ndjson")
+
+
+@router.get("/api/animate/smile/results/{key}")
+async def get_smile_result(key: str, request: Request):
+    path = await smile_cache.apath(key) if _KEY_RE.match(key) else None
+    if not path:
+        raise HTTPException(status_code=404, detail="Result not found")
+    return await file_response(request, path, media_type="image/webp", etag=key)
+
+
+def _read_zip(fileobj, max_items: int, max_bytes: float) -> tuple:
+    """(filename, bytes) for every entry of an uploaded zip, hidden files
+    skipped, and their total size; 413 past max_items or max_bytes."""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid zip file")
+
+    items, total = [], 0
+    with archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name or name.startswith(".") or "__MACOSX" in info.filename:
+                continue
+            # Check the declared sizes before inflating anything
+            total += info.file_size
+            if len(items) >= max_items or total > max_bytes:
+                raise HTTPException(status_code=413, detail="Zip holds too many or too large images")
+            items.append((name, archive.read(info)))
+    return items, total
+
+
+async def _run_batch(items: list, client: str):
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    prepaid   = True  # the token generate_smile_batch took
+
+    async def run_item(index: int, filename: str, data: bytes) -> dict:
+        nonlocal prepaid
+        result = {"index": index, "filename": filename}
+        if os.path.splitext(filename)[1].lower() not in ALLOWED_EXTENSIONS:
+            return {**result, "status": "failed", "error": "Unsupported file type"}
+        async with semaphore:
             try:
-                os.remove(input_path)
-            except:
-                pass
\ No newline at end of file
+                if len(data) > ingest.MAX_UPLOAD_BYTES:
+                    raise Exception(f"Larger than {ingest.MAX_UPLOAD_MB:.0f}MB")
+                ingest.probe(data)
+                if prepaid:
+                    prepaid = False
+                else:
+                    await smile_admission.wait_rate(client)
+                async with smile_admission.slot():
+                    path = await animator.smile_from_bytes(data)
+            except HTTPException as e:
+                return {**result, "status": "failed", "error": e.detail}
+            except Exception as e:
+                print(f" Batch item {index} ({filename}) failed: {e}")
+                return {**result, "status": "failed", "error": str(e)}
+        key = Path(path).name.split(".", 1)[0]
+        return {**result, "status": "succeeded", "result_url": f"/api/animate/smile/results/{key}"}
+
+    tasks = [asyncio.create_task(run_item(i, name, data)) for i, (name, data) in enumerate(items)]
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            succeeded += result["status"] == "succeeded"
+            yield json.dumps(result) + "\n"
+        yield json.dumps({
+            "status": "done", "total": len(items),
+            "succeeded": succeeded, "failed": len(items) - succeeded,
+        }) + "\n"
+    finally:
+        # Client went away mid-batch: stop (and remotely cancel) the rest
+        for task in tasks:
+            task.cancel()
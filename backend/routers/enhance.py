@@ -1,72 +1,284 @@
-import sys, os
-sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
-from fastapi import APIRouter, UploadFile, File, Query
-from PIL import Image, ImageEnhance, ImageFilter
-import io
+from fastapi import APIRouter, UploadFile, File, Query, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response
 import base64
+import json
+import io
+import time
+from typing import Optional
+
+from services import enhancer, ingest, pipeline, metrics
+from services.cache import enhance_cache, acache_key, derive_key
+from services.pool import enhance_pool, thumbnail_pool, session_pool, http_errors
+from services.sessions import enhance_sessions
 
 router = APIRouter()
 
+STREAM_CHUNK = 64 * 1024
+BASE64_CHUNK = 48 * 1024  # a multiple of 3: each slice encodes without padding
+
+
 @router.post("/api/enhance/")
 async def enhance(
     file: UploadFile = File(...),
     enh: float = Query(50, ge=0, le=100),
     sharp: float = Query(50, ge=0, le=100),
-    clarity: float = Query(50, ge=0, le=100)
+    clarity: float = Query(50, ge=0, le=100),
+    tiled: Optional[bool] = Query(None),
+    fmt: str = Query("png", alias="format", pattern="^(png|jpeg|webp)$"),
+    quality: int = Query(90, ge=1, le=100),
+    binary: bool = Query(False),
+    preview: bool = Query(False),
+    accept: Optional[str] = Header(None)
+):
+    settings, params = _settings(enh, sharp, clarity, fmt, quality, preview)
+    quality = params["quality"]
+    op = "preview" if preview else "enhance"
+
+    # ─── Read the spooled upload in place; reject bad/huge images early ──────
+    start = time.perf_counter()
+    with ingest.upload_buffer(file) as data:
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - start, op=op, stage="upload_read")
+        with metrics.stage(op, "probe"):
+            ingest.probe(data)
+
+        # ─── Identical upload + settings → cached result ─────────────────────
+        with metrics.stage(op, "cache_lookup"):
+            key = await acache_key(data, **params)
+            result = await enhance_cache.aget(key)
+
+        # The one copy we need: the bytes have to be pickled over to a worker
+        image_bytes = bytes(data) if result is None else None
+
+    # ─── Live preview: decoded straight to preview size, a few ms ────────────
+    # Runs in the thumbnail pool rather than queueing behind full-size jobs
+    if result is None and preview:
+        result = await _run_preview(image_bytes, enh, sharp, clarity, fmt, quality or 90)
+        await enhance_cache.aput(key, result, suffix=f".{fmt}")
+
+    if result is None:
+        result = await _run_pipeline(image_bytes, enh, sharp, clarity, tiled, fmt, quality or 90)
+        await enhance_cache.aput(key, result, suffix=f".{fmt}")
+
+    return _respond(result, fmt, settings, binary or (accept or "").startswith("image/"), op)
+
+
+@router.post("/api/enhance/upscale")
+async def upscale(
+    file: UploadFile = File(...),
+    scale: float = Query(2.0, ge=enhancer.MIN_SCALE, le=enhancer.MAX_SCALE),
+    method: str = Query("lanczos", pattern="^(lanczos|bicubic|edge)$"),
+    fmt: str = Query("jpeg", alias="format", pattern="^(png|jpeg|webp)$"),
+    quality: int = Query(90, ge=1, le=100),
+    subsampling: Optional[str] = Query(None, pattern="^4:(4:4|2:2|2:0)$"),
+    progressive: bool = Query(False),
+    compress_level: int = Query(6, ge=0, le=9),
+    binary: bool = Query(False),
+    accept: Optional[str] = Header(None)
 ):
-    image = Image.open(io.BytesIO(await file.read())).convert("RGB")
-
-    # ─── 1. BRIGHTNESS ───────────────────────────────────────────────────────
-    if enh != 50:
-        brightness_factor = 1.0 + (enh - 50) * 0.008
-        image = ImageEnhance.Brightness(image).enhance(brightness_factor)
-
-    # ─── 2. CONTRAST ─────────────────────────────────────────────────────────
-    if enh != 50:
-        contrast_factor = 1.0 + (enh - 50) * 0.012
-        image = ImageEnhance.Contrast(image).enhance(contrast_factor)
-
-    # ─── 3. VIBRANCE (via Pillow Color enhancer) ─────────────────────────────
-    if enh != 50:
-        vibrance_factor = 1.0 + (enh - 50) * 0.006
-        image = ImageEnhance.Color(image).enhance(max(0.0, vibrance_factor))
-
-    # ─── 4. SHARPNESS ────────────────────────────────────────────────────────
-    if sharp != 50:
-        sharp_factor = 1.0 + (sharp - 50) * 0.06
-        image = ImageEnhance.Sharpness(image).enhance(max(0.0, sharp_factor))
-
-    # ─── 5. CLARITY (multi-pass unsharp via Pillow filters) ──────────────────
-    if clarity != 50:
-        passes = int(1 + (abs(clarity - 50) / 25))  # 1–3 passes based on strength
-        for _ in range(passes):
-            image = image.filter(ImageFilter.UnsharpMask(
-                radius=2,
-                percent=int((clarity - 50) * 3),
-                threshold=2
-            ))
-
-        if clarity > 70:
-            image = image.filter(ImageFilter.SHARPEN)
-            image = image.filter(ImageFilter.DETAIL)
-        if clarity > 85:
-            image = image.filter(ImageFilter.SHARPEN)
-
-    # ─── 6. NOISE REDUCTION ──────────────────────────────────────────────────
-    if enh > 70 or sharp > 70 or clarity > 70:
-        image = image.filter(ImageFilter.SMOOTH)
-
-    # ─── Convert to Base64 ───────────────────────────────────────────────────
-    buffer = io.BytesIO()
-    image.save(buffer, format="PNG", optimize=True)
-    base64_img = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    """
+    Resize an image by an arbitrary factor (2 and 4 are the usual upscales).
+    Large outputs are rendered in strips across several cores, within the
+    engine's memory budget. JPEG accepts quality, chroma subsampling and
+    progressive; WebP accepts quality; PNG accepts compress_level.
+    """
+    settings = {"scale": scale, "method": method}
+    params = {"op": "upscale", "scale": scale, "method": method, "format": fmt}
+    if fmt == "png":
+        params["compress_level"] = compress_level
+    else:
+        params["quality"] = quality
+    if fmt == "jpeg":
+        params.update(subsampling=subsampling, progressive=progressive)
+    op = "upscale"
+
+    start = time.perf_counter()
+    with ingest.upload_buffer(file) as data:
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - start, op=op, stage="upload_read")
+        with metrics.stage(op, "probe"):
+            _, width, height = ingest.probe(data)
+        try:
+            width, height = enhancer.check_output(width, height, scale, fmt)
+        except ValueError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        settings.update(width=width, height=height)
+
+        with metrics.stage(op, "cache_lookup"):
+            key = await acache_key(data, **params)
+            result = await enhance_cache.aget(key)
+        image_bytes = bytes(data) if result is None else None
+
+    if result is None:
+        start = time.perf_counter()
+        with http_errors("Enhance", "Upscale"):
+            result, timings, worker_seconds = await enhance_pool.run(
+                pipeline.timed, enhancer.enhance_image, image_bytes, scale, method, fmt,
+                quality, subsampling, progressive, compress_level
+            )
+        metrics.observe_stages(op, timings)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - start - worker_seconds, op=op, stage="pool_wait")
+        await enhance_cache.aput(key, result, suffix=f".{fmt}")
 
+    return _respond(result, fmt, settings, binary or (accept or "").startswith("image/"), op)
+
+
+@router.post("/api/enhance/sessions", status_code=201)
+async def create_session(file: UploadFile = File(...)):
+    """
+    Upload an image once for interactive editing. The decoded image stays on
+    the server; render it with GET /api/enhance/sessions/{session_id} and the
+    usual enhance query parameters. Only the stages downstream of a changed
+    slider are recomputed. Sessions expire after a period of inactivity.
+    """
+    with ingest.upload_buffer(file) as data:
+        ingest.probe(data)
+        # Its own copy: a decode that times out runs on past this block
+        image_bytes = bytes(data)
+
+    # Bounded like renders: 429 when the session queue is full
+    with http_errors("Enhance", "Decoding the image"):
+        session = await session_pool.run(enhance_sessions.decode, image_bytes)
+    await enhance_sessions.add(session, image_bytes)
+
+    width, height = session.size
     return {
-        "status": "success",
-        "image": base64_img,
-        "settings": {
-            "enhancement": enh,
-            "sharpness": sharp,
-            "clarity": clarity
+        "session_id": session.id,
+        "width": width,
+        "height": height,
+        "expires_in": enhance_sessions.ttl
+    }
+
+
+@router.get("/api/enhance/sessions/{session_id}")
+async def render_session(
+    session_id: str,
+    request: Request,
+    enh: float = Query(50, ge=0, le=100),
+    sharp: float = Query(50, ge=0, le=100),
+    clarity: float = Query(50, ge=0, le=100),
+    fmt: str = Query("png", alias="format", pattern="^(png|jpeg|webp)$"),
+    quality: int = Query(90, ge=1, le=100),
+    binary: bool = Query(False),
+    preview: bool = Query(False),
+    accept: Optional[str] = Header(None)
+):
+    session = await enhance_sessions.load(session_id)
+    settings, params = _settings(enh, sharp, clarity, fmt, quality, preview)
+    quality = params["quality"]
+    op = "session_preview" if preview else "session"
+
+    # Same key as the stateless route would use for this upload + settings
+    as_binary = binary or (accept or "").startswith("image/")
+    key  = derive_key(session.digest, **params)
+    etag = f'"{key}"' if as_binary else f'"{key}-json"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    result = await enhance_cache.aget(key)
+    if result is None:
+        # In this process's threads (the session's images live here), with the
+        # enhance pool's bounded queue: 429 when full, 504 past the timeout
+        start = time.perf_counter()
+        with http_errors("Enhance", "Enhancement"):
+            result, timings, worker_seconds = await session_pool.run(
+                pipeline.timed, session.render_bytes,
+                "preview" if preview else "full", enh, sharp, clarity, fmt, quality or 90
+            )
+        metrics.observe_stages(op, timings)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - start - worker_seconds, op=op, stage="pool_wait")
+        await enhance_cache.aput(key, result, suffix=f".{fmt}")
+        enhance_sessions.sweep()  # memoized stages grew the session
+
+    return _respond(result, fmt, settings, as_binary, op, headers={"ETag": etag})
+
+
+@router.delete("/api/enhance/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str):
+    if not await enhance_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Enhance session not found or expired")
+
+
+def _settings(enh: float, sharp: float, clarity: float, fmt: str, quality: int, preview: bool):
+    """Settings echoed to the client, and the parameters that key the cache."""
+    settings = {
+        "enhancement": enh,
+        "sharpness": sharp,
+        "clarity": clarity
+    }
+    if fmt == "png":
+        quality = None  # lossless — quality has no effect on the output
+    params = {"enh": enh, "sharp": sharp, "clarity": clarity, "format": fmt, "quality": quality}
+    if preview:
+        settings["preview"] = True
+        params["preview"] = pipeline.PREVIEW_MAX_SIZE
+    return settings, params
+
+
+def _respond(result: bytes, fmt: str, settings: dict, binary: bool, op: str, headers: dict = None):
+    # ─── Binary mode: raw image bytes, settings in a header ──────────────────
+    if binary:
+        return StreamingResponse(
+            _chunks(result),
+            media_type=pipeline.OUTPUT_FORMATS[fmt],
+            headers={
+                "Content-Length": str(len(result)),
+                "X-Enhance-Settings": json.dumps(settings),
+                **(headers or {}),
+            }
+        )
+
+    # ─── JSON with the image in Base64, encoded as it streams ────────────────
+    # Base64 needs no JSON escaping, so the body is written around it rather
+    # than built and serialized whole on the event loop
+    head = b'{"status":"success","image":"'
+    tail = f'","format":{json.dumps(fmt)},"settings":{json.dumps(settings)}}}'.encode()
+    return StreamingResponse(
+        _base64_chunks(result, head, tail),
+        media_type="application/json",
+        headers={
+            "Content-Length": str(len(head) + (len(result) + 2) // 3 * 4 + len(tail)),
+            **(headers or {}),
         }
-    }
\ No newline at end of file
+    )
+
+
+def _chunks(data: bytes):
+    view = memoryview(data)
+    for start in range(0, len(view), STREAM_CHUNK):
+        yield view[start:start + STREAM_CHUNK]
+
+
+def _base64_chunks(data: bytes, head: bytes, tail: bytes):
+    yield head
+    view = memoryview(data)
+    for start in range(0, len(view), BASE64_CHUNK):
+        yield base64.b64encode(view[start:start + BASE64_CHUNK])
+    yield tail
+
+
+async def _run_preview(image_bytes: bytes, enh: float, sharp: float, clarity: float,
+                       fmt: str, quality: int) -> bytes:
+    start = time.perf_counter()
+    with http_errors("Preview", "Preview"):
+        result, timings, worker_seconds = await thumbnail_pool.run(
+            pipeline.timed, pipeline.preview_bytes, io.BytesIO(image_bytes), enh, sharp, clarity, fmt, quality
+        )
+
+    metrics.observe_stages("preview", timings)
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - start - worker_seconds, op="preview", stage="pool_wait")
+    return result
+
+
+async def _run_pipeline(image_bytes: bytes, enh: float, sharp: float, clarity: float,
+                        tiled, fmt: str, quality: int) -> bytes:
+    # ─── Filter chain + encode run in the worker pool, off the event loop ────
+    # tiled=None lets the worker pick strip-wise processing for huge images
+    start = time.perf_counter()
+    with http_errors("Enhance", "Enhancement"):
+        result, timings, worker_seconds = await enhance_pool.run(
+            pipeline.timed, pipeline.enhance_bytes, image_bytes, enh, sharp, clarity, tiled, fmt, quality
+        )
+
+    # Whatever the worker didn't spend running is queueing plus pickling
+    metrics.observe_stages("enhance", timings)
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - start - worker_seconds, op="enhance", stage="pool_wait")
+    return result
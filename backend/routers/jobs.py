@@ -0,0 +1,42 @@
+# backend/routers/jobs.py
+import os
+
+from fastapi import APIRouter, HTTPException, Query, Request
+
+from routers.video import check_variant, serve_variant
+from services.jobs import job_queue, public_view, SUCCEEDED
+from services.store import file_response
+from services import fileio, transcode
+
+router = APIRouter()
+
+RESULT_MEDIA_TYPES = {"video": ("video/mp4", "animated_video.mp4")}
+
+
+@router.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_view(job)
+
+
+@router.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str, request: Request, variant: str = Query(transcode.ORIGINAL)):
+    """The job's result file; video jobs take ?variant= like /api/animate/video."""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if not job["result_path"] or not await fileio.run(os.path.exists, job["result_path"]):
+        raise HTTPException(status_code=410, detail="Job result has expired")
+
+    if variant != transcode.ORIGINAL and job["kind"] == "video":
+        check_variant(variant)
+        # Cached results are stored as <key><suffix>
+        key = os.path.splitext(os.path.basename(job["result_path"]))[0]
+        return await serve_variant(request, key, job["result_path"], variant)
+
+    media_type, filename = RESULT_MEDIA_TYPES[job["kind"]]
+    return await file_response(request, job["result_path"], media_type=media_type, filename=filename)
@@ -2,203 +2,397 @@
 Video Generation Router - UPDATED VERSION
 Uses wan-video/wan-2.2-i2v-fast (faster ~39 seconds)
 """
-import sys, os
-sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
-from fastapi import APIRouter, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse
-from starlette.background import BackgroundTask
-import replicate
+from fastapi import APIRouter, File, UploadFile, Form, Query, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from typing import Optional
 import os
-import tempfile
-import requests
+import asyncio
 import time
+import logging
+
+from services.cache import video_cache, acache_key
+from services.jobs import job_queue, public_view, InvalidCallback
+from services.http_client import get_client, CHUNK_SIZE
+from services import fileio, ingest, replicate_client, resilience, metrics, transcode
+from services.resilience import video_breaker
+from services.admission import video_admission, queue_header, client_id
+from services.singleflight import video_flights
+from services.pool import http_errors
+from services.store import file_response
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-# Set your Replicate API token
-REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN", "")
+VIDEO_MODEL = "wan-video/wan-2.2-i2v-fast"
+VIDEO_INPUT = {
+    "prompt": "person with natural smile, eyes blinking gently, slight head movement, looking at camera, realistic, smooth motion",
+    "negative_prompt": "distorted face, blurry, artifacts, unnatural movement",
+    "resolution": "480p",
+    "num_frames": 81,
+}
 
-if REPLICATE_API_TOKEN:
-    os.environ["REPLICATE_API_TOKEN"] = REPLICATE_API_TOKEN
+# Generation normally takes ~40s; past this the remote prediction is cancelled.
+# The timeout covers all attempts, retries included.
+VIDEO_TIMEOUT  = float(os.getenv("VIDEO_TIMEOUT", 300))
+VIDEO_ATTEMPTS = int(os.getenv("VIDEO_ATTEMPTS", 2))
 
 
 @router.post("/api/animate/video")
-async def generate_video(file: UploadFile = File(...)):
+async def generate_video(request: Request, file: UploadFile = File(...),
+                         variant: str = Query(transcode.ORIGINAL)):
     """
     Generate video with blinking, smile and head movement from a face image.
     Uses wan-video/wan-2.2-i2v-fast model (~39 seconds)
+
+    The MP4 is streamed from Replicate straight to the client while being
+    written to the result cache, so memory use doesn't grow with video size.
+    The admission slot covers the generation; the download that follows
+    doesn't hold it.
+
+    ?variant=poster|preview|mobile returns a smaller rendition instead (a
+    JPEG frame, an animated WebP, a 360p MP4), see services/transcode.py.
+    """
+
+    check_token()
+    check_variant(variant)
+
+    # ── Rate limit, then wait for a slot (429 + Retry-After when full) ─────
+    async with video_admission.admit(request):
+        # ── Read the spooled upload in place: no temp file for the input ───
+        start = time.perf_counter()
+        with ingest.upload_buffer(file) as data:
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - start, op="video", stage="upload_read")
+            with metrics.stage("video", "probe"):
+                ingest.probe(data)
+
+            # ── Same image + same model/prompt → cached video ────────────────
+            with metrics.stage("video", "cache_lookup"):
+                key = await video_key(data)
+                cached_path = await video_cache.apath(key)
+            if cached_path and variant == transcode.ORIGINAL:
+                logger.info(f"Cache hit: {cached_path}")
+                return FileResponse(
+                    cached_path,
+                    media_type="video/mp4",
+                    filename="animated_video.mp4",
+                    headers=queue_header(request)
+                )
+
+            if not cached_path:
+                # Identical uploads in flight share one prediction; each request
+                # then downloads the output itself. The flight gets its own copy
+                # of the image, since it may outlive this request's upload buffer.
+                video_url = await video_flights.run(key, lambda: run_model(bytes(data)))
+
+    if variant != transcode.ORIGINAL:
+        # Variants are cut from the whole file, so download it to the cache first
+        if not cached_path:
+            cached_path = await download_video(key, video_url)
+        return await serve_variant(request, key, cached_path, variant)
+
+    upstream = await open_download(video_url)
+
+    headers = {"Content-Disposition": 'attachment; filename="animated_video.mp4"', **queue_header(request)}
+    if "content-length" in upstream.headers:
+        headers["Content-Length"] = upstream.headers["content-length"]
+
+    return StreamingResponse(
+        _stream_and_cache(upstream, key),
+        media_type="video/mp4",
+        headers=headers
+    )
+
+
+@router.post("/api/animate/video/jobs", status_code=202)
+async def submit_video_job(request: Request, file: UploadFile = File(...),
+                           callback_url: Optional[str] = Form(None)):
+    """
+    Queue a video generation and return its job id immediately.
+    Poll GET /api/jobs/{job_id}, or pass callback_url to get the final job
+    status POSTed to you when it finishes (http/https to a public host, or
+    422). Submissions spend the same per-client tokens as
+    /api/animate/video; the job workers bound the concurrency.
     """
 
-    if not REPLICATE_API_TOKEN:
+    check_token()
+    await video_admission.check_rate(client_id(request))
+
+    with ingest.upload_buffer(file) as data:
+        ingest.probe(data)
+        try:
+            job_id = await job_queue.submit("video", data, suffix=".jpg", callback_url=callback_url)
+        except InvalidCallback as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return public_view(await job_queue.get(job_id))
+
+
+def check_token():
+    try:
+        replicate_client.get_token()
+    except Exception:
         raise HTTPException(
             status_code=500,
             detail="REPLICATE_API_TOKEN not set. Please set your API token in environment variables."
         )
 
-    temp_input_path = None
+
+def check_variant(variant: str):
+    if variant != transcode.ORIGINAL and variant not in transcode.VARIANTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid variant. Allowed: {', '.join([transcode.ORIGINAL, *transcode.VARIANTS])}"
+        )
+    if variant != transcode.ORIGINAL and not transcode.available():
+        raise HTTPException(status_code=501, detail="Video variants need ffmpeg, which is not installed")
+
+
+async def serve_variant(request: Request, key: str, original_path: str, variant: str):
+    """Response with one variant of the cached video under key, made on first use."""
+    try:
+        with http_errors("Video transcode", f"Making the {variant} variant"):
+            path = await transcode.variant_path(key, original_path, variant)
+    except transcode.TranscodeFailed as e:
+        logger.warning(f"Video variant failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to make the {variant} variant: {e}")
+
+    spec = transcode.VARIANTS[variant]
+    response = await file_response(request, path, media_type=spec["media_type"], filename=spec["filename"],
+                                   etag=transcode.variant_key(key, variant))
+    response.headers.update(queue_header(request))
+    return response
+
+
+async def video_key(image_bytes) -> str:
+    return await acache_key(image_bytes, model=VIDEO_MODEL, **VIDEO_INPUT)
+
+
+async def render_video(input_path: str) -> str:
+    """
+    Path of the generated video for this image — from the result cache when
+    the same image was animated before, otherwise via Replicate, downloaded
+    chunk by chunk into the cache.
+    """
+    image_bytes = await fileio.read_bytes(input_path)
+
+    key = await video_key(image_bytes)
+    cached_path = await video_cache.apath(key)
+    if cached_path:
+        logger.info(f"Cache hit: {cached_path}")
+        return cached_path
+
+    video_url = await video_flights.run(key, lambda: run_model(image_bytes))
+    return await download_video(key, video_url)
+
+
+async def download_video(key: str, video_url: str) -> str:
+    """Download a generated video chunk by chunk into the result cache; returns its path."""
+    import httpx
+
+    upstream = await open_download(video_url)
+
     temp_output_path = None
+    start = time.perf_counter()
+    try:
+        async with fileio.TempWriter(suffix=".mp4") as temp_output:
+            temp_output_path = temp_output.path
+            async for chunk in upstream.aiter_bytes(CHUNK_SIZE):
+                await temp_output.write(chunk)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - start, op="video", stage="download")
+        logger.info(f"Video saved to: {temp_output_path}")
+
+        video_path = await video_cache.aput_file(key, temp_output_path, suffix=".mp4")
+        temp_output_path = None
+        return video_path
+
+    except httpx.HTTPError as e:
+        logger.warning(f"Error downloading video: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to download video: {str(e)}"
+        )
+    finally:
+        await upstream.aclose()
+        await cleanup_temp_files(temp_output_path)
+
+
+async def run_model(image_bytes) -> str:
+    """Run the video model and return the output URL. Errors become HTTPExceptions."""
+    from replicate.exceptions import ModelError, ReplicateException
+
+    logger.info(f"Processing image: {len(image_bytes) // 1024}KB")
+    logger.info("Starting video generation with Wan 2.2 Fast...")
 
     try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_input:
-            content = await file.read()
-            temp_input.write(content)
-            temp_input_path = temp_input.name
-
-        print(f"Processing image: {temp_input_path}")
-        print("Starting video generation with Wan 2.2 Fast...")
-
-        # Open the file for Replicate
-        with open(temp_input_path, "rb") as image_file:
-            print("Calling Replicate API...")
-
-            output = replicate.run(
-                "wan-video/wan-2.2-i2v-fast",
-                input={
-                    "image": image_file,
-                    "prompt": "person with natural smile, eyes blinking gently, slight head movement, looking at camera, realistic, smooth motion",
-                    "negative_prompt": "distorted face, blurry, artifacts, unnatural movement",
-                    "resolution": "480p",
-                    "num_frames": 81,
-                }
-            )
-
-        print(f"Video generation completed!")
-        print(f"Output: {output}")
-
-        # ── Extract video URL (handles all output types) ──────────────────────
-        video_url = None
-
-        if isinstance(output, str) and output.startswith('http'):
-            # Direct string URL
-            video_url = output
-        elif isinstance(output, list) and len(output) > 0:
-            # List of URLs or file objects
-            video_url = str(output[0])
-        elif hasattr(output, 'url'):
-            # Object with url attribute
-            video_url = output.url
-        elif hasattr(output, '__iter__'):
-            # Iterable - try to get first item
-            for item in output:
-                video_url = str(item)
-                if video_url.startswith('http'):
-                    break
-
-        # Last resort - convert to string
-        if not video_url:
-            video_url = str(output)
-
-        if not video_url or not video_url.startswith('http'):
-            raise HTTPException(
-                status_code=500,
-                detail=f"Could not extract video URL. Output: {output}"
-            )
-
-        print(f"Downloading video from: {video_url}")
-
-        # Download the generated video
-        video_response = requests.get(video_url, timeout=180)
-        video_response.raise_for_status()
-
-        print(f"Video downloaded! Size: {len(video_response.content)} bytes")
-
-        # Save video to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_output:
-            temp_output.write(video_response.content)
-            temp_output_path = temp_output.name
-
-        print(f"Video saved to: {temp_output_path}")
-
-        # Clean up input file
-        if temp_input_path and os.path.exists(temp_input_path):
-            try:
-                time.sleep(0.1)
-                os.unlink(temp_input_path)
-            except PermissionError:
-                print(f"Warning: Could not delete input file: {temp_input_path}")
-
-        # Return the video file
-        def cleanup_file(path):
-            try:
-                if os.path.exists(path):
-                    time.sleep(0.5)
-                    os.unlink(path)
-            except Exception as e:
-                print(f"Cleanup error: {e}")
-
-        return FileResponse(
-            temp_output_path,
-            media_type="video/mp4",
-            filename="animated_video.mp4",
-            background=BackgroundTask(cleanup_file, temp_output_path)
+        logger.info("Calling Replicate API...")
+        output = await resilience.call(
+            _predict, image_bytes,
+            breaker=video_breaker,
+            attempts=VIDEO_ATTEMPTS,
+            deadline=VIDEO_TIMEOUT,
         )
 
-    except replicate.exceptions.ReplicateError as e:
+    except resilience.CircuitOpen as e:
+        logger.warning(f"Video generation skipped: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Video generation is temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": str(int(e.retry_after))},
+        )
+
+    except asyncio.TimeoutError:
+        logger.warning(f"Video generation timed out after {VIDEO_TIMEOUT}s")
+        raise HTTPException(
+            status_code=504,
+            detail=f"Video generation timed out after {VIDEO_TIMEOUT:.0f}s"
+        )
+
+    except ReplicateException as e:
         error_msg = str(e)
-        print(f"Replicate API error: {error_msg}")
-        cleanup_temp_files(temp_input_path, temp_output_path)
+        status    = resilience.status_of(e)
+        logger.warning(f"Replicate API error: {error_msg}")
 
-        if "401" in error_msg or "authentication" in error_msg.lower():
+        if status == 401:
             detail = "Invalid API token. Please check your REPLICATE_API_TOKEN."
-        elif "402" in error_msg or "payment" in error_msg.lower():
+        elif status == 402:
             detail = "Insufficient credits. Please add credits to your Replicate account."
-        elif "404" in error_msg:
+        elif status == 404:
             detail = "Model not found. Check your internet connection."
-        elif "422" in error_msg:
+        elif status == 422 or isinstance(e, ModelError):
             detail = f"Input validation failed: {error_msg}"
         else:
             detail = f"Replicate API error: {error_msg}"
 
         raise HTTPException(status_code=500, detail=detail)
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading video: {e}")
-        cleanup_temp_files(temp_input_path, temp_output_path)
+    except Exception as e:
+        logger.warning(f"Unexpected error: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to generate video: {str(e)}"
+        )
+
+    logger.info("Video generation completed!")
+    logger.info(f"Output: {output}")
+    return _extract_video_url(output)
+
+
+async def _predict(image_bytes):
+    # A fresh reader per attempt: a retry must upload the image from the start
+    with ingest.BufferReader(image_bytes, name="image.jpg") as image_file:
+        return await replicate_client.run(
+            VIDEO_MODEL,
+            {"image": image_file, **VIDEO_INPUT},
+            timeout=VIDEO_TIMEOUT,
+        )
+
+
+async def open_download(video_url: str) -> "httpx.Response":
+    """Start streaming the generated video over the shared connection pool."""
+    import httpx
+
+    logger.info(f"Downloading video from: {video_url}")
+
+    client = get_client()
+    response = None
+    try:
+        response = await client.send(client.build_request("GET", video_url), stream=True)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        if response is not None:
+            await response.aclose()
+        logger.warning(f"Error downloading video: {e}")
         raise HTTPException(
             status_code=500,
             detail=f"Failed to download video: {str(e)}"
         )
+    return response
 
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        import traceback
-        traceback.print_exc()
-        cleanup_temp_files(temp_input_path, temp_output_path)
+
+async def _stream_and_cache(upstream: "httpx.Response", key: str):
+    """Relay upstream chunks to the client, tee-ing them into the result cache."""
+    temp_output_path = None
+    complete = False
+    start = time.perf_counter()
+    try:
+        async with fileio.TempWriter(suffix=".mp4") as temp_output:
+            temp_output_path = temp_output.path
+            async for chunk in upstream.aiter_bytes(CHUNK_SIZE):
+                await temp_output.write(chunk)
+                yield chunk
+        complete = True
+    finally:
+        await upstream.aclose()
+        if complete:
+            # Paced by the client as well as by Replicate's CDN
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - start, op="video", stage="download")
+            await video_cache.aput_file(key, temp_output_path, suffix=".mp4")
+            logger.info(f"Video streamed and cached: {key}")
+        else:
+            # Client went away or upstream failed — don't cache a partial file
+            await cleanup_temp_files(temp_output_path)
+
+
+def _extract_video_url(output) -> str:
+    """Extract video URL (handles all output types)"""
+    video_url = None
+
+    if isinstance(output, str) and output.startswith('http'):
+        # Direct string URL
+        video_url = output
+    elif isinstance(output, list) and len(output) > 0:
+        # List of URLs or file objects
+        video_url = str(output[0])
+    elif hasattr(output, 'url'):
+        # Object with url attribute
+        video_url = output.url
+    elif hasattr(output, '__iter__'):
+        # Iterable - try to get first item
+        for item in output:
+            video_url = str(item)
+            if video_url.startswith('http'):
+                break
+
+    # Last resort - convert to string
+    if not video_url:
+        video_url = str(output)
+
+    if not video_url or not video_url.startswith('http'):
         raise HTTPException(
             status_code=500,
-            detail=f"Failed to generate video: {str(e)}"
+            detail=f"Could not extract video URL. Output: {output}"
         )
 
+    return video_url
+
+
+job_queue.register("video", render_video)
+
 
-def cleanup_temp_files(input_path, output_path):
-    """Helper function to cleanup temporary files (Windows-safe)"""
-    for path in [input_path, output_path]:
-        if path and os.path.exists(path):
-            try:
-                time.sleep(0.1)
-                os.unlink(path)
-            except Exception as e:
-                print(f"Cleanup error for {path}: {e}")
+async def cleanup_temp_files(*paths):
+    """Delete temp files off the event loop. Callers close their handles
+    first, so no retry delay is needed on Windows either."""
+    await fileio.remove(*paths)
 
 
 @router.get("/api/animate/test")
 async def test_replicate_connection():
     """Test if Replicate API token works"""
     try:
-        if not REPLICATE_API_TOKEN:
+        if not os.getenv("REPLICATE_API_TOKEN"):
             return {
                 "status": "error",
                 "message": "REPLICATE_API_TOKEN not set",
                 "solution": "Set the environment variable with your Replicate API token"
             }
 
-        model = replicate.models.get("wan-video/wan-2.2-i2v-fast")
+        await replicate_client.get_client().models.async_get(VIDEO_MODEL)
 
         return {
             "status": "success",
             "message": "Replicate API token is valid and model exists!",
-            "model": "wan-video/wan-2.2-i2v-fast",
+            "model": VIDEO_MODEL,
             "estimated_time": "~39 seconds"
         }
 
@@ -214,7 +408,7 @@ async def test_replicate_connection():
 async def get_model_info():
     """Get information about the video generation model"""
     return {
-        "model": "wan-video/wan-2.2-i2v-fast",
+        "model": VIDEO_MODEL,
         "description": "Fast image-to-video generation with natural face animation",
         "features": [
             "Natural eye blinking",
@@ -224,9 +418,6 @@ async def get_model_info():
         ],
         "estimated_time": "~39 seconds",
         "output": "480p MP4 video (~5 seconds)",
+        "variants": [transcode.ORIGINAL, *transcode.VARIANTS] if transcode.available() else [transcode.ORIGINAL],
         "cost": "~$0.03-0.05 per video"
     }
-
-
-
-
@@ -0,0 +1,126 @@
+# backend/serve.py
+"""
+Production entry point: several uvicorn worker processes on one port.
+
+    python serve.py --workers 4          # or WEB_WORKERS=4 python serve.py
+
+With preloading (the default, POSIX only) the app is imported once, here,
+and the workers are forked from this process — they skip the import and
+share its memory pages copy-on-write. Without it (--no-preload, or on
+Windows) uvicorn spawns workers that each import the app themselves.
+
+Workers that die are started again. State the workers must agree on (result
+cache index, job claims, Replicate concurrency) lives in SQLite, see
+services/shared.py. Each worker logs its cold-start time and reports it as
+imagify_startup_seconds on /metrics.
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+RESTART_DELAY = 1.0  # seconds between restarts of a crashing worker
+
+
+def _flag(value: str) -> bool:
+    return value.lower() not in ("0", "false", "no", "off")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the API with several worker processes.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", 2)))
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction,
+                        default=_flag(os.getenv("WEB_PRELOAD", "1")),
+                        help="import the app once and fork the workers (default on)")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    return parser.parse_args()
+
+
+def run_worker(app_module, sock: socket.socket, log_level: str):
+    """Body of a forked worker: serve on the inherited socket until told to stop."""
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    app_module.startup["boot"] = time.perf_counter()
+    config = uvicorn.Config(app_module.app, log_level=log_level, proxy_headers=True)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve_preloaded(args):
+    started = time.perf_counter()
+    import main as app_module
+    print(f" Imported app in {(time.perf_counter() - started) * 1000:.0f} ms"
+          f" (pid {os.getpid()}); forking {args.workers} worker(s)")
+
+    sock = socket.create_server((args.host, args.port), backlog=2048)
+    sock.set_inheritable(True)
+
+    workers  = {}  # pid -> started at
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(app_module, sock, args.log_level)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = time.monotonic()
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(args.workers):
+        spawn()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started_at = workers.pop(pid, None)
+        if started_at is None or stopping:
+            continue
+        print(f" Worker {pid} exited (status {status}); restarting it")
+        if time.monotonic() - started_at < RESTART_DELAY:
+            time.sleep(RESTART_DELAY)  # crashing at startup — don't spin
+        spawn()
+    sock.close()
+
+
+def main():
+    args = parse_args()
+    # Read by services/shared.py (and so the pool sizing) in every worker
+    os.environ["WEB_WORKERS"] = str(max(1, args.workers))
+    sys.path.insert(0, BACKEND_DIR)
+
+    if args.preload and hasattr(os, "fork"):
+        serve_preloaded(args)
+    else:
+        import uvicorn
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers,
+                    log_level=args.log_level, proxy_headers=True, app_dir=BACKEND_DIR)
+
+
+if __name__ == "__main__":
+    main()
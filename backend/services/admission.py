@@ -0,0 +1,307 @@
+# backend/services/admission.py
+"""
+Admission control for the expensive animate routes (smile, video).
+
+Each route has an Admission gate in front of its Replicate work:
+
+  * a per-client token bucket — a client spending faster than its rate
+    gets 429 at once, before any work is done on its upload (FastAPI has
+    already received and spooled the body by the time a route runs)
+  * a concurrency limit — at most `concurrency` requests do the work
+  * a bounded wait queue behind it — when the queue is full, or a
+    request has waited queue_timeout seconds, it gets 429 too
+
+Every rejection carries Retry-After: when the client's next token is due,
+or roughly when a slot should free up given the recent service time. Time
+spent waiting is reported in the X-Queue-Time response header and as the
+"queue" stage on /metrics.
+
+Clients are told apart by address (request.client, which honours
+X-Forwarded-For from trusted proxies); a route may pass another key.
+
+With one worker process the state is in memory and the queue is FIFO. When
+serve.py runs several, the buckets, slots and queue places live in the
+shared SQLite database (services/shared.py), so a client's rate and burst
+and each route's limits hold across the host; waiters poll for a slot, so
+the queue order is then only approximate. Counters and the in_flight /
+queued figures in stats() are this process's own.
+"""
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, Request
+
+from services import metrics, shared
+
+
+MAX_CLIENTS  = 10_000  # token buckets kept per gate; the idlest are dropped first
+PRUNE_EVERY  = 60      # seconds between sweeps of full buckets from the shared table
+
+
+def _env(name: str, setting: str, default: float) -> float:
+    return float(os.getenv(f"ADMISSION_{name.upper()}_{setting}", default))
+
+
+def client_id(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+class TokenBucket:
+    """`rate` tokens a second, up to `burst` saved up."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate    = rate
+        self.burst   = burst
+        self.tokens  = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token; returns 0, or the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens  = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.burst
+
+
+class LocalBuckets:
+    """One gate's token buckets in this process's memory."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate     = rate
+        self.burst    = burst
+        self._buckets = OrderedDict()  # client -> TokenBucket, least recently used first
+
+    async def take(self, client: str) -> float:
+        bucket = self._buckets.pop(client, None) or TokenBucket(self.rate, self.burst)
+        self._buckets[client] = bucket
+        if len(self._buckets) > MAX_CLIENTS:
+            self._prune()
+        return bucket.take()
+
+    def _prune(self):
+        # Full buckets carry no state a new one wouldn't; drop those first
+        for client in [client for client, bucket in self._buckets.items() if bucket.full()]:
+            del self._buckets[client]
+        while len(self._buckets) > MAX_CLIENTS:
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SharedBuckets:
+    """One gate's token buckets in the shared database, for every worker.
+    take() runs its transaction on a database thread."""
+
+    def __init__(self, gate: str, rate: float, burst: float, database: shared.Database = shared.db):
+        self.gate    = gate
+        self.rate    = rate
+        self.burst   = burst
+        self.db      = database
+        self._pruned = 0.0
+
+    async def take(self, client: str) -> float:
+        return await shared.run(self._take, client)
+
+    def _take(self, client: str) -> float:
+        now = time.time()
+        with self.db.transaction() as conn:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE gate = ? AND client = ?",
+                               (self.gate, client)).fetchone()
+            tokens = self.burst if row is None else \
+                min(self.burst, row["tokens"] + max(0.0, now - row["updated"]) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute("INSERT OR REPLACE INTO rate_buckets (gate, client, tokens, updated) VALUES (?, ?, ?, ?)",
+                         (self.gate, client, tokens, now))
+        if now - self._pruned > PRUNE_EVERY:
+            self._prune(now)
+        return wait
+
+    def _prune(self, now: float):
+        # A bucket untouched for burst/rate seconds is full again
+        self._pruned = now
+        self.db.execute("DELETE FROM rate_buckets WHERE gate = ? AND updated < ?",
+                        (self.gate, now - self.burst / self.rate))
+
+    def __len__(self) -> int:
+        # Blocking; only stats() calls it, from /metrics and the sync stats endpoints
+        return self.db.execute("SELECT COUNT(*) FROM rate_buckets WHERE gate = ?", (self.gate,)).fetchone()[0]
+
+
+class Admission:
+    """Concurrency limit, bounded wait queue and per-client rate limit for one route."""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, queue_timeout: float,
+                 rate: float, burst: float):
+        self.name          = name
+        self.concurrency   = max(1, int(_env(name, "CONCURRENCY", concurrency)))
+        self.max_queue     = int(_env(name, "MAX_QUEUE", max_queue))
+        self.queue_timeout = _env(name, "QUEUE_TIMEOUT", queue_timeout)
+        self.rate          = _env(name, "RATE", rate)  # tokens/s per client; 0 = unlimited
+        self.burst         = max(1.0, _env(name, "BURST", burst))
+        self.in_flight     = 0
+        self.queued        = 0
+        self.counters      = {"admitted": 0, "rate_limited": 0, "queue_full": 0, "wait_timeout": 0}
+        self._service_time = None  # moving average of how long a request holds a slot
+        if shared.WORKERS > 1:
+            self._slots   = shared.Slots(f"admission_{name}", self.concurrency)
+            self._places  = shared.Slots(f"admission_{name}_queue", self.max_queue)
+            self._buckets = SharedBuckets(name, self.rate, self.burst)
+        else:
+            self._slots   = asyncio.Semaphore(self.concurrency)
+            self._places  = None
+            self._buckets = LocalBuckets(self.rate, self.burst)
+
+    def _reject(self, reason: str, retry_after: float, detail: str):
+        self.counters[reason] += 1
+        raise HTTPException(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after))), "X-Admission": reason},
+        )
+
+    def _queue_wait(self) -> float:
+        """Rough seconds until a new arrival would get a slot."""
+        service = self._service_time or 1.0
+        return service * (self.queued + 1) / self.concurrency
+
+    async def check_rate(self, client: str):
+        """Spend one of the client's tokens, or raise 429."""
+        if self.rate <= 0:
+            return
+        wait = await self._buckets.take(client)
+        if wait:
+            self._reject("rate_limited", wait,
+                         f"Too many {self.name} requests; limit is {self.rate:g}/s"
+                         f" (burst {self.burst:g}). Retry in {math.ceil(wait)}s.")
+
+    async def wait_rate(self, client: str):
+        """Spend one of the client's tokens, waiting for it if need be —
+        for work a client asked for in bulk (a batch's items)."""
+        if self.rate <= 0:
+            return
+        while wait := await self._buckets.take(client):
+            await asyncio.sleep(wait)
+
+    def _full(self):
+        self._reject("queue_full", self._queue_wait(),
+                     f"{self.name} is at capacity ({self.in_flight} running,"
+                     f" {self.queued} waiting). Please retry shortly.")
+
+    def _timed_out(self):
+        self._reject("wait_timeout", self._queue_wait(),
+                     f"{self.name} is busy; no slot freed up within {self.queue_timeout:.0f}s.")
+
+    async def _acquire(self):
+        """Take a slot, queueing for one if need be; returns its token (None in memory)."""
+        if self._places is None:
+            if self.in_flight >= self.concurrency or self.queued:
+                if self.queued >= self.max_queue:
+                    self._full()
+                self.queued += 1
+                try:
+                    await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+                except asyncio.TimeoutError:
+                    self._timed_out()
+                finally:
+                    self.queued -= 1
+            else:
+                await self._slots.acquire()
+            return None
+
+        token = await self._slots.try_acquire()
+        if token is not None:
+            return token
+        place = await self._places.try_acquire()
+        if place is None:
+            self._full()
+        self.queued += 1
+        try:
+            return await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._timed_out()
+        finally:
+            self.queued -= 1
+            await self._places.release(place)
+
+    async def _release(self, token):
+        if token is None:
+            self._slots.release()
+        else:
+            await self._slots.release(token)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold one of the route's slots for the block; yields the seconds spent
+        queued. Raises 429 when the queue is full or the wait ran out.
+        """
+        start = time.perf_counter()
+        token = await self._acquire()
+        waited = time.perf_counter() - start
+        metrics.STAGE_SECONDS.observe(waited, op=self.name, stage="queue")
+        self.counters["admitted"] += 1
+        self.in_flight += 1
+        held = time.perf_counter()
+        try:
+            yield waited
+        finally:
+            self.in_flight -= 1
+            await self._release(token)
+            duration = time.perf_counter() - held
+            self._service_time = duration if self._service_time is None else \
+                0.8 * self._service_time + 0.2 * duration
+
+    @asynccontextmanager
+    async def admit(self, request: Request, client: str = None):
+        """
+        Rate-limit the request's client, then hold a slot for the block;
+        yields the seconds spent queued. Raises 429 when rate-limited, the
+        queue is full, or the wait ran out.
+        """
+        await self.check_rate(client or client_id(request))
+        async with self.slot() as waited:
+            request.state.queue_seconds = waited
+            yield waited
+
+    def stats(self) -> dict:
+        return {
+            "in_flight":     self.in_flight,
+            "queued":        self.queued,
+            "concurrency":   self.concurrency,
+            "max_queue":     self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "rate":          self.rate,
+            "burst":         self.burst,
+            "clients":       len(self._buckets),
+            "shared":        self._places is not None,
+            **self.counters,
+        }
+
+
+def queue_header(request: Request) -> dict:
+    """X-Queue-Time for a response, once admit() has run for the request."""
+    waited = getattr(request.state, "queue_seconds", None)
+    return {} if waited is None else {"X-Queue-Time": f"{waited:.3f}"}
+
+
+# ─── Gates (env overrides: ADMISSION_<NAME>_<SETTING>) ───────────────────────
+# Smiles are cheap and quick; videos take ~40s and are billed per run
+smile_admission = Admission("smile", concurrency=16, max_queue=32, queue_timeout=30, rate=1.0, burst=10)
+video_admission = Admission("video", concurrency=4,  max_queue=8,  queue_timeout=60, rate=0.05, burst=3)
+
+GATES = (smile_admission, video_admission)
@@ -1,131 +1,172 @@
 # backend/services/animator.py
 import os
 import base64
-import time
 import io
 import asyncio
-from pathlib import Path
-from PIL import Image
-import replicate
-from dotenv import load_dotenv
 
-
-# ─── Load .env permanently ────────────────────────────────────────────────────
-BASE_DIR = Path(__file__).resolve().parent.parent
-load_dotenv(dotenv_path=BASE_DIR / ".env", override=True)
-# ─────────────────────────────────────────────────────────────────────────────
-
-RESULTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "results"))
-TEMP_DIR    = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "temp"))
-os.makedirs(RESULTS_DIR, exist_ok=True)
-os.makedirs(TEMP_DIR,    exist_ok=True)
-
-MAX_RETRIES       = 2
-RETRY_DELAY       = 2
-REPLICATE_TIMEOUT = 60
-
-
-def get_token():
-    """Always read fresh token — never cached."""
-    token = os.environ.get("REPLICATE_API_TOKEN", "")
-    if not token:
-        load_dotenv(dotenv_path=BASE_DIR / ".env", override=True)
-        token = os.environ.get("REPLICATE_API_TOKEN", "")
-    if not token:
-        raise Exception("REPLICATE_API_TOKEN not set! Check your backend/.env file")
-    return token
+from services import fileio, ingest, pipeline, replicate_client, resilience, metrics
+from services.resilience import smile_breaker
+from services.cache import smile_cache, acache_key
+from services.pool import enhance_pool, thumbnail_pool, http_errors, PoolBusy, PoolTimeout, PoolError
+from services.store import file_store, new_key
+from services.singleflight import smile_flights
+from services.replicate_client import get_token
+
+MAX_ATTEMPTS      = 3
+RETRY_BASE_DELAY  = 1     # backoff: up to 1s, 2s, 4s … (full jitter)
+RETRY_MAX_DELAY   = 8
+REPLICATE_TIMEOUT = 60    # one attempt
+SMILE_DEADLINE    = float(os.getenv("SMILE_DEADLINE", 75))  # all attempts + backoff
+COMPRESS_MAX_SIZE = 512
+
+SMILE_MODEL = "fofr/expression-editor:bf913bc90e1c44ba288ba3942a538693b72e8cc7df576f3beebe56adc0a92b86"
+SMILE_INPUT = {
+    "smile":          0.9,
+    "eyebrow":        0.1,
+    "wink":           0,
+    "pupil_x":        0,
+    "pupil_y":        0,
+    "aaa":            0,
+    "eee":            0,
+    "woo":            0,
+    "rotate_pitch":   0,
+    "rotate_yaw":     0,
+    "rotate_roll":    0,
+    "blink":          0,
+    "output_format":  "webp",
+    "output_quality": 90,
+}
+
+
+class SmileFailed(Exception):
+    """Every Replicate attempt for an image failed."""
 
 
 def compress_image(input_path: str, max_size: int = 512) -> bytes:
     """Compress and resize image before sending to Replicate."""
-    img = Image.open(input_path).convert("RGB")
-    if img.width > max_size or img.height > max_size:
-        img.thumbnail((max_size, max_size), Image.LANCZOS)
-        print(f" Resized image to {img.width}x{img.height}")
+    with open(input_path, "rb") as f:
+        return compress_bytes(f.read(), max_size)
+
+
+def compress_bytes(data, max_size: int = 512) -> bytes:
+    """compress_image() for an upload already in memory (any bytes-like)."""
+    # Draft-mode JPEG decode + reduce-before-resample: never decodes the
+    # full-size frame just to keep a 512px copy
+    img = pipeline.open_thumbnail(ingest.BufferReader(data), max_size)
+    print(f" Resized image to {img.width}x{img.height}")
     buffer = io.BytesIO()
     img.save(buffer, format="JPEG", quality=78)
     compressed = buffer.getvalue()
-    original_size = os.path.getsize(input_path)
-    print(f" Compressed: {original_size // 1024}KB → {len(compressed) // 1024}KB")
+    print(f" Compressed: {len(data) // 1024}KB → {len(compressed) // 1024}KB")
     return compressed
 
 
-def _run_replicate_sync(image_data_uri: str, token: str) -> bytes:
-    """Blocking Replicate call — runs inside a thread via asyncio.to_thread."""
-    client = replicate.Client(api_token=token)
-    output = client.run(
-        "fofr/expression-editor:bf913bc90e1c44ba288ba3942a538693b72e8cc7df576f3beebe56adc0a92b86",
-        input={
-            "image":          image_data_uri,
-            "smile":          0.9,
-            "eyebrow":        0.1,
-            "wink":           0,
-            "pupil_x":        0,
-            "pupil_y":        0,
-            "aaa":            0,
-            "eee":            0,
-            "woo":            0,
-            "rotate_pitch":   0,
-            "rotate_yaw":     0,
-            "rotate_roll":    0,
-            "blink":          0,
-            "output_format":  "webp",
-            "output_quality": 90,
-        }
+async def smile_key(image_bytes: bytes) -> str:
+    return await acache_key(image_bytes, model=SMILE_MODEL, max_size=COMPRESS_MAX_SIZE, **SMILE_INPUT)
+
+
+async def _run_replicate(image_data_uri: str) -> bytes:
+    """One prediction on the shared Replicate client, plus the output download."""
+    output = await replicate_client.run(
+        SMILE_MODEL,
+        {"image": image_data_uri, **SMILE_INPUT},
+        timeout=REPLICATE_TIMEOUT,
     )
     if not output or len(output) == 0:
         raise Exception("Empty output from Replicate model")
-    result_bytes = output[0].read()
+    with metrics.stage("smile", "download"):
+        result_bytes = await replicate_client.fetch(output[0])
     if not result_bytes:
         raise Exception("Empty bytes from Replicate model")
     return result_bytes
 
 
 async def generate_smile_animation(input_path: str, output_filename: str) -> str:
-    """Generate AI smile via Replicate with timeout and retry."""
+    """Generate AI smile via Replicate; falls back to the original image."""
     print(" Starting AI smile generation via Replicate...")
 
-    token          = get_token()
-    image_bytes    = compress_image(input_path, max_size=512)
-    image_data_uri = f"data:image/jpeg;base64,{base64.b64encode(image_bytes).decode()}"
-
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            print(f" Attempt {attempt}/{MAX_RETRIES} (timeout={REPLICATE_TIMEOUT}s)...")
-
-            result_bytes = await asyncio.wait_for(
-                asyncio.to_thread(_run_replicate_sync, image_data_uri, token),
-                timeout=REPLICATE_TIMEOUT,
-            )
-
-            name       = Path(output_filename).stem
-            final_path = os.path.join(TEMP_DIR, f"{name}.webp")
-            with open(final_path, "wb") as f:
-                f.write(result_bytes)
-
-            print(f" AI smile saved on attempt {attempt}: {final_path}")
-            return final_path
-
-        except asyncio.TimeoutError:
-            print(f" Attempt {attempt} timed out after {REPLICATE_TIMEOUT}s")
-        except Exception as e:
-            print(f" Attempt {attempt} failed: {e}")
-
-        if attempt < MAX_RETRIES:
-            print(f" Retrying in {RETRY_DELAY}s...")
-            await asyncio.sleep(RETRY_DELAY)
+    return await generate_smile(await fileio.read_bytes(input_path), output_filename)
+
+
+async def generate_smile(image_bytes, output_filename: str) -> str:
+    """generate_smile_animation() for an upload already in memory (any bytes-like)."""
+    try:
+        return await smile_from_bytes(image_bytes)
+    except SmileFailed as e:
+        print(f" {e}. Returning original image.")
+        return await _save_original(image_bytes, output_filename)
+
+
+async def smile_from_bytes(image_bytes) -> str:
+    """
+    Smile result for an in-memory upload; returns the cached result path.
+    Retries and the circuit breaker live in services/resilience.py. Unlike
+    generate_smile_animation() this raises SmileFailed when no result could
+    be had instead of falling back to the original, so batch callers can
+    report the failure per item. Concurrent calls for the same photo share
+    one prediction (services/singleflight.py).
+    """
+    # ─── Same photo + same model/settings → cached result ───────────────────
+    with metrics.stage("smile", "cache_lookup"):
+        key         = await smile_key(image_bytes)
+        cached_path = await smile_cache.apath(key)
+    if cached_path:
+        print(f" Cache hit: {cached_path}")
+        return cached_path
+
+    get_token()  # fail fast without a token
+    # The flight may outlive this request's upload buffer: it gets its own copy
+    return await smile_flights.run(key, lambda: _generate(key, bytes(image_bytes)))
+
+
+async def _generate(key: str, image_bytes: bytes) -> str:
+    """The uncached half of smile_from_bytes(): one prediction, stored under key."""
+    # In the thumbnail pool: off the event loop (and its GIL), and a batch
+    # compresses its images in parallel
+    try:
+        with metrics.stage("smile", "compress"):
+            compressed = await thumbnail_pool.run(compress_bytes, image_bytes, COMPRESS_MAX_SIZE)
+    except PoolBusy:
+        raise SmileFailed("Compress queue is full")
+    except PoolTimeout:
+        raise SmileFailed("Compressing the image timed out")
+    except PoolError:
+        raise SmileFailed("Compress worker failed")
+    image_data_uri = f"data:image/jpeg;base64,{base64.b64encode(compressed).decode()}"
+
+    try:
+        result_bytes = await resilience.call(
+            _run_replicate, image_data_uri,
+            breaker=smile_breaker,
+            attempts=MAX_ATTEMPTS,
+            base_delay=RETRY_BASE_DELAY,
+            max_delay=RETRY_MAX_DELAY,
+            deadline=SMILE_DEADLINE,
+        )
+    except resilience.CircuitOpen as e:
+        raise SmileFailed(str(e))
+    except asyncio.TimeoutError:
+        raise SmileFailed(f"Replicate did not answer within {SMILE_DEADLINE:.0f}s")
+    except Exception as e:
+        raise SmileFailed(f"Replicate failed: {e}")
+
+    final_path = await smile_cache.aput(key, result_bytes, suffix=".webp")
+    print(f" AI smile saved: {final_path}")
+    return final_path
 
-    print(" All attempts failed. Returning original image.")
-    return await _save_original(input_path, output_filename)
 
+async def _save_original(image_bytes, output_filename: str) -> str:
+    """Last resort: return a copy of the original image.
 
-async def _save_original(input_path: str, output_filename: str) -> str:
-    """Last resort: return a copy of the original image."""
-    img        = Image.open(input_path).convert("RGB")
-    name       = Path(output_filename).stem
-    final_path = os.path.join(TEMP_DIR, f"{name}.jpg")
-    img.save(final_path, format="JPEG", quality=95)
-    print(f" Saved original as fallback: {final_path}")
+    Stored under a unique key in the managed file store (not under the
+    upload's name), so concurrent uploads of the same filename can't
+    overwrite each other and the copy expires with the store's TTL. The
+    re-encode is CPU work, so it runs on the enhance pool.
+    """
+    with http_errors("Enhance", "Saving the original image"):
+        jpeg = await enhance_pool.run(pipeline.jpeg_bytes, bytes(image_bytes))
+    final_path = await file_store.aput(new_key(), jpeg, suffix=".jpg")
+    print(f" Saved original of {output_filename} as fallback: {final_path}")
     return final_path
 
 
@@ -0,0 +1,390 @@
+# backend/services/cache.py
+"""
+Content-addressed result cache.
+
+Entries are keyed by a hash of the input bytes plus the normalized request
+parameters (including the model version for Replicate-backed routes), so an
+identical upload with identical settings never gets recomputed.
+
+Two tiers per cache:
+  * memory — LRU of small results (bytes), bounded by size
+  * disk   — files under backend/results/cache/<name>, bounded by size,
+             evicted least-recently-used first. The index of these files
+             lives in the shared SQLite database (services/shared.py), so
+             every worker process sees the others' results and one quota
+             covers them all.
+
+Both tiers honour a TTL measured from when the entry was stored. Lookups
+drop expired entries as they find them; services/store.py sweeps the rest in
+the background.
+
+The plain methods block on SQLite and the filesystem. Route code uses the
+a-prefixed ones, which do that work on the database threads
+(shared.run()) and services/fileio.py's, and keep only the memory tier on
+the event loop.
+"""
+import os
+import time
+import json
+import uuid
+import shutil
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+from services import fileio, shared
+
+
+RESULTS_DIR = os.getenv("RESULTS_DIR") or os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "results"))
+CACHE_DIR   = os.path.join(RESULTS_DIR, "cache")
+
+MB = 1024 * 1024
+
+# An interrupted write leaves a .tmp file behind; the sweeper removes it after this
+STALE_TMP_AGE = 3600
+
+
+def cache_key(data: bytes, **params) -> str:
+    """sha256 over the input bytes and the sorted, JSON-encoded parameters."""
+    return derive_key(hashlib.sha256(data), **params)
+
+
+async def acache_key(data: bytes, **params) -> str:
+    """cache_key() on a worker thread: hashing a large upload takes a while."""
+    return await asyncio.to_thread(cache_key, data, **params)
+
+
+def derive_key(digest, **params) -> str:
+    """cache_key() from a sha256 object already fed the input bytes (left
+    untouched), for callers that keep the digest instead of the input."""
+    digest = digest.copy()
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _env(name: str, setting: str, default: float) -> float:
+    return float(os.getenv(f"CACHE_{name.upper()}_{setting}", default))
+
+
+class ResultCache:
+    def __init__(self, name: str, memory_mb: float, disk_mb: float, ttl: float, directory: str = None,
+                 database: shared.Database = shared.db):
+        self.name         = name
+        self.directory    = directory or os.path.join(CACHE_DIR, name)
+        self.memory_limit = int(_env(name, "MEMORY_MB", memory_mb) * MB)
+        self.disk_limit   = int(_env(name, "DISK_MB", disk_mb) * MB)
+        self.ttl          = _env(name, "TTL", ttl)
+        self.db           = database
+
+        self._memory       = OrderedDict()  # key -> (stored_at, bytes)
+        self._memory_bytes = 0
+        self._scanned      = False
+
+        self.hits        = 0
+        self.misses      = 0
+        self.memory_hits = 0
+        self.disk_hits   = 0
+        self.evictions   = 0
+        self.expirations = 0
+
+    # ─── internals ───────────────────────────────────────────────────────────
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    def _ensure_indexed(self):
+        """On this process's first use, index files the database doesn't know
+        yet (results written before it existed, or after it was deleted)."""
+        if self._scanned:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        rows = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                key  = entry.name.split(".", 1)[0]
+                rows.append((self.name, key, entry.name, stat.st_size, stat.st_mtime, stat.st_mtime))
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO cache_entries (cache, key, filename, size, stored_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+        self._scanned = True
+
+    def _remember(self, key: str, data: bytes, stored_at: float):
+        # A single entry may not take more than a quarter of the memory tier
+        if len(data) > self.memory_limit // 4:
+            return
+        self._forget_memory(key)
+        self._memory[key] = (stored_at, data)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_limit:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _forget_memory(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry:
+            self._memory_bytes -= len(entry[1])
+
+    def _remove_file(self, filename: str):
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except FileNotFoundError:
+            pass
+
+    def _forget_disk(self, key: str) -> bool:
+        self._ensure_indexed()
+        row = self.db.execute(
+            "DELETE FROM cache_entries WHERE cache = ? AND key = ? RETURNING filename", (self.name, key)
+        ).fetchone()
+        if row:
+            self._remove_file(row["filename"])
+        return row is not None
+
+    def _index_file(self, key: str, filename: str):
+        path = os.path.join(self.directory, filename)
+        now  = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO cache_entries (cache, key, filename, size, stored_at, used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (self.name, key, filename, os.path.getsize(path), now, now)
+        )
+        self._enforce_quota()
+        return path
+
+    def _disk_usage(self) -> tuple:
+        """(files, bytes) in the disk tier, across all workers."""
+        row = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE cache = ?", (self.name,)
+        ).fetchone()
+        return row[0], row[1]
+
+    def _enforce_quota(self):
+        """Evict least-recently-used files until the disk tier fits its limit."""
+        victims = []
+        with self.db.transaction() as conn:
+            files, total = self._disk_usage()
+            if total > self.disk_limit:
+                rows = conn.execute(
+                    "SELECT key, filename, size FROM cache_entries WHERE cache = ? ORDER BY used_at",
+                    (self.name,)
+                ).fetchall()
+                for row in rows:
+                    if total <= self.disk_limit or files - len(victims) <= 1:
+                        break
+                    victims.append(row)
+                    total -= row["size"]
+                conn.executemany("DELETE FROM cache_entries WHERE cache = ? AND key = ?",
+                                 [(self.name, row["key"]) for row in victims])
+        for row in victims:
+            self._remove_file(row["filename"])
+        self.evictions += len(victims)
+
+    def _lookup_disk(self, key: str):
+        """(stored_at, size, filename) of a live disk entry, or None."""
+        self._ensure_indexed()
+        entry = self.db.execute(
+            "SELECT stored_at, size, filename FROM cache_entries WHERE cache = ? AND key = ?", (self.name, key)
+        ).fetchone()
+        if entry is None:
+            return None
+        if self._expired(entry[0]) or not os.path.exists(os.path.join(self.directory, entry[2])):
+            self._forget_disk(key)
+            return None
+        self.db.execute("UPDATE cache_entries SET used_at = ? WHERE cache = ? AND key = ?",
+                        (time.time(), self.name, key))
+        return entry
+
+    # ─── public API ──────────────────────────────────────────────────────────
+
+    def _lookup_memory(self, key: str):
+        entry = self._memory.get(key)
+        if entry is not None:
+            if not self._expired(entry[0]):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return entry[1]
+            self._forget_memory(key)
+        return None
+
+    def _disk_hit(self, key: str, data: bytes, stored_at: float) -> bytes:
+        self._remember(key, data, stored_at)
+        self.hits += 1
+        self.disk_hits += 1
+        return data
+
+    def get(self, key: str):
+        """Cached bytes for key, or None. Disk hits are promoted to memory."""
+        data = self._lookup_memory(key)
+        if data is not None:
+            return data
+
+        entry = self._lookup_disk(key)
+        if entry is not None:
+            with open(os.path.join(self.directory, entry[2]), "rb") as f:
+                return self._disk_hit(key, f.read(), entry[0])
+
+        self.misses += 1
+        return None
+
+    def path(self, key: str):
+        """Path of the cached file for key, or None. For results served as files."""
+        entry = self._lookup_disk(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.disk_hits += 1
+        return os.path.join(self.directory, entry[2])
+
+    def put(self, key: str, data: bytes, suffix: str = "") -> str:
+        """Store bytes in both tiers and return the on-disk path."""
+        self._forget_disk(key)
+        filename = f"{key}{suffix}"
+        # Per-process temp name: two workers may store the same key at once
+        tmp_path = os.path.join(self.directory, f"{filename}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.directory, filename))
+
+        self._remember(key, data, time.time())
+        return self._index_file(key, filename)
+
+    def put_file(self, key: str, src_path: str, suffix: str = "") -> str:
+        """Move an existing file into the disk tier and return its new path."""
+        self._forget_disk(key)
+        filename = f"{key}{suffix}"
+        shutil.move(src_path, os.path.join(self.directory, filename))
+        return self._index_file(key, filename)
+
+    def delete(self, key: str) -> bool:
+        """Drop key from both tiers. Other workers' memory tiers keep their
+        copy until it expires."""
+        self._forget_memory(key)
+        return self._forget_disk(key)
+
+    def sweep(self) -> int:
+        """
+        Drop expired entries from both tiers, re-apply the disk quota and
+        remove stale .tmp files. Returns how many files were deleted.
+        """
+        self._sweep_memory()
+        return self._sweep_disk()
+
+    # ─── async variants: the index and file I/O run on the database and
+    #     services/fileio.py's threads, the memory tier stays on the loop ────
+
+    async def aget(self, key: str):
+        """get() without blocking the event loop on the index or a disk read."""
+        data = self._lookup_memory(key)
+        if data is not None:
+            return data
+
+        entry = await shared.run(self._lookup_disk, key)
+        if entry is not None:
+            try:
+                data = await fileio.read_bytes(os.path.join(self.directory, entry[2]))
+            except FileNotFoundError:
+                pass  # evicted by another request meanwhile
+            else:
+                return self._disk_hit(key, data, entry[0])
+
+        self.misses += 1
+        return None
+
+    async def apath(self, key: str):
+        """path() without blocking the event loop on the index."""
+        entry = await shared.run(self._lookup_disk, key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.disk_hits += 1
+        return os.path.join(self.directory, entry[2])
+
+    async def aput(self, key: str, data: bytes, suffix: str = "") -> str:
+        """put() without blocking the event loop on the index or the write."""
+        await shared.run(self._forget_disk, key)
+        filename = f"{key}{suffix}"
+        # Unique per write: the same key may be stored by two threads at once
+        tmp_path = os.path.join(self.directory, f"{filename}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+        await fileio.write_bytes(tmp_path, data)
+        await fileio.run(os.replace, tmp_path, os.path.join(self.directory, filename))
+
+        self._remember(key, data, time.time())
+        return await shared.run(self._index_file, key, filename)
+
+    async def aput_file(self, key: str, src_path: str, suffix: str = "") -> str:
+        """put_file() without blocking the event loop — moving a file from
+        another filesystem copies it."""
+        await shared.run(self._forget_disk, key)
+        filename = f"{key}{suffix}"
+        await fileio.run(shutil.move, src_path, os.path.join(self.directory, filename))
+        return await shared.run(self._index_file, key, filename)
+
+    async def adelete(self, key: str) -> bool:
+        """delete() without blocking the event loop."""
+        self._forget_memory(key)
+        return await shared.run(self._forget_disk, key)
+
+    async def asweep(self) -> int:
+        """sweep() without blocking the event loop."""
+        self._sweep_memory()
+        return await shared.run(self._sweep_disk)
+
+    def _sweep_memory(self):
+        for key in [key for key, (stored_at, _) in self._memory.items() if self._expired(stored_at)]:
+            self._forget_memory(key)
+
+    def _sweep_disk(self) -> int:
+        self._ensure_indexed()
+        expired = []
+        if self.ttl > 0:
+            expired = [row[0] for row in self.db.execute(
+                "SELECT key FROM cache_entries WHERE cache = ? AND stored_at < ?",
+                (self.name, time.time() - self.ttl)
+            )]
+        expired = [key for key in expired if self._forget_disk(key)]
+        self.expirations += len(expired)
+
+        evictions = self.evictions
+        self._enforce_quota()
+        removed = len(expired) + self.evictions - evictions
+
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp") and now - entry.stat().st_mtime > STALE_TMP_AGE:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def stats(self) -> dict:
+        self._ensure_indexed()
+        disk_items, disk_bytes = self._disk_usage()
+        lookups = self.hits + self.misses
+        return {
+            "hits":          self.hits,
+            "misses":        self.misses,
+            "hit_rate":      round(self.hits / lookups, 3) if lookups else 0.0,
+            "memory_hits":   self.memory_hits,
+            "disk_hits":     self.disk_hits,
+            "evictions":     self.evictions,
+            "expirations":   self.expirations,
+            "memory_items":  len(self._memory),
+            "memory_bytes":  self._memory_bytes,
+            "disk_items":    disk_items,
+            "disk_bytes":    disk_bytes,
+        }
+
+
+# ─── Per-route caches (sizes in MB, TTL in seconds; env overrides) ────────────
+enhance_cache = ResultCache("enhance", memory_mb=128, disk_mb=512,  ttl=24 * 3600)
+smile_cache   = ResultCache("smile",   memory_mb=32,  disk_mb=256,  ttl=7 * 24 * 3600)
+video_cache   = ResultCache("video",   memory_mb=0,   disk_mb=2048, ttl=7 * 24 * 3600)
+
+CACHES = (enhance_cache, smile_cache, video_cache)
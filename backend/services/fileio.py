@@ -0,0 +1,114 @@
+# backend/services/fileio.py
+"""
+Blocking file work off the event loop.
+
+Reads, writes, stats, moves (a copy when the temp dir is another filesystem)
+and unlinks run on a dedicated thread pool, so a slow disk never stalls every
+other request on the loop, and file work never queues behind — or crowds out —
+asyncio.to_thread users (session_pool's decodes, cache-key hashing) on the
+default executor. Image compression is CPU work and runs in thumbnail_pool's
+processes, not here.
+
+The result caches' SQLite indexes run on the database threads (shared.run());
+only their memory tiers stay on the loop (see ResultCache.aput()).
+"""
+import os
+import asyncio
+import tempfile
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ─── Config (env overrides) ───────────────────────────────────────────────────
+IO_THREADS = int(os.getenv("IO_THREADS", 4))
+# ─────────────────────────────────────────────────────────────────────────────
+
+_executor = None
+_pid      = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Threads don't survive a fork: serve.py's workers each start their own
+    global _executor, _pid
+    if _executor is None or _pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="fileio")
+        _pid      = os.getpid()
+    return _executor
+
+
+async def run(fn, *args, **kwargs):
+    """fn(*args, **kwargs) on the I/O thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(), functools.partial(fn, *args, **kwargs)
+    )
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write(path: str, data) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _remove(paths) -> None:
+    for path in paths:
+        if not path:
+            continue
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Cleanup error for {path}: {e}")
+
+
+async def read_bytes(path: str) -> bytes:
+    return await run(_read, path)
+
+
+async def write_bytes(path: str, data) -> None:
+    await run(_write, path, data)
+
+
+async def remove(*paths) -> None:
+    """Delete files, skipping None and ones already gone."""
+    await run(_remove, paths)
+
+
+class TempWriter:
+    """
+    A named temp file written chunk by chunk from async code:
+
+        async with TempWriter(suffix=".mp4") as out:
+            await out.write(chunk)
+        out.path  # closed, still on disk — the caller moves or removes it
+    """
+
+    def __init__(self, suffix: str = ""):
+        self.suffix = suffix
+        self.path   = None
+        self._file  = None
+
+    def _open(self):
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix=self.suffix)
+        self.path  = self._file.name
+
+    async def __aenter__(self):
+        await run(self._open)
+        return self
+
+    async def write(self, chunk: bytes):
+        await run(self._file.write, chunk)
+
+    async def __aexit__(self, *exc):
+        await run(self._file.close)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None and _pid == os.getpid():
+        _executor.shutdown(wait=False)
+    _executor = None
@@ -0,0 +1,47 @@
+# backend/services/http_client.py
+# httpx is imported on first use, so routes that never download don't pay for it at
+# startup; warm_up() does that import and the client's TLS setup off the event loop
+import asyncio
+
+DOWNLOAD_TIMEOUT = 180  # seconds; connecting gets 10
+MAX_CONNECTIONS  = 50
+MAX_KEEPALIVE    = 10
+CHUNK_SIZE       = 64 * 1024
+
+_client = None
+
+
+def get_client() -> "httpx.AsyncClient":
+    """Process-wide AsyncClient, so downloads reuse pooled keep-alive connections."""
+    global _client
+    if _client is None:
+        _client = _build()
+    return _client
+
+
+def _build() -> "httpx.AsyncClient":
+    import httpx
+
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(DOWNLOAD_TIMEOUT, connect=10),
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE),
+        follow_redirects=True,
+    )
+
+
+async def warm_up():
+    """Build the client in a thread; a request that got there first keeps its own."""
+    global _client
+    if _client is None:
+        client = await asyncio.to_thread(_build)
+        if _client is None:
+            _client = client
+        else:
+            await client.aclose()
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,135 @@
+# backend/services/ingest.py
+"""
+Upload ingestion without copies.
+
+Starlette spools each upload into a SpooledTemporaryFile: a BytesIO while
+small, an anonymous temp file once it grows. upload_buffer() exposes those
+bytes as a memoryview — the BytesIO's own buffer, or an mmap of the temp
+file — so hashing, header probing and decoding all read the spool in place
+instead of going through await file.read() copies and temp files.
+
+probe() checks byte and pixel limits from the image header alone, before
+anything is decoded, so oversized uploads are rejected cheaply.
+"""
+import io
+import os
+import mmap
+from contextlib import contextmanager
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image, UnidentifiedImageError
+
+
+# ─── Limits (env overrides) ───────────────────────────────────────────────────
+MAX_UPLOAD_MB = float(os.getenv("UPLOAD_MAX_MB", 50))
+MAX_PIXELS    = int(os.getenv("UPLOAD_MAX_PIXELS", 80_000_000))  # under Pillow's bomb warning
+# ─────────────────────────────────────────────────────────────────────────────
+
+MAX_UPLOAD_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024)
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only, seekable file over a bytes-like object, without copying it."""
+
+    def __init__(self, data, name: str = "upload"):
+        # Reuse the caller's view rather than exporting a new one, so a reader
+        # that outlives upload_buffer() can never pin the spool's buffer
+        self._owned = not isinstance(data, memoryview)
+        self._view  = memoryview(data) if self._owned else data
+        self._pos   = 0
+        self.name   = name  # lets Replicate's file upload guess the content type
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = max(0, min(len(buffer), len(self._view) - self._pos))
+        buffer[:count] = self._view[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if self._owned:
+            self._view.release()
+        super().close()
+
+
+def open_image(data) -> Image.Image:
+    """Image.open() over an in-memory buffer (lazy: only the header is read)."""
+    return Image.open(BufferReader(data))
+
+
+def probe(data, max_pixels: int = MAX_PIXELS):
+    """(format, width, height) from the header; 400/413 for bad or huge images."""
+    try:
+        with open_image(data) as image:
+            fmt, (width, height) = image.format, image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise HTTPException(status_code=400, detail="Unsupported or corrupt image")
+
+    if width * height > max_pixels:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image too large ({width}x{height}). Max: {max_pixels // 1_000_000} megapixels"
+        )
+    return fmt, width, height
+
+
+def upload_size(file: UploadFile) -> int:
+    """Size of a spooled upload, without reading it."""
+    spool = file.file
+    spool.seek(0, os.SEEK_END)
+    size = spool.tell()
+    spool.seek(0)
+    return size
+
+
+@contextmanager
+def upload_buffer(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    memoryview over an upload's bytes, valid inside the with-block.
+    Raises 413 past max_bytes and 400 for an empty upload.
+    """
+    spool = file.file
+    size = upload_size(file)
+    if size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload larger than {max_bytes // (1024 * 1024)}MB")
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Empty upload")
+
+    inner = getattr(spool, "_file", spool)
+    if isinstance(inner, io.BytesIO):
+        view = inner.getbuffer()
+        try:
+            yield view
+        finally:
+            view.release()
+        return
+
+    try:
+        inner.flush()
+        mapped = mmap.mmap(inner.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        yield spool.read()  # not mappable — fall back to one copy
+        return
+
+    view = memoryview(mapped)
+    try:
+        yield view
+    finally:
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:
+            pass  # a reader still holds a slice; the mapping closes when it is collected
@@ -0,0 +1,353 @@
+# backend/services/jobs.py
+"""
+Background job queue for long-running generations.
+
+POST handlers submit a job and return its id straight away; a fixed number of
+asyncio workers run the registered handler for each job kind. Job state and
+the uploaded input live in SQLite / on disk under backend/results/jobs, so jobs
+that were queued or running when the process stopped are picked up again on
+the next start.
+
+Several API worker processes (serve.py) share the one queue: workers claim a
+job with a single UPDATE, so each job runs exactly once, and a job left
+running by a process that died is queued again. Queries run on the shared
+database threads (shared.run()), never on the event loop.
+
+A job's callback_url must be http(s) and reach only public addresses, so a
+client cannot make the API POST to itself, its cloud metadata endpoint or
+the private network behind it; hosts in JOB_CALLBACK_ALLOW_HOSTS are exempt.
+The POST connects to the address that was checked (Host header and TLS
+name kept), so the host cannot resolve elsewhere in between.
+
+Finished jobs are kept for JOB_TTL seconds, then deleted with their result.
+A job's result is its own link to the cached file, so the video cache
+evicting its copy doesn't expire the job early.
+"""
+import os
+import time
+import uuid
+import socket
+import asyncio
+import shutil
+import ipaddress
+import threading
+import traceback
+
+from services import fileio, shared
+from services.http_client import get_client
+
+RESULTS_DIR = os.getenv("RESULTS_DIR") or os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "results"))
+JOBS_DIR    = os.path.join(RESULTS_DIR, "jobs")
+DB_PATH     = os.getenv("JOBS_DB_PATH", os.path.join(JOBS_DIR, "jobs.db"))
+
+JOB_CONCURRENCY  = int(os.getenv("JOB_CONCURRENCY", 2))
+CALLBACK_TIMEOUT = 10
+# Callback hosts allowed even though they resolve to private addresses
+CALLBACK_ALLOW_HOSTS = {
+    host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOW_HOSTS", "").split(",") if host.strip()
+}
+# Idle workers check for jobs submitted to other processes this often
+POLL_INTERVAL    = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+# Finished jobs and their results are deleted this long after they finish
+JOB_TTL          = float(os.getenv("JOB_TTL", 7 * 24 * 3600))
+EXPIRE_EVERY     = 300  # seconds between sweeps for expired jobs
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class InvalidCallback(ValueError):
+    """callback_url is not an http(s) URL to a public (or allow-listed) host."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    input_path   TEXT,
+    result_path  TEXT,
+    error        TEXT,
+    callback_url TEXT,
+    created_at   REAL NOT NULL,
+    updated_at   REAL NOT NULL,
+    owner        INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+class JobQueue:
+    def __init__(self, db_path: str = DB_PATH, concurrency: int = JOB_CONCURRENCY):
+        self.db_path     = db_path
+        self.concurrency = concurrency
+        self.handlers    = {}
+        self._db         = None
+        self._db_lock    = threading.Lock()
+        self._wakeup     = None
+        self._workers    = []
+        self._expired_at = 0.0
+
+    # ─── storage ─────────────────────────────────────────────────────────────
+
+    def _database(self) -> shared.Database:
+        # Blocking, like everything in this section; called from database threads
+        with self._db_lock:
+            if self._db is None:
+                database = shared.Database(self.db_path, _SCHEMA)
+                columns = {row["name"] for row in database.execute("PRAGMA table_info(jobs)")}
+                if "owner" not in columns:  # databases from before jobs were shared
+                    database.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+                self._db = database
+            return self._db
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._database().execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _claim(self):
+        """Take the oldest queued job for this process, or None. Atomic across processes."""
+        row = self._database().execute(
+            "UPDATE jobs SET status = ?, owner = ?, updated_at = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) AND status = ? "
+            "RETURNING *",
+            (RUNNING, os.getpid(), time.time(), QUEUED, QUEUED),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def _requeue_orphans(self, restarting: bool = False) -> int:
+        """Queue running jobs whose process is gone (on start, also this pid's
+        own — a previous run of a restarted container can reuse it)."""
+        rows = self._database().execute(
+            "SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,)
+        ).fetchall()
+        orphans = [
+            row["id"] for row in rows
+            if row["owner"] is None or not shared.alive(row["owner"])
+            or (restarting and row["owner"] == os.getpid())
+        ]
+        for job_id in orphans:
+            self._database().execute(
+                "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? WHERE id = ? AND status = ?",
+                (QUEUED, time.time(), job_id, RUNNING),
+            )
+        return len(orphans)
+
+    def _get(self, job_id: str):
+        row = self._database().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _insert(self, job_id: str, kind: str, input_path: str, callback_url: str):
+        now = time.time()
+        self._database().execute(
+            "INSERT INTO jobs (id, kind, status, input_path, callback_url, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, input_path, callback_url, now, now),
+        )
+
+    def _expire(self) -> int:
+        """Delete jobs that finished more than JOB_TTL ago, and their results."""
+        rows = self._database().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ? RETURNING id",
+            (SUCCEEDED, FAILED, time.time() - JOB_TTL),
+        ).fetchall()
+        for row in rows:
+            shutil.rmtree(_result_dir(row["id"]), ignore_errors=True)
+        return len(rows)
+
+    def _release_own(self):
+        self._database().execute(
+            "UPDATE jobs SET status = ?, owner = NULL WHERE status = ? AND owner = ?",
+            (QUEUED, RUNNING, os.getpid()),
+        )
+
+    # ─── public API ──────────────────────────────────────────────────────────
+
+    async def get(self, job_id: str):
+        return await shared.run(self._get, job_id)
+
+    @property
+    def depth(self) -> int:
+        """Jobs waiting for a worker, across all processes. Blocking: read at
+        /metrics scrape time, on a threadpool thread."""
+        return self._database().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def register(self, kind: str, handler):
+        """handler: async fn(input_path) -> result_path"""
+        self.handlers[kind] = handler
+
+    async def submit(self, kind: str, input_bytes: bytes, suffix: str = "", callback_url: str = None) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if callback_url:
+            await check_callback_url(callback_url)
+
+        job_id = uuid.uuid4().hex
+        await fileio.run(os.makedirs, JOBS_DIR, exist_ok=True)
+        input_path = os.path.join(JOBS_DIR, f"{job_id}{suffix}")
+        await fileio.write_bytes(input_path, input_bytes)
+
+        await shared.run(self._insert, job_id, kind, input_path, callback_url)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+
+        # Anything queued or mid-run when we last stopped starts over
+        resumed = await shared.run(self._requeue_orphans, restarting=True)
+        if resumed:
+            print(f" Resuming {resumed} unfinished job(s)")
+
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._db is not None:
+            # Interrupted jobs go back to the queue for the other workers
+            await shared.run(self._release_own)
+            self._db.close()
+            self._db = None
+
+    # ─── workers ─────────────────────────────────────────────────────────────
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await shared.run(self._claim)
+                if job is not None:
+                    await self._run(job)
+                    continue
+            except Exception:
+                # One bad job (or a database hiccup) must not take the worker down
+                traceback.print_exc()
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                await shared.run(self._requeue_orphans)
+                if JOB_TTL > 0 and time.time() - self._expired_at > EXPIRE_EVERY:
+                    self._expired_at = time.time()
+                    expired = await shared.run(self._expire)
+                    if expired:
+                        print(f" Expired {expired} finished job(s)")
+
+    async def _run(self, job: dict):
+        job_id = job["id"]
+        print(f" Job {job_id} ({job['kind']}) started")
+        try:
+            result_path = await self.handlers[job["kind"]](job["input_path"])
+            result_path = await fileio.run(_pin_result, job_id, result_path)
+            await shared.run(self._update, job_id, status=SUCCEEDED, result_path=result_path)
+            print(f" Job {job_id} finished: {result_path}")
+        except asyncio.CancelledError:
+            # Shutting down — stop() hands it back to the queue
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            await shared.run(self._update, job_id, status=FAILED, error=getattr(e, "detail", None) or str(e))
+            print(f" Job {job_id} failed: {e}")
+
+        await fileio.remove(job["input_path"])
+        if job["callback_url"]:
+            await self._callback(await self.get(job_id))
+
+    async def _callback(self, job: dict):
+        try:
+            # Checked again: the host's DNS may have changed since submit.
+            # Redirects are not followed, they could point anywhere
+            address = await check_callback_url(job["callback_url"])
+            url, headers, extensions = _pinned(job["callback_url"], address)
+            await get_client().post(url, json=public_view(job), headers=headers, extensions=extensions,
+                                    timeout=CALLBACK_TIMEOUT, follow_redirects=False)
+        except Exception as e:
+            print(f" Callback for job {job['id']} failed: {e}")
+
+
+def _result_dir(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, "results", job_id)
+
+
+def _pin_result(job_id: str, result_path: str) -> str:
+    """The job's own hard link to its result (a copy across filesystems),
+    under the result's file name — routers/jobs.py reads the cache key from it."""
+    directory = _result_dir(job_id)
+    os.makedirs(directory, exist_ok=True)
+    pinned = os.path.join(directory, os.path.basename(result_path))
+    try:
+        os.link(result_path, pinned)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(result_path, pinned)
+    return pinned
+
+
+def _pinned(url: str, address: str) -> tuple:
+    """(url, headers, extensions) that connect to the checked address while
+    keeping the original Host header and TLS server name."""
+    import httpx
+
+    if address is None:
+        return url, {}, {}
+    parsed = httpx.URL(url)
+    return (parsed.copy_with(host=address), {"Host": parsed.netloc.decode("ascii")},
+            {"sni_hostname": parsed.host})
+
+
+async def check_callback_url(url: str):
+    """
+    Raise InvalidCallback unless url is http(s) and its host resolves only
+    to public addresses (or is in JOB_CALLBACK_ALLOW_HOSTS). Returns the
+    address to connect to, or None for an allow-listed host.
+    """
+    import httpx
+
+    try:
+        parsed = httpx.URL(url)
+    except (httpx.InvalidURL, TypeError, ValueError) as e:
+        raise InvalidCallback(f"callback_url is not a valid URL: {e}")
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        raise InvalidCallback("callback_url must be an http:// or https:// URL with a host")
+
+    host = parsed.host.lower()
+    if host in CALLBACK_ALLOW_HOSTS:
+        return None
+    try:
+        addresses = [ipaddress.ip_address(host)]
+    except ValueError:
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, parsed.port, type=socket.SOCK_STREAM)
+        except (socket.gaierror, UnicodeError):
+            raise InvalidCallback(f"callback_url host {host!r} does not resolve")
+        addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+
+    for address in addresses:
+        address = getattr(address, "ipv4_mapped", None) or address
+        if not address.is_global:
+            raise InvalidCallback(f"callback_url host {host!r} is not a public address")
+    return str(addresses[0])
+
+
+def public_view(job: dict) -> dict:
+    """Job fields safe to hand back to clients."""
+    view = {
+        "job_id":     job["id"],
+        "kind":       job["kind"],
+        "status":     job["status"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+    if job["status"] == SUCCEEDED:
+        view["result_url"] = f"/api/jobs/{job['id']}/result"
+    if job["status"] == FAILED:
+        view["error"] = job["error"]
+    return view
+
+
+job_queue = JobQueue()
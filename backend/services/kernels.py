@@ -0,0 +1,110 @@
+# backend/services/kernels.py
+"""
+Vectorized NumPy kernels for the enhance pipeline.
+
+apply_tone() reproduces Pillow's Brightness → Contrast → Color chain
+bit-for-bit on a single uint8 buffer, in place:
+
+  * ImageEnhance is Image.blend(degenerate, image, f), i.e.
+    trunc(clip(deg + f * (x - deg))) in float32.
+  * Brightness and Contrast are per-channel, so both fold into one 256-entry
+    lookup table. Contrast pivots on the mean grey level of the brightened
+    image, which costs one read-only pass.
+  * Color blends each channel with the pixel's luma. Its output depends only
+    on (luma, channel value), so with the tone LUT folded in it becomes a
+    single 256x256 table lookup per channel.
+
+Work is done in small row blocks so temporaries stay in cache, instead of the
+six full frames (three results + three degenerate images) Pillow allocates.
+"""
+import numpy as np
+
+
+BLOCK_ROWS = 32
+
+# ITU-R 601-2 luma in 16-bit fixed point, exactly as Pillow's RGB → L
+_LUMA_WEIGHTS = (19595, 38470, 7471)
+
+_LEVELS = np.arange(256, dtype=np.float32)
+
+
+def _blend(degenerate, values, factor: float) -> np.ndarray:
+    """Pillow's Image.blend arithmetic: float32, clipped, truncated to uint8."""
+    out = degenerate + np.float32(factor) * (values - degenerate)
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+
+def _luma_luts(lut: np.ndarray):
+    """Weighted per-channel LUTs so luma(lut[px]) is three lookups and a shift."""
+    lut = lut.astype(np.uint32)
+    r, g, b = (lut * w for w in _LUMA_WEIGHTS)
+    r += 0x8000  # rounding term, folded into the red table
+    return r, g, b
+
+
+def _luma(block: np.ndarray, luts) -> np.ndarray:
+    r, g, b = luts
+    y = np.take(r, block[..., 0])
+    y += np.take(g, block[..., 1])
+    y += np.take(b, block[..., 2])
+    y >>= 16
+    return y
+
+
+def _row_blocks(pixels: np.ndarray):
+    for top in range(0, pixels.shape[0], BLOCK_ROWS):
+        yield pixels[top:top + BLOCK_ROWS]
+
+
+def brightness_lut(brightness: float) -> np.ndarray:
+    """Pillow's Brightness enhancer (blend against black) as a 256-entry LUT."""
+    return _blend(np.float32(0), _LEVELS, brightness)
+
+
+def tone_lut(brightness: float, contrast: float, mean: int) -> np.ndarray:
+    """Compose Brightness then Contrast (around the given mean) into one LUT."""
+    bright = brightness_lut(brightness)
+    return _blend(np.float32(mean), bright.astype(np.float32), contrast)
+
+
+def color_table(vibrance: float, lut: np.ndarray) -> np.ndarray:
+    """Flattened 256x256 table: [luma << 8 | raw value] → Color(lut[value])."""
+    grey = _LEVELS[:, None]
+    return _blend(grey, lut.astype(np.float32)[None, :], vibrance).ravel()
+
+
+def luma_sum(pixels: np.ndarray, lut: np.ndarray = None) -> int:
+    """Sum of the grey levels of lut[pixels]."""
+    if lut is None:
+        lut = np.arange(256, dtype=np.uint8)
+    luts  = _luma_luts(lut)
+    total = 0
+    for block in _row_blocks(pixels):
+        total += int(_luma(block, luts).sum(dtype=np.uint64))
+    return total
+
+
+def mean_luma(pixels: np.ndarray, lut: np.ndarray = None) -> int:
+    """Rounded mean grey level of lut[pixels], as ImageEnhance.Contrast computes it."""
+    count = pixels.shape[0] * pixels.shape[1]
+    return int(luma_sum(pixels, lut) / count + 0.5) if count else 0
+
+
+def apply_tone(pixels: np.ndarray, brightness: float, contrast: float, vibrance: float,
+               mean: int = None):
+    """Brightness, contrast and vibrance in one pass over an (H, W, 3) uint8 array.
+
+    `mean` is the contrast pivot (mean grey of the brightened image); pass it
+    when the caller already knows it, e.g. when processing tile by tile.
+    """
+    if mean is None:
+        mean = mean_luma(pixels, brightness_lut(brightness))
+    lut   = tone_lut(brightness, contrast, mean)
+    luts  = _luma_luts(lut)
+    table = color_table(vibrance, lut)
+
+    for block in _row_blocks(pixels):
+        index = _luma(block, luts)
+        index <<= 8
+        np.take(table, index[..., None] + block, out=block)
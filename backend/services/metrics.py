@@ -0,0 +1,275 @@
+# backend/services/metrics.py
+"""
+In-process metrics in the Prometheus text format, served at GET /metrics.
+
+Deliberately tiny: counters, gauges and histograms with labels, plus gauges
+whose values are computed at scrape time (pool depth, cache hit rates, ...).
+Everything lives in the API process; pool workers send their per-stage
+timings back with each result (see pipeline.timed) and the route records
+them here.
+"""
+import os
+import math
+import time
+import bisect
+import asyncio
+from contextlib import contextmanager
+
+
+# Seconds, from a fast kernel stage up to a slow video generation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Event-loop stalls: anything past a few ms holds up every request on the loop
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.05))  # seconds between probes
+
+REGISTRY = []
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Base for counters and gauges. With collect, values are computed at scrape
+    time instead: collect() -> {label-values tuple: value}.
+    """
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), collect=None):
+        self.name       = name
+        self.help       = help
+        self.labelnames = tuple(labelnames)
+        self._values    = {}
+        self._collector = collect
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._collect().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+    def _collect(self) -> dict:
+        if self._collector is None:
+            return self._values
+        return {tuple(str(v) for v in key): value for key, value in self._collector().items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key    = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            # per-bucket counts (non-cumulative), then the sum
+            series = self._values[key] = [0] * len(self.buckets) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─── Instruments ──────────────────────────────────────────────────────────────
+
+REQUEST_SECONDS = Histogram(
+    "imagify_http_request_duration_seconds",
+    "Request time until the last body byte was sent.",
+    ("method", "route", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "imagify_http_requests_in_flight",
+    "Requests currently being handled.",
+    ("method", "route"),
+)
+STAGE_SECONDS = Histogram(
+    "imagify_stage_duration_seconds",
+    "Time spent in each processing stage of a request.",
+    ("op", "stage"),
+)
+REPLICATE_SECONDS = Histogram(
+    "imagify_replicate_duration_seconds",
+    "Replicate prediction phases: slot (waiting for a local concurrency slot), "
+    "queue (remote, before the model started) and run (model running).",
+    ("model", "phase"),
+)
+REPLICATE_PREDICTIONS = Counter(
+    "imagify_replicate_predictions_total",
+    "Finished Replicate predictions by outcome.",
+    ("model", "outcome"),
+)
+
+
+EVENT_LOOP_LAG = Histogram(
+    "imagify_event_loop_lag_seconds",
+    "How late the event loop ran a timer: time it spent blocked by synchronous work.",
+    buckets=LOOP_LAG_BUCKETS,
+)
+
+
+def observe_stages(op: str, timings: dict):
+    """Record a {stage: seconds} dict, e.g. one returned by pipeline.timed."""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, op=op, stage=stage)
+
+
+@contextmanager
+def stage(op: str, name: str):
+    with STAGE_SECONDS.time(op=op, stage=name):
+        yield
+
+
+# ─── Event-loop lag ───────────────────────────────────────────────────────────
+
+class LoopLagMonitor:
+    """
+    Sleeps `interval` seconds over and over on the event loop; however much
+    later than that it wakes up, the loop was busy running something else
+    without yielding. Each probe goes into EVENT_LOOP_LAG; max_lag is the
+    worst since start.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.max_lag  = 0.0
+        self._task    = None
+
+    async def _loop(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            EVENT_LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    async def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+loop_monitor = LoopLagMonitor()
+
+
+# ─── HTTP middleware ──────────────────────────────────────────────────────────
+
+class MetricsMiddleware:
+    """
+    Per-route request duration and in-flight gauges. Pure ASGI, so streamed
+    responses are timed until their last chunk.
+
+    The route template is known once the router has matched — by the time the
+    endpoint reads the body or starts answering — so that is when a request
+    starts counting as in flight.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        route  = None
+        status = 500
+
+        def routed():
+            nonlocal route
+            if route is None:
+                route = getattr(scope.get("route"), "path", "other")
+                REQUESTS_IN_FLIGHT.inc(method=method, route=route)
+
+        async def receive_wrapper():
+            routed()
+            return await receive()
+
+        async def send_wrapper(message):
+            nonlocal status
+            routed()
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            routed()
+            REQUESTS_IN_FLIGHT.dec(method=method, route=route)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=method, route=route, status=status)
@@ -0,0 +1,234 @@
+# backend/services/pipeline.py
+from PIL import Image, ImageEnhance, ImageFilter
+from contextlib import contextmanager
+import numpy as np
+import contextvars
+import time
+import io
+import os
+
+from services import kernels
+
+
+UNSHARP_RADIUS = 2
+
+# Output formats the enhance route can return, with their media types
+OUTPUT_FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Long edge of live slider previews (preview_bytes)
+PREVIEW_MAX_SIZE = int(os.getenv("ENHANCE_PREVIEW_SIZE", 640))
+
+# Rows of context a stage reads above/below each output pixel. Tiled mode
+# pads every strip with the sum of these so strip edges never show.
+KERNEL_HALO  = 1                       # 3x3 kernels: Sharpness, SHARPEN, DETAIL, SMOOTH
+UNSHARP_HALO = 3 * UNSHARP_RADIUS + 1  # Pillow's gaussian is 3 box-blur passes
+
+# {stage: seconds} of the enhance running in this context, while timed() is active
+_timings = contextvars.ContextVar("pipeline_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Add the block's duration to the current timings (no-op outside timed())."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def timed(fn, *args):
+    """
+    Call fn(*args) and return (result, {stage: seconds}, total seconds).
+
+    Works across the process pool: the worker measures its own stages and the
+    timings travel back with the result. Tiled runs sum each stage over strips.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    start = time.perf_counter()
+    try:
+        return fn(*args), timings, time.perf_counter() - start
+    finally:
+        _timings.reset(token)
+
+
+def tone_factors(enh: float):
+    """Brightness, contrast and vibrance factors for the enhancement slider."""
+    return (
+        1.0 + (enh - 50) * 0.008,
+        1.0 + (enh - 50) * 0.012,
+        max(0.0, 1.0 + (enh - 50) * 0.006),
+    )
+
+
+def clarity_passes(clarity: float) -> int:
+    return int(1 + (abs(clarity - 50) / 25))  # 1–3 passes based on strength
+
+
+def apply_tone(image: Image.Image, enh: float, mean: int = None) -> Image.Image:
+    """Brightness, contrast and vibrance — the per-pixel part of the chain."""
+
+    # ─── 1–3. BRIGHTNESS / CONTRAST / VIBRANCE (one fused NumPy pass) ────────
+    # Bit-identical to chaining ImageEnhance.Brightness → Contrast → Color,
+    # see services/kernels.py.
+    if enh == 50:
+        return image
+
+    with stage("tone"):
+        pixels = np.array(image)
+        kernels.apply_tone(pixels, *tone_factors(enh), mean=mean)
+        return Image.fromarray(pixels)
+
+
+def apply_sharpness(image: Image.Image, sharp: float) -> Image.Image:
+    # ─── 4. SHARPNESS ────────────────────────────────────────────────────────
+    if sharp != 50:
+        with stage("sharpness"):
+            sharp_factor = 1.0 + (sharp - 50) * 0.06
+            image = ImageEnhance.Sharpness(image).enhance(max(0.0, sharp_factor))
+    return image
+
+
+def apply_clarity(image: Image.Image, clarity: float) -> Image.Image:
+    # ─── 5. CLARITY (multi-pass unsharp via Pillow filters) ──────────────────
+    if clarity != 50:
+        with stage("clarity"):
+            for _ in range(clarity_passes(clarity)):
+                image = image.filter(ImageFilter.UnsharpMask(
+                    radius=UNSHARP_RADIUS,
+                    percent=int((clarity - 50) * 3),
+                    threshold=2
+                ))
+
+        if clarity > 70:
+            with stage("clarity_detail"):
+                image = image.filter(ImageFilter.SHARPEN)
+                image = image.filter(ImageFilter.DETAIL)
+                if clarity > 85:
+                    image = image.filter(ImageFilter.SHARPEN)
+    return image
+
+
+def apply_denoise(image: Image.Image, enh: float, sharp: float, clarity: float) -> Image.Image:
+    # ─── 6. NOISE REDUCTION ──────────────────────────────────────────────────
+    if enh > 70 or sharp > 70 or clarity > 70:
+        with stage("denoise"):
+            image = image.filter(ImageFilter.SMOOTH)
+    return image
+
+
+def apply_filters(image: Image.Image, enh: float, sharp: float, clarity: float) -> Image.Image:
+    """Sharpness, clarity and smoothing — the neighbourhood part of the chain."""
+    image = apply_sharpness(image, sharp)
+    image = apply_clarity(image, clarity)
+    return apply_denoise(image, enh, sharp, clarity)
+
+
+def filter_halo(enh: float, sharp: float, clarity: float) -> int:
+    """Total rows of context apply_filters() needs for these settings."""
+    halo = 0
+    if sharp != 50:
+        halo += KERNEL_HALO
+    if clarity != 50:
+        halo += clarity_passes(clarity) * UNSHARP_HALO
+        if clarity > 70:
+            halo += 2 * KERNEL_HALO
+        if clarity > 85:
+            halo += KERNEL_HALO
+    if enh > 70 or sharp > 70 or clarity > 70:
+        halo += KERNEL_HALO
+    return halo
+
+
+def apply_adjustments(image: Image.Image, enh: float, sharp: float, clarity: float) -> Image.Image:
+    """Run the slider filter chain on an RGB image and return the result."""
+    image = apply_tone(image, enh)
+    return apply_filters(image, enh, sharp, clarity)
+
+
+def encode(image: Image.Image, sink, fmt: str = "png", quality: int = 90, fast: bool = False):
+    """Encode the result; lossy formats skip the costly optimize=True PNG pass.
+    fast=True (previews) trades PNG size for speed."""
+    with stage("encode"):
+        if fmt == "png" and fast:
+            image.save(sink, format="PNG", compress_level=1)
+        elif fmt == "png":
+            image.save(sink, format="PNG", optimize=True)
+        else:
+            image.save(sink, format=fmt.upper(), quality=quality)
+
+
+def open_thumbnail(fp, max_size: int, resample=Image.LANCZOS, reducing_gap: float = 2.0) -> Image.Image:
+    """
+    Decode fp to an RGB image no larger than max_size on either edge.
+
+    thumbnail() runs on the still-unloaded image, so JPEGs are decoded at
+    1/2–1/8 scale in the DCT domain (Image.draft) and other formats are
+    shrunk by an integer reduce() before the resampling pass — the
+    full-size frame of a large JPEG is never materialized.
+    """
+    with stage("decode"):
+        image = Image.open(fp)
+        if image.mode in ("P", "1"):
+            image = image.convert("RGB")  # resizing palette images would fall back to NEAREST
+        image.thumbnail((max_size, max_size), resample, reducing_gap=reducing_gap)
+        image.load()  # thumbnail() leaves an image that already fits unloaded, still reading fp
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def enhance_bytes(image_bytes: bytes, enh: float, sharp: float, clarity: float,
+                  tiled: bool = None, fmt: str = "png", quality: int = 90) -> bytes:
+    """Decode, enhance and encode an upload. Runs inside a pool worker.
+
+    Large images (or tiled=True) go through the strip-wise path in
+    services/tiling.py: the filter chain's working set stays within the tile
+    budget, on top of the decoded source (reused as the JPEG/WebP output
+    frame) and the encoded result, which is returned whole.
+    """
+    from services import tiling
+
+    with stage("decode"):
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+    if tiled is None:
+        tiled = image.width * image.height >= tiling.TILED_MIN_PIXELS
+    buffer = io.BytesIO()
+    if tiled:
+        tiling.enhance_tiled(image, enh, sharp, clarity, buffer, fmt=fmt, quality=quality, in_place=True)
+        return buffer.getvalue()
+
+    with stage("decode"):
+        image = image.convert("RGB")
+    image = apply_adjustments(image, enh, sharp, clarity)
+    encode(image, buffer, fmt, quality)
+    return buffer.getvalue()
+
+
+def preview_bytes(fp, enh: float, sharp: float, clarity: float,
+                  fmt: str = "png", quality: int = 90, max_size: int = PREVIEW_MAX_SIZE) -> bytes:
+    """Fast low-resolution enhance for live slider previews.
+
+    Decodes straight to preview size with a cheaper resample and encodes
+    fast, so a drag costs tens of milliseconds instead of seconds. Filters
+    act on preview-scale pixels, so sharpening looks a little stronger than
+    on the full-size result.
+    """
+    image = open_thumbnail(fp, max_size, Image.BILINEAR, reducing_gap=1.5)
+    image = apply_adjustments(image, enh, sharp, clarity)
+    buffer = io.BytesIO()
+    encode(image, buffer, fmt, quality, fast=True)
+    return buffer.getvalue()
+
+
+def jpeg_bytes(image_bytes: bytes, quality: int = 95) -> bytes:
+    """Re-encode an upload as JPEG (the smile fallback). Runs inside a pool worker."""
+    with stage("decode"):
+        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    buffer = io.BytesIO()
+    encode(image, buffer, "jpeg", quality)
+    return buffer.getvalue()
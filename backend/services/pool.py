@@ -0,0 +1,245 @@
+# backend/services/pool.py
+import os
+import asyncio
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException
+
+from services import shared
+
+
+# ─── Config (env overrides) ───────────────────────────────────────────────────
+# Every API worker process has its own pool; together they cover the cores
+POOL_WORKERS   = int(os.getenv("ENHANCE_POOL_WORKERS", max(1, (os.cpu_count() or 1) // shared.WORKERS)))
+POOL_MAX_QUEUE = int(os.getenv("ENHANCE_POOL_MAX_QUEUE", POOL_WORKERS * 2))
+POOL_TIMEOUT   = float(os.getenv("ENHANCE_POOL_TIMEOUT", 30))
+# Video variants (services/transcode.py): ffmpeg is multi-threaded itself
+VIDEO_POOL_WORKERS   = int(os.getenv("VIDEO_POOL_WORKERS", max(1, POOL_WORKERS // 4)))
+VIDEO_POOL_MAX_QUEUE = int(os.getenv("VIDEO_POOL_MAX_QUEUE", VIDEO_POOL_WORKERS * 4))
+VIDEO_POOL_TIMEOUT   = float(os.getenv("VIDEO_POOL_TIMEOUT", 90))
+# Live previews and smile compression: short decode-to-thumbnail jobs, in their
+# own processes so they neither queue behind full-size enhances nor hold the
+# event loop's GIL (Pillow decodes with it held)
+THUMBNAIL_POOL_WORKERS   = int(os.getenv("THUMBNAIL_POOL_WORKERS", max(1, POOL_WORKERS // 2)))
+THUMBNAIL_POOL_MAX_QUEUE = int(os.getenv("THUMBNAIL_POOL_MAX_QUEUE", THUMBNAIL_POOL_WORKERS * 8))
+THUMBNAIL_POOL_TIMEOUT   = float(os.getenv("THUMBNAIL_POOL_TIMEOUT", 10))
+# Enhance session renders: threads of the API process (they use the session's decoded image)
+SESSION_RENDERS        = int(os.getenv("ENHANCE_SESSION_RENDERS", POOL_WORKERS))
+SESSION_RENDER_QUEUE   = int(os.getenv("ENHANCE_SESSION_MAX_QUEUE", SESSION_RENDERS * 2))
+SESSION_RENDER_TIMEOUT = float(os.getenv("ENHANCE_SESSION_TIMEOUT", POOL_TIMEOUT))
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class PoolError(Exception):
+    """Raised when a job's worker died (OOM-killed, crashed, or killed when a
+    hung job recycled the pool); base class of the pool's other errors."""
+
+
+class PoolBusy(PoolError):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class PoolTimeout(PoolError):
+    """Raised when a job does not finish within its timeout."""
+
+
+@contextmanager
+def http_errors(queue: str, action: str):
+    """
+    Turn pool errors raised in the block into HTTP errors: 429 when the
+    `queue` is full, 504 when `action` timed out, 503 when its worker died.
+    The retryable ones carry Retry-After.
+    """
+    try:
+        yield
+    except PoolBusy:
+        raise HTTPException(
+            status_code=429,
+            detail=f"{queue} queue is full, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    except PoolTimeout:
+        raise HTTPException(status_code=504, detail=f"{action} timed out")
+    except PoolError:
+        raise HTTPException(
+            status_code=503,
+            detail=f"{queue} worker failed, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+
+
+class WorkerPool:
+    """Process pool with a bounded number of in-flight jobs.
+
+    A job keeps its slot until its worker actually finishes — a timed-out job
+    is still burning a CPU, so it must keep counting against the bound. A job
+    that times out while running retires its executor: new jobs go to a fresh
+    one, and the old one's processes are killed once its other jobs are done
+    (or have had `timeout` seconds to finish), which frees the hung slot.
+    """
+
+    def __init__(self, workers: int, max_queue: int, timeout: float):
+        self.workers   = workers
+        self.max_queue = max_queue
+        self.timeout   = timeout
+        self.in_flight = 0
+        self.recycled  = 0
+        self._executor = None
+        self._jobs     = {}  # executor -> its unfinished concurrent futures
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.in_flight - self.workers)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._jobs[self._executor] = set()
+        return self._executor
+
+    def _submit(self, fn, *args):
+        executor = self._get_executor()
+        cfuture  = executor.submit(fn, *args)
+        jobs     = self._jobs[executor]
+        jobs.add(cfuture)
+        cfuture.add_done_callback(jobs.discard)
+        return executor, cfuture
+
+    def _release(self, _future):
+        self.in_flight -= 1
+
+    async def run(self, fn, *args, timeout: float = None):
+        """Run fn(*args) in a worker process, raising PoolBusy / PoolTimeout,
+        or PoolError when its worker died."""
+        if self.in_flight >= self.capacity:
+            raise PoolBusy(f"{self.in_flight} jobs in flight (limit {self.capacity})")
+
+        try:
+            executor, cfuture = self._submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed) — start a fresh pool and retry once
+            print(" Worker pool broken, restarting it")
+            self._discard(self._executor)
+            executor, cfuture = self._submit(fn, *args)
+
+        self.in_flight += 1
+        future = asyncio.wrap_future(cfuture)
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            # A job that never started just leaves the queue; a running one
+            # holds a worker that may never come back
+            if not cfuture.cancel():
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())  # nobody awaits it now
+                self._retire(executor, cfuture)
+            raise PoolTimeout(f"Job did not finish within {timeout or self.timeout}s")
+        except BrokenProcessPool as e:
+            self._discard(executor)
+            raise PoolError(f"Worker process died: {e}")
+
+    def _retire(self, executor: ProcessPoolExecutor, hung):
+        if executor is not self._executor:
+            return  # already retired by another timed-out job
+        print(" Pool job timed out while running, recycling the worker pool")
+        self._executor = None
+        self.recycled += 1
+        others = [f for f in self._jobs.get(executor, ()) if f is not hung]
+        asyncio.ensure_future(self._reap(executor, others))
+
+    async def _reap(self, executor: ProcessPoolExecutor, others: list):
+        if others:
+            await asyncio.wait([asyncio.wrap_future(f) for f in others], timeout=self.timeout)
+        _kill(executor)  # whatever is left on it fails with BrokenProcessPool
+        self._jobs.pop(executor, None)
+        executor.shutdown(wait=False)
+
+    def _discard(self, executor: ProcessPoolExecutor):
+        if executor is None:
+            return
+        if executor is self._executor:
+            self._executor = None
+        self._jobs.pop(executor, None)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        for executor in list(self._jobs):
+            self._discard(executor)
+        self._executor = None
+
+
+class ThreadPool:
+    """WorkerPool's bound, queue and timeout for work that has to run in this
+    process, on threads.
+
+    A thread cannot be killed, so a job that times out while running keeps
+    its slot until it returns; one still waiting for a slot just leaves.
+    """
+
+    def __init__(self, workers: int, max_queue: int, timeout: float):
+        self.workers   = workers
+        self.max_queue = max_queue
+        self.timeout   = timeout
+        self.in_flight = 0
+        self._slots    = asyncio.Semaphore(workers)
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.in_flight - self.workers)
+
+    def _release(self, _task):
+        self.in_flight -= 1
+
+    async def run(self, fn, *args, timeout: float = None):
+        """Run fn(*args) in a thread, raising PoolBusy / PoolTimeout."""
+        if self.in_flight >= self.capacity:
+            raise PoolBusy(f"{self.in_flight} jobs in flight (limit {self.capacity})")
+
+        started = False
+
+        async def job():
+            nonlocal started
+            async with self._slots:
+                started = True
+                return await asyncio.to_thread(fn, *args)
+
+        self.in_flight += 1
+        task = asyncio.ensure_future(job())
+        task.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            if started:
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())  # nobody awaits it now
+            else:
+                task.cancel()
+            raise PoolTimeout(f"Job did not finish within {timeout or self.timeout}s")
+
+
+def _kill(executor: ProcessPoolExecutor):
+    """Terminate an executor's worker processes; their jobs fail with BrokenProcessPool."""
+    terminate = getattr(executor, "terminate_workers", None)  # Python 3.14+
+    if terminate is not None:
+        terminate()
+        return
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        if process.is_alive():
+            process.terminate()
+
+
+enhance_pool = WorkerPool(POOL_WORKERS, POOL_MAX_QUEUE, POOL_TIMEOUT)
+video_pool   = WorkerPool(VIDEO_POOL_WORKERS, VIDEO_POOL_MAX_QUEUE, VIDEO_POOL_TIMEOUT)
+thumbnail_pool = WorkerPool(THUMBNAIL_POOL_WORKERS, THUMBNAIL_POOL_MAX_QUEUE, THUMBNAIL_POOL_TIMEOUT)
+session_pool = ThreadPool(SESSION_RENDERS, SESSION_RENDER_QUEUE, SESSION_RENDER_TIMEOUT)
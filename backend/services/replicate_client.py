@@ -0,0 +1,192 @@
+# backend/services/replicate_client.py
+"""
+Shared Replicate client for the smile service and the video router.
+
+One replicate.Client per process, so its httpx connection pool is reused
+across requests. Predictions are created and polled with the library's native
+async calls, a semaphore caps how many run at once, and a prediction that
+times out (or whose request is cancelled) is cancelled on Replicate's side
+too instead of being left running and billing.
+
+The replicate package (and httpx under it) is not imported at startup:
+warm_up(), started once the app is ready, imports it and builds the clients
+in a thread — a first import and TLS setup on the event loop would stall
+every other request for a few hundred milliseconds — and a prediction that
+comes sooner builds them itself. The Replicate client gets its httpx
+transport through the constructor's transport argument, so the TLS context is
+built up front and the connections are closed through the transport. The
+library's private client is left alone. The concurrency cap is shared by all
+worker processes when serve.py runs several.
+"""
+import os
+import time
+import asyncio
+from pathlib import Path
+
+from services import http_client, metrics, shared
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+REPLICATE_CONCURRENCY = int(os.getenv("REPLICATE_CONCURRENCY", 8))
+POLL_INTERVAL         = float(os.getenv("REPLICATE_POLL_INTERVAL", 1.0))
+API_TIMEOUT           = 30  # seconds; connecting gets 5
+
+_token     = None
+_client    = None
+_transport = None  # _client's httpx transport: ours to close
+_semaphore = shared.limiter("replicate", REPLICATE_CONCURRENCY)
+_active    = 0
+
+
+def get_token() -> str:
+    """Token from the environment (or backend/.env), looked up once."""
+    global _token
+    if _token is None:
+        token = os.environ.get("REPLICATE_API_TOKEN", "")
+        if not token:
+            from dotenv import load_dotenv
+
+            load_dotenv(dotenv_path=BASE_DIR / ".env", override=True)
+            token = os.environ.get("REPLICATE_API_TOKEN", "")
+        if not token:
+            raise Exception("REPLICATE_API_TOKEN not set! Check your backend/.env file")
+        _token = token
+    return _token
+
+
+def get_client() -> "replicate.Client":
+    global _client, _transport
+    if _client is None:
+        _client, _transport = _build(get_token())
+    return _client
+
+
+def _build(token: str) -> tuple:
+    """(client, transport). Creating the transport sets up its TLS context."""
+    import httpx
+    import replicate
+
+    transport = httpx.AsyncHTTPTransport()
+    client = replicate.Client(api_token=token, timeout=httpx.Timeout(API_TIMEOUT, connect=5),
+                              transport=transport)
+    return client, transport
+
+
+async def warm_up():
+    """Import replicate and build both HTTP clients off the event loop."""
+    global _client, _transport
+    try:
+        await http_client.warm_up()
+        if _client is None:
+            client, transport = await asyncio.to_thread(_build, get_token())
+            if _client is None:
+                _client, _transport = client, transport
+            else:
+                await transport.aclose()
+    except Exception as e:
+        print(f" Replicate warm-up skipped: {e}")
+
+
+def in_flight() -> int:
+    """Predictions currently holding a concurrency slot."""
+    return _active
+
+
+async def run(ref: str, input: dict, timeout: float):
+    """
+    Run a model ("owner/name" or "owner/name:version") and return its output.
+    Raises asyncio.TimeoutError after `timeout` seconds, cancelling the
+    remote prediction first.
+    """
+    from replicate.exceptions import ModelError
+
+    global _active
+    model = ref.split(":")[0]
+    start = time.perf_counter()
+    async with _semaphore:
+        metrics.REPLICATE_SECONDS.observe(time.perf_counter() - start, model=model, phase="slot")
+        _active += 1
+        outcome = "error"
+        try:
+            prediction = await _create(ref, input)
+            print(f" Prediction {prediction.id} created for {model}")
+            try:
+                output = await asyncio.wait_for(_wait(prediction, model), timeout)
+                outcome = "succeeded"
+                return output
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                await _cancel(prediction)
+                raise
+            except asyncio.CancelledError:
+                outcome = "canceled"
+                await _cancel(prediction)
+                raise
+            except ModelError:
+                outcome = "failed"
+                raise
+        finally:
+            _active -= 1
+            metrics.REPLICATE_PREDICTIONS.inc(model=model, outcome=outcome)
+
+
+async def fetch(url: str) -> bytes:
+    """Download a (small) prediction output file over the shared HTTP pool."""
+    response = await http_client.get_client().get(str(url))
+    response.raise_for_status()
+    return response.content
+
+
+async def _create(ref: str, input: dict):
+    client = get_client()
+    model, _, version = ref.partition(":")
+    if version:
+        return await client.predictions.async_create(version=version, input=input)
+    return await client.models.predictions.async_create(model=model, input=input)
+
+
+async def _wait(prediction, model: str = ""):
+    created = started = time.perf_counter()
+    while prediction.status not in ("succeeded", "failed", "canceled"):
+        await asyncio.sleep(POLL_INTERVAL)
+        await prediction.async_reload()
+        if prediction.status == "starting":
+            started = time.perf_counter()
+    _observe_phases(prediction, model, created, started)
+
+    if prediction.status == "failed":
+        from replicate.exceptions import ModelError
+
+        raise ModelError(prediction)
+    if prediction.status == "canceled":
+        raise Exception(f"Prediction {prediction.id} was canceled")
+    return prediction.output
+
+
+def _observe_phases(prediction, model: str, created: float, started: float):
+    """
+    Split a prediction's time into remote queueing and model run. Replicate
+    reports the run as metrics["predict_time"]; without it, fall back to
+    when polling last saw the prediction still "starting".
+    """
+    total        = time.perf_counter() - created
+    predict_time = (prediction.metrics or {}).get("predict_time")
+    run          = min(total, predict_time) if predict_time is not None else time.perf_counter() - started
+    metrics.REPLICATE_SECONDS.observe(total - run, model=model, phase="queue")
+    metrics.REPLICATE_SECONDS.observe(run, model=model, phase="run")
+
+
+async def _cancel(prediction):
+    try:
+        await asyncio.shield(prediction.async_cancel())
+        print(f" Canceled prediction {prediction.id}")
+    except Exception as e:
+        print(f" Could not cancel prediction {prediction.id}: {e}")
+
+
+async def close():
+    global _client, _transport
+    if _transport is not None:
+        await _transport.aclose()
+    _client = _transport = None
@@ -0,0 +1,196 @@
+# backend/services/resilience.py
+"""
+Retry and circuit-breaker layer for calls to upstream services (Replicate).
+
+call() retries transient failures with capped exponential backoff and full
+jitter, inside an overall deadline so a request can never spend longer than
+that on an upstream. Errors are classified first: auth, billing and input
+errors (401/402/403/404/422) or a model rejecting its input fail at once,
+since retrying cannot help.
+
+Each upstream has a CircuitBreaker. When the failure rate over a rolling
+window crosses the threshold the breaker opens and calls fail immediately
+with CircuitOpen — callers then take their fallback without waiting on a
+struggling upstream. After a cool-down one probe call is let through
+(half-open); its outcome closes the breaker or re-opens it.
+"""
+import os
+import time
+import random
+import asyncio
+from collections import deque
+
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# HTTP statuses that mean "this request will never succeed as sent"
+NON_RETRYABLE_STATUS = {400, 401, 402, 403, 404, 422}
+
+
+class CircuitOpen(Exception):
+    """The upstream's breaker is open; the call was not attempted."""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name        = name
+        self.retry_after = retry_after
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+
+
+def status_of(exc: Exception):
+    """HTTP status carried by an upstream error, if any."""
+    # Imported here so startup doesn't pay for them; anything that can raise
+    # these has imported them already
+    import httpx
+    from replicate.exceptions import ReplicateError
+
+    if isinstance(exc, ReplicateError):
+        return exc.status
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Transient failures (timeouts, network errors, 429/5xx) are worth retrying."""
+    from replicate.exceptions import ModelError
+
+    if isinstance(exc, (CircuitOpen, ModelError)):
+        return False
+    return status_of(exc) not in NON_RETRYABLE_STATUS
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff for the given (1-based) attempt."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def _env(name: str, setting: str, default: float) -> float:
+    return float(os.getenv(f"BREAKER_{name.upper()}_{setting}", default))
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 5,
+                 window: float = 60, reset_timeout: float = 30):
+        self.name          = name
+        self.failure_rate  = _env(name, "FAILURE_RATE", failure_rate)
+        self.min_calls     = int(_env(name, "MIN_CALLS", min_calls))
+        self.window        = _env(name, "WINDOW", window)
+        self.reset_timeout = _env(name, "RESET_TIMEOUT", reset_timeout)
+
+        self.state      = CLOSED
+        self._outcomes  = deque()  # (timestamp, ok), oldest first
+        self._opened_at = 0.0
+        self._probing   = False
+
+        self.opened   = 0
+        self.rejected = 0
+        self.retries  = 0
+
+    # ─── internals ───────────────────────────────────────────────────────────
+
+    def _trim(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def _open(self, now: float):
+        self.state      = OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self.opened += 1
+        print(f" Circuit '{self.name}' opened for {self.reset_timeout:.0f}s")
+
+    # ─── public API ──────────────────────────────────────────────────────────
+
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go through right now."""
+        if self.state == OPEN and self.retry_after() == 0:
+            self.state = HALF_OPEN
+        if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+            self.rejected += 1
+            raise CircuitOpen(self.name, max(self.retry_after(), 1))
+        if self.state == HALF_OPEN:
+            self._probing = True
+
+    def record_success(self):
+        if self.state == HALF_OPEN:
+            print(f" Circuit '{self.name}' closed")
+            self.state = CLOSED
+        self._probing = False
+        now = time.monotonic()
+        self._outcomes.append((now, True))
+        self._trim(now)
+
+    def record_failure(self):
+        now = time.monotonic()
+        self._probing = False
+        if self.state == HALF_OPEN:
+            self._open(now)
+            return
+        self._outcomes.append((now, False))
+        self._trim(now)
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+            self._open(now)
+
+    def stats(self) -> dict:
+        self._trim(time.monotonic())
+        calls    = len(self._outcomes)
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        return {
+            "state":        self.state,
+            "retry_after":  round(self.retry_after(), 1),
+            "window_calls": calls,
+            "failure_rate": round(failures / calls, 3) if calls else 0.0,
+            "opened":       self.opened,
+            "rejected":     self.rejected,
+            "retries":      self.retries,
+        }
+
+
+async def call(fn, *args, breaker: CircuitBreaker, attempts: int = 3,
+               base_delay: float = 1.0, max_delay: float = 8.0, deadline: float = None):
+    """
+    await fn(*args) under the breaker, retrying transient errors.
+
+    deadline bounds the whole thing (attempts plus backoff sleeps) in seconds;
+    on expiry the running attempt is cancelled and asyncio.TimeoutError raised.
+    """
+    give_up_at = time.monotonic() + deadline if deadline else None
+
+    for attempt in range(1, attempts + 1):
+        breaker.before_call()
+        try:
+            if give_up_at is None:
+                result = await fn(*args)
+            else:
+                result = await asyncio.wait_for(fn(*args), max(give_up_at - time.monotonic(), 0))
+        except asyncio.CancelledError:
+            breaker._probing = False
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                # The upstream answered; this request is just not servable
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            out_of_time = give_up_at is not None and time.monotonic() + delay >= give_up_at
+            if attempt == attempts or out_of_time:
+                raise
+            print(f" {breaker.name}: attempt {attempt} failed ({e!r}); retrying in {delay:.1f}s")
+            breaker.retries += 1
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+smile_breaker = CircuitBreaker("smile")
+video_breaker = CircuitBreaker("video")
+
+BREAKERS = (smile_breaker, video_breaker)
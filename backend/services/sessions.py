@@ -0,0 +1,233 @@
+# backend/services/sessions.py
+"""
+Enhance sessions: upload once, re-render on every slider change.
+
+A session keeps the decoded upload (full size, plus the preview-size decode
+preview_bytes would make) and memoizes the image after each stage of the
+chain, keyed by the slider values that stage depends on:
+
+    tone       (enh,)
+    sharpness  (enh, sharp)
+    clarity    (enh, sharp, clarity)
+    denoise    (enh, sharp, clarity)
+
+so moving only the clarity slider reuses the toned and sharpened image and
+reruns clarity and denoise alone. Results are identical to the stateless
+route's, and share its cache keys (derived from the upload's digest).
+
+Sessions live in this process's memory: they expire after SESSION_TTL idle
+seconds and the least recently used ones are dropped once all sessions
+together exceed SESSION_MEMORY_MB. When serve.py runs several worker
+processes, the upload is also spooled to a shared store, so a worker that
+didn't create a session rebuilds it from there on first use.
+
+Decodes run on services/pool.session_pool's threads, like renders, so a
+burst of large uploads queues (or gets 429) instead of decoding every full
+frame at once.
+"""
+import io
+import os
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from PIL import Image
+
+from services import fileio, ingest, pipeline, shared
+from services.cache import ResultCache
+from services.pool import session_pool, http_errors
+
+
+# ─── Config (env overrides) ───────────────────────────────────────────────────
+SESSION_TTL       = float(os.getenv("ENHANCE_SESSION_TTL", 900))
+SESSION_MEMORY_MB = float(os.getenv("ENHANCE_SESSION_MEMORY_MB", 1024))
+SESSION_MEMO_SIZE = int(os.getenv("ENHANCE_SESSION_MEMO", 2))  # images kept per stage
+# ─────────────────────────────────────────────────────────────────────────────
+
+MB = 1024 * 1024
+
+# Uploads behind live sessions, for the other worker processes. Kept a while
+# past SESSION_TTL: a session in steady use outlives its idle timeout.
+session_uploads = ResultCache("session_uploads", memory_mb=0, disk_mb=1024, ttl=SESSION_TTL * 4)
+
+STAGES = ("tone", "sharpness", "clarity", "denoise")
+
+_counters_lock = threading.Lock()  # sessions of one store render on several threads
+
+
+def _stages(enh: float, sharp: float, clarity: float) -> list:
+    """(name, memo prefix, fn) for each stage of the chain, in order."""
+    return [
+        ("tone",      (enh,),                lambda image: pipeline.apply_tone(image, enh)),
+        ("sharpness", (enh, sharp),          lambda image: pipeline.apply_sharpness(image, sharp)),
+        ("clarity",   (enh, sharp, clarity), lambda image: pipeline.apply_clarity(image, clarity)),
+        ("denoise",   (enh, sharp, clarity), lambda image: pipeline.apply_denoise(image, enh, sharp, clarity)),
+    ]
+
+
+def _nbytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class Session:
+    def __init__(self, digest, full: Image.Image, preview: Image.Image, counters: dict = None,
+                 session_id: str = None):
+        self.id        = session_id or uuid.uuid4().hex
+        self.digest    = digest  # sha256 of the upload, for cache keys
+        self.sources   = {"full": full, "preview": preview}
+        self.last_used = time.monotonic()
+        self.counters  = counters if counters is not None else {"reused": 0, "computed": 0}
+
+        # (scale, stage) -> OrderedDict(prefix -> image), LRU order
+        self._memo = {(scale, stage): OrderedDict() for scale in self.sources for stage in STAGES}
+        self._lock = threading.Lock()
+        self.nbytes = sum(_nbytes(image) for image in self.sources.values())
+
+    @property
+    def size(self) -> tuple:
+        return self.sources["full"].size
+
+    def _recount(self):
+        # Stages that change nothing hand back their input, so count each image once
+        images = {id(image): image for image in self.sources.values()}
+        for memo in self._memo.values():
+            images.update((id(image), image) for image in memo.values())
+        self.nbytes = sum(_nbytes(image) for image in images.values())
+
+    def render(self, scale: str, enh: float, sharp: float, clarity: float) -> Image.Image:
+        """The adjusted image, rerunning only the stages after the deepest memo hit.
+        Call from a worker thread; renders of one session are serialized."""
+        stages = _stages(enh, sharp, clarity)
+        with self._lock:
+            image, start = self.sources[scale], 0
+            for index in range(len(stages) - 1, -1, -1):
+                name, prefix, _ = stages[index]
+                memo = self._memo[(scale, name)]
+                if prefix in memo:
+                    memo.move_to_end(prefix)
+                    image, start = memo[prefix], index + 1
+                    break
+
+            for name, prefix, fn in stages[start:]:
+                image = fn(image)
+                memo = self._memo[(scale, name)]
+                memo[prefix] = image
+                while len(memo) > SESSION_MEMO_SIZE:
+                    memo.popitem(last=False)
+
+            self._recount()
+
+        with _counters_lock:
+            self.counters["reused"]   += start
+            self.counters["computed"] += len(stages) - start
+        return image
+
+    def render_bytes(self, scale: str, enh: float, sharp: float, clarity: float,
+                     fmt: str = "png", quality: int = 90) -> bytes:
+        image = self.render(scale, enh, sharp, clarity)
+        buffer = io.BytesIO()
+        pipeline.encode(image, buffer, fmt, quality, fast=scale == "preview")
+        return buffer.getvalue()
+
+
+class SessionStore:
+    def __init__(self, name: str, ttl: float = SESSION_TTL, memory_mb: float = SESSION_MEMORY_MB,
+                 uploads: ResultCache = None):
+        self.name         = name
+        self.ttl          = ttl
+        self.memory_limit = int(memory_mb * MB)
+        self.uploads      = uploads if shared.WORKERS > 1 else None
+        self._sessions    = OrderedDict()  # id -> Session, LRU order
+        self.counters     = {"reused": 0, "computed": 0}  # stages, across all sessions
+        self.created      = 0
+        self.expired      = 0
+        self.evicted      = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(session.nbytes for session in self._sessions.values())
+
+    def decode(self, data, session_id: str = None) -> Session:
+        """Decode an upload into a new (not yet added) session. Blocking — run it on session_pool."""
+        full = ingest.open_image(data)
+        if full.width * full.height * 3 > self.memory_limit:
+            raise HTTPException(status_code=413, detail="Image too large for an enhance session")
+        full = full.convert("RGB")
+        # The same decode preview_bytes() makes, so previews match the stateless route
+        preview = pipeline.open_thumbnail(ingest.BufferReader(data), pipeline.PREVIEW_MAX_SIZE,
+                                          Image.BILINEAR, reducing_gap=1.5)
+        return Session(hashlib.sha256(data), full, preview, self.counters, session_id)
+
+    async def add(self, session: Session, data=None) -> Session:
+        """Add a decoded session; pass its upload to share it with the other workers."""
+        if data is not None and self.uploads is not None:
+            await self.uploads.aput(session.id, bytes(data))
+        self._sessions[session.id] = session
+        self.created += 1
+        self.sweep()
+        return session
+
+    async def load(self, session_id: str) -> Session:
+        """get(), falling back to rebuilding a session another worker created."""
+        try:
+            return self.get(session_id)
+        except HTTPException:
+            path = await self.uploads.apath(session_id) if self.uploads and session_id.isalnum() else None
+            if path is None:
+                raise
+        try:
+            data = await fileio.read_bytes(path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Enhance session not found or expired")
+        with http_errors("Enhance", "Decoding the image"):
+            session = await session_pool.run(self.decode, data, session_id)
+        self._sessions[session.id] = session
+        self.sweep()
+        return session
+
+    def get(self, session_id: str) -> Session:
+        session = self._sessions.get(session_id)
+        if session is None or self._idle(session):
+            self._sessions.pop(session_id, None)
+            raise HTTPException(status_code=404, detail="Enhance session not found or expired")
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def delete(self, session_id: str) -> bool:
+        spooled = await self.uploads.adelete(session_id) if self.uploads and session_id.isalnum() else False
+        return self._sessions.pop(session_id, None) is not None or spooled
+
+    def _idle(self, session: Session) -> bool:
+        return time.monotonic() - session.last_used > self.ttl
+
+    def sweep(self) -> int:
+        """Drop idle sessions, then the least recently used ones over the memory limit."""
+        idle = [session_id for session_id, session in self._sessions.items() if self._idle(session)]
+        for session_id in idle:
+            del self._sessions[session_id]
+        self.expired += len(idle)
+
+        evicted = 0
+        while len(self._sessions) > 1 and self.nbytes > self.memory_limit:
+            self._sessions.popitem(last=False)
+            evicted += 1
+        self.evicted += evicted
+        return len(idle) + evicted
+
+    def stats(self) -> dict:
+        return {
+            "sessions":        len(self._sessions),
+            "bytes":           self.nbytes,
+            "created":         self.created,
+            "expired":         self.expired,
+            "evicted":         self.evicted,
+            "stages_reused":   self.counters["reused"],
+            "stages_computed": self.counters["computed"],
+        }
+
+
+enhance_sessions = SessionStore("enhance_sessions", uploads=session_uploads)
@@ -0,0 +1,240 @@
+# backend/services/shared.py
+"""
+State shared by the API worker processes of one host.
+
+serve.py can run several workers side by side. Whatever they must agree on
+lives in SQLite, in WAL mode so readers never wait for the writer:
+
+  * the result caches' disk index (services/cache.py)
+  * background job claims (services/jobs.py)
+  * Replicate concurrency slots (Slots, below)
+  * admission control: route slots, wait queues and per-client token
+    buckets (services/admission.py)
+
+Each thread of each process opens its own connection on first use — and
+again after a fork, so a connection opened before serve.py forks its workers
+is never shared. A write can wait up to BUSY_TIMEOUT for another process's
+transaction, so async code never queries on the event loop: it hands the
+work to run(), which executes it on a few database threads.
+Process-local things (memory cache tiers, counters, circuit breakers, enhance
+sessions) stay per worker.
+"""
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import functools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+RESULTS_DIR = os.getenv("RESULTS_DIR") or os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "results"))
+
+# ─── Config (env overrides) ───────────────────────────────────────────────────
+SHARED_DB_PATH = os.getenv("SHARED_DB_PATH", os.path.join(RESULTS_DIR, "shared.db"))
+WORKERS        = max(1, int(os.getenv("WEB_WORKERS", 1)))  # set by serve.py
+BUSY_TIMEOUT   = 10  # seconds a write waits for another process's transaction
+DB_THREADS     = int(os.getenv("DB_THREADS", 2))  # threads run() hands async code's queries to
+# ─────────────────────────────────────────────────────────────────────────────
+
+_executor = None
+_pid      = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Threads don't survive a fork: serve.py's workers each start their own
+    global _executor, _pid
+    if _executor is None or _pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="sqlite")
+        _pid      = os.getpid()
+    return _executor
+
+
+async def run(fn, *args, **kwargs):
+    """fn(*args, **kwargs) on a database thread. fn does the whole read or
+    read-modify-write, with the blocking Database calls below."""
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(), functools.partial(fn, *args, **kwargs)
+    )
+
+
+def shutdown():
+    global _executor
+    if _executor is not None and _pid == os.getpid():
+        _executor.shutdown(wait=False)
+    _executor = None
+
+
+def alive(pid: int) -> bool:
+    """Whether a process with this pid exists on this host."""
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Database:
+    """One SQLite file, one lazily opened connection per thread and process.
+    Its calls block: from async code, make them inside run()."""
+
+    def __init__(self, path: str, schema: str):
+        self.path   = path
+        self.schema = schema
+        self._local = threading.local()
+        self._lock  = threading.Lock()
+        self._conns = []  # (pid, connection), for close()
+
+    def conn(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Autocommit; read-modify-write sequences use transaction()
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.schema)
+            local.conn, local.pid = conn, os.getpid()
+            with self._lock:
+                self._conns.append((os.getpid(), conn))
+        return local.conn
+
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        return self.conn().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction, taken up front so concurrent writers queue instead of failing."""
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        """Close this process's connections, on every thread."""
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for pid, conn in conns:
+            if pid == os.getpid():
+                conn.close()
+        self._local = threading.local()
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    cache     TEXT NOT NULL,
+    key       TEXT NOT NULL,
+    filename  TEXT NOT NULL,
+    size      INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    used_at   REAL NOT NULL,
+    PRIMARY KEY (cache, key)
+);
+CREATE INDEX IF NOT EXISTS cache_entries_lru ON cache_entries (cache, used_at);
+
+CREATE TABLE IF NOT EXISTS slots (
+    token       TEXT PRIMARY KEY,
+    name        TEXT NOT NULL,
+    pid         INTEGER NOT NULL,
+    acquired_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS slots_name ON slots (name);
+
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    gate    TEXT NOT NULL,
+    client  TEXT NOT NULL,
+    tokens  REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (gate, client)
+);
+"""
+
+db = Database(SHARED_DB_PATH, _SCHEMA)
+
+
+class Slots:
+    """
+    Counting semaphore across every worker process (async with slots: ...).
+    Waiters poll with backoff; slots held by a process that died are
+    reclaimed. A slot taken for a caller that was cancelled meanwhile is
+    handed back, so cancellation never leaks one.
+    """
+
+    def __init__(self, name: str, limit: int, database: Database = db,
+                 poll: float = 0.05, max_poll: float = 0.5):
+        self.name     = name
+        self.limit    = limit
+        self.db       = database
+        self.poll     = poll
+        self.max_poll = max_poll
+        self._held    = {}  # task -> token
+
+    def _try_acquire(self):
+        with self.db.transaction() as conn:
+            rows = conn.execute("SELECT token, pid FROM slots WHERE name = ?", (self.name,)).fetchall()
+            dead = [row["token"] for row in rows if not alive(row["pid"])]
+            for token in dead:
+                conn.execute("DELETE FROM slots WHERE token = ?", (token,))
+            if len(rows) - len(dead) >= self.limit:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute("INSERT INTO slots (token, name, pid, acquired_at) VALUES (?, ?, ?, ?)",
+                         (token, self.name, os.getpid(), time.time()))
+            return token
+
+    def _release(self, token: str):
+        self.db.execute("DELETE FROM slots WHERE token = ?", (token,))
+
+    def held(self) -> int:
+        """Slots taken across all workers. Blocking."""
+        return self.db.execute("SELECT COUNT(*) FROM slots WHERE name = ?", (self.name,)).fetchone()[0]
+
+    async def try_acquire(self):
+        """A slot's token if one is free right now, else None."""
+        attempt = asyncio.ensure_future(run(self._try_acquire))
+        try:
+            return await asyncio.shield(attempt)
+        except asyncio.CancelledError:
+            attempt.add_done_callback(self._give_back)
+            raise
+
+    def _give_back(self, attempt: asyncio.Future):
+        if not attempt.cancelled() and attempt.exception() is None and attempt.result() is not None:
+            asyncio.ensure_future(self.release(attempt.result()))
+
+    async def acquire(self) -> str:
+        """Wait for a slot and return its token, for release()."""
+        delay = self.poll
+        while (token := await self.try_acquire()) is None:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll)
+        return token
+
+    async def release(self, token: str):
+        # Shielded: a release cut short would hold the slot until this process exits
+        await asyncio.shield(run(self._release, token))
+
+    async def __aenter__(self):
+        self._held[asyncio.current_task()] = await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release(self._held.pop(asyncio.current_task()))
+
+
+def limiter(name: str, limit: int):
+    """An async-with concurrency limit: a plain asyncio.Semaphore for a single
+    worker, Slots shared through SQLite when serve.py runs several."""
+    return Slots(name, limit) if WORKERS > 1 else asyncio.Semaphore(limit)
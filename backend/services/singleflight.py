@@ -0,0 +1,82 @@
+# backend/services/singleflight.py
+"""
+Single-flight coalescing of identical in-flight generations.
+
+Two uploads of the same image with the same model and settings have the
+same result-cache key. While a generation for a key is running, a request
+for that key attaches to it instead of starting its own Replicate
+prediction, and every attached request gets the same result (or the same
+error). Afterwards the result cache answers.
+
+The work runs as its own task: the request that started it can go away
+without failing the others. When the last attached request goes away the
+task is cancelled, which cancels the remote prediction too — as it would
+have been without coalescing.
+
+Flights are per worker process; with several serve.py workers, duplicates
+that land on different workers each run once.
+"""
+import asyncio
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task    = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """At most one running factory() per key; concurrent callers share its result."""
+
+    def __init__(self, name: str):
+        self.name     = name
+        self.counters = {"leader": 0, "follower": 0}
+        self._flights = {}  # key -> _Flight
+
+    async def run(self, key: str, factory):
+        """
+        Await factory() — or the identical call already running for key.
+        factory is only called by the request that starts the flight, so it
+        is the place to copy anything the work needs past that request.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _task: self._land(key, flight))
+            self.counters["leader"] += 1
+        else:
+            self.counters["follower"] += 1
+            print(f" Joined in-flight {self.name} generation {key[:12]}… ({flight.waiters + 1} attached)")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()  # nobody left to deliver the result to
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _land(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    @property
+    def waiters(self) -> int:
+        """Requests attached to another request's generation right now."""
+        return sum(max(0, flight.waiters - 1) for flight in self._flights.values())
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "waiters": self.waiters, **self.counters}
+
+
+smile_flights = SingleFlight("smile")
+video_flights = SingleFlight("video")
+
+FLIGHTS = (smile_flights, video_flights)
@@ -0,0 +1,110 @@
+# backend/services/store.py
+"""
+Managed result files.
+
+Everything the API writes for clients to fetch lives in a ResultCache-style
+store — the content-addressed caches plus `file_store`, which holds results
+that aren't keyed by content (e.g. the smile fallback) under unique random
+keys, so two uploads of "pic.jpg" can never overwrite each other.
+
+A background sweeper enforces every store's TTL and disk quota (least
+recently used first), and file_response() serves results with ETag,
+Cache-Control, conditional GET and Range support.
+"""
+import os
+import uuid
+import asyncio
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+from services import fileio
+from services.cache import ResultCache, CACHES, RESULTS_DIR
+from services.sessions import enhance_sessions, session_uploads
+
+
+# ─── Config (env overrides) ───────────────────────────────────────────────────
+SWEEP_INTERVAL = float(os.getenv("STORE_SWEEP_INTERVAL", 300))
+# Results never change under their key, so clients may keep them
+RESULT_CACHE_CONTROL = os.getenv("RESULT_CACHE_CONTROL", "private, max-age=86400, immutable")
+# ─────────────────────────────────────────────────────────────────────────────
+
+file_store = ResultCache("files", memory_mb=0, disk_mb=256, ttl=24 * 3600,
+                         directory=os.path.join(RESULTS_DIR, "files"))
+
+STORES = CACHES + (file_store, session_uploads)
+
+
+def new_key() -> str:
+    """A collision-free key for a result that isn't content-addressed."""
+    return uuid.uuid4().hex
+
+
+class Sweeper:
+    """Periodically sweeps every store.
+
+    The per-process memory tiers and enhance sessions, which are not safe
+    to share with a thread, are trimmed on the event loop; a ResultCache's
+    disk tier (its index in the shared SQLite database, services/shared.py,
+    and the files themselves) is swept on a database thread by asweep().
+    """
+
+    def __init__(self, stores: tuple, interval: float = SWEEP_INTERVAL):
+        self.stores   = stores
+        self.interval = interval
+        self._task    = None
+
+    async def sweep(self) -> int:
+        removed = 0
+        for store in self.stores:
+            try:
+                removed += await store.asweep() if isinstance(store, ResultCache) else store.sweep()
+            except OSError as e:
+                print(f" Sweep of {store.name} failed: {e}")
+        if removed:
+            print(f" Swept {removed} expired/evicted result file(s)")
+        return removed
+
+    async def _loop(self):
+        while True:
+            await self.sweep()
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+# Enhance sessions hold decoded images in memory; they expire the same way
+sweeper = Sweeper(STORES + (enhance_sessions,))
+
+
+async def file_response(request: Request, path: str, media_type: str = None, filename: str = None,
+                  etag: str = None) -> Response:
+    """
+    FileResponse with Cache-Control, and 304 Not Modified for a matching
+    If-None-Match. Starlette handles Range / If-Range. Pass the result key as
+    etag for content-addressed results; otherwise it is derived from the
+    file's mtime and size.
+    """
+    stat = await fileio.run(os.stat, path)
+    response = FileResponse(path, media_type=media_type, filename=filename, stat_result=stat)
+    if etag:
+        response.headers["etag"] = f'"{etag}"'
+    response.headers["cache-control"] = RESULT_CACHE_CONTROL
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or response.headers["etag"] in tags:
+            return Response(status_code=304, headers={
+                "etag":          response.headers["etag"],
+                "cache-control": RESULT_CACHE_CONTROL,
+            })
+    return response
@@ -0,0 +1,189 @@
+# backend/services/tiling.py
+"""
+Strip-wise execution of the enhance pipeline for very large uploads.
+
+The image is processed in horizontal strips padded with enough halo rows for
+every neighbourhood filter in the chain (see pipeline.filter_halo), so the
+output is identical to the full-frame path. The filter chain's working set —
+one padded strip and its intermediates — is bounded by the tile budget.
+
+What the budget does not cover:
+
+  * the decoded source. Pillow decodes the whole frame in one go; a JPEG
+    draft/reduce would decode at a lower resolution, which this path must
+    not. It is the one allocation proportional to the input size.
+  * the encoded result. PNG strips are encoded into the sink as they come,
+    so no full-size output frame exists, but the sink holds the whole
+    encoded file: the caller gets it as bytes, not as a stream.
+  * JPEG/WebP frames. Pillow's encoders need the whole frame; with in_place
+    the strips are written back into the decoded source, so it is not
+    allocated a second time. The encoders' own buffers come on top (libwebp
+    converts the frame to YUV).
+"""
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from services import kernels, pipeline
+
+
+# ─── Config (env overrides) ───────────────────────────────────────────────────
+TILE_BUDGET_MB   = float(os.getenv("ENHANCE_TILE_BUDGET_MB", 64))
+TILED_MIN_PIXELS = int(os.getenv("ENHANCE_TILED_MIN_PIXELS", 16_000_000))
+PNG_COMPRESS_LEVEL = int(os.getenv("ENHANCE_PNG_COMPRESS_LEVEL", 6))
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Rough working-set cost per strip pixel: the RGB crop, its NumPy copy and the
+# filters' input/output images. The PNG filter's int16 temporaries are
+# bounded separately, _PNG_BLOCK_ROWS rows at a time.
+_BYTES_PER_PIXEL = 48
+_MIN_STRIP_ROWS  = 8
+_IDAT_CHUNK      = 256 * 1024
+_PNG_BLOCK_ROWS  = 32
+
+
+class PngWriter:
+    """Incremental 8-bit RGB PNG encoder fed one block of rows at a time."""
+
+    def __init__(self, sink, width: int, height: int, compress_level: int = PNG_COMPRESS_LEVEL):
+        self.sink     = sink
+        self.width    = width
+        self._zlib    = zlib.compressobj(compress_level)
+        self._pending = []
+        self._size    = 0
+        self._prev    = np.zeros(width * 3, dtype=np.int16)
+
+        sink.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes):
+        self.sink.write(struct.pack(">I", len(data)))
+        self.sink.write(kind)
+        self.sink.write(data)
+        self.sink.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def _flush_idat(self):
+        if self._pending:
+            self._chunk(b"IDAT", b"".join(self._pending))
+            self._pending = []
+            self._size    = 0
+
+    def write_rows(self, rows: np.ndarray):
+        """Append an (H, W, 3) uint8 block of rows, Paeth-filtered."""
+        # A few rows at a time, so the filter's int16 temporaries stay small
+        # however tall the strip
+        for start in range(0, rows.shape[0], _PNG_BLOCK_ROWS):
+            self._write_block(rows[start:start + _PNG_BLOCK_ROWS])
+
+    def _write_block(self, rows: np.ndarray):
+        cur  = rows.reshape(rows.shape[0], -1).astype(np.int16)
+        up   = np.vstack([self._prev[None], cur[:-1]])
+        left = np.zeros_like(cur)
+        left[:, 3:] = cur[:, :-3]
+        upleft = np.zeros_like(cur)
+        upleft[:, 3:] = up[:, :-3]
+
+        p  = left + up - upleft
+        pa = np.abs(p - left)
+        pb = np.abs(p - up)
+        pc = np.abs(p - upleft)
+        predictor = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upleft))
+
+        filtered = np.empty((cur.shape[0], cur.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0]  = 4  # Paeth
+        filtered[:, 1:] = (cur - predictor).astype(np.uint8)
+        self._prev = cur[-1]
+
+        data = self._zlib.compress(filtered.tobytes())
+        if data:
+            self._pending.append(data)
+            self._size += len(data)
+            if self._size >= _IDAT_CHUNK:
+                self._flush_idat()
+
+    def close(self):
+        self._pending.append(self._zlib.flush())
+        self._flush_idat()
+        self._chunk(b"IEND", b"")
+
+
+def strip_rows(width: int, halo: int, budget_mb: float = TILE_BUDGET_MB) -> int:
+    """Output rows per strip so one padded strip fits in the tile budget."""
+    rows = int(budget_mb * 1024 * 1024) // (max(width, 1) * _BYTES_PER_PIXEL) - 2 * halo
+    return max(rows, _MIN_STRIP_ROWS)
+
+
+def _rgb_strip(image: Image.Image, top: int, bottom: int) -> Image.Image:
+    strip = image.crop((0, top, image.width, bottom))
+    return strip if strip.mode == "RGB" else strip.convert("RGB")
+
+
+def _contrast_mean(image: Image.Image, enh: float, rows: int) -> int:
+    """Global contrast pivot, gathered strip by strip."""
+    bright = kernels.brightness_lut(pipeline.tone_factors(enh)[0])
+    total  = 0
+    for top in range(0, image.height, rows):
+        strip = _rgb_strip(image, top, min(top + rows, image.height))
+        total += kernels.luma_sum(np.asarray(strip), bright)
+    return int(total / (image.width * image.height) + 0.5)
+
+
+def iter_strips(image: Image.Image, enh: float, sharp: float, clarity: float,
+                budget_mb: float = TILE_BUDGET_MB):
+    """Yield (top, strip) pairs of finished RGB strips, top to bottom."""
+    width, height = image.size
+    halo = pipeline.filter_halo(enh, sharp, clarity)
+    rows = strip_rows(width, halo, budget_mb)
+
+    mean = None
+    if enh != 50:
+        with pipeline.stage("tone"):
+            mean = _contrast_mean(image, enh, rows)
+
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        padded_top, padded_bottom = max(0, top - halo), min(height, bottom + halo)
+
+        strip = _rgb_strip(image, padded_top, padded_bottom)
+        strip = pipeline.apply_tone(strip, enh, mean)
+        strip = pipeline.apply_filters(strip, enh, sharp, clarity)
+        yield top, strip.crop((0, top - padded_top, width, bottom - padded_top))
+
+
+def enhance_tiled(image: Image.Image, enh: float, sharp: float, clarity: float, sink,
+                  budget_mb: float = TILE_BUDGET_MB, fmt: str = "png", quality: int = 90,
+                  in_place: bool = False):
+    """Run the enhance chain strip by strip and encode the result into sink.
+
+    PNG is encoded strip by strip. Pillow's JPEG/WebP encoders need the whole
+    frame, so for those the strips are assembled into one output image first:
+    with in_place and an RGB source, the source image itself, so no second
+    full-size frame is allocated (the caller's image is overwritten).
+    """
+    strips = iter_strips(image, enh, sharp, clarity, budget_mb)
+
+    if fmt != "png":
+        output = image if in_place and image.mode == "RGB" else Image.new("RGB", image.size)
+        # Written back in place, a strip has to wait until no later strip's
+        # halo reads the source rows under it
+        halo = pipeline.filter_halo(enh, sharp, clarity) if output is image else 0
+        pending = []
+        for top, strip in strips:
+            pending.append((top, strip))
+            while pending and pending[0][0] + pending[0][1].height <= top + strip.height - halo:
+                done_top, done = pending.pop(0)
+                output.paste(done, (0, done_top))
+        for done_top, done in pending:
+            output.paste(done, (0, done_top))
+        pipeline.encode(output, sink, fmt, quality)
+        return
+
+    writer = PngWriter(sink, image.width, image.height)
+    for _, strip in strips:
+        with pipeline.stage("encode"):
+            writer.write_rows(np.asarray(strip))
+    with pipeline.stage("encode"):
+        writer.close()
@@ -0,0 +1,146 @@
+# backend/services/transcode.py
+"""
+Smaller variants of a generated video, made with ffmpeg.
+
+  * poster  — one JPEG frame, for a placeholder while the video loads
+  * preview — a short, small animated WebP that plays inline like a GIF
+  * mobile  — a 360p, low-bitrate H.264 MP4 with faststart
+
+ffmpeg runs in video_pool (services/pool.py), so a burst of variant requests
+queues on a bounded number of transcodes instead of starting one per request.
+Variants go into the video result cache next to the original, under a key
+derived from the original's key and the variant's settings, and are made
+once per key (services/singleflight.py).
+"""
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from services import fileio, metrics
+from services.cache import video_cache, derive_key
+from services.pool import video_pool
+from services.singleflight import video_flights
+
+
+# ─── Config (env overrides) ───────────────────────────────────────────────────
+FFMPEG_PATH       = os.getenv("FFMPEG_PATH", "ffmpeg")
+TRANSCODE_TIMEOUT = float(os.getenv("VIDEO_TRANSCODE_TIMEOUT", 60))  # ffmpeg is killed past this
+POSTER_AT         = float(os.getenv("VIDEO_POSTER_AT", 1.0))          # seconds into the video
+PREVIEW_WIDTH     = int(os.getenv("VIDEO_PREVIEW_WIDTH", 320))
+PREVIEW_FPS       = int(os.getenv("VIDEO_PREVIEW_FPS", 10))
+MOBILE_HEIGHT     = int(os.getenv("VIDEO_MOBILE_HEIGHT", 360))
+MOBILE_CRF        = int(os.getenv("VIDEO_MOBILE_CRF", 30))
+MOBILE_MAXRATE    = os.getenv("VIDEO_MOBILE_MAXRATE", "400k")
+MOBILE_BUFSIZE    = os.getenv("VIDEO_MOBILE_BUFSIZE", "800k")
+# ─────────────────────────────────────────────────────────────────────────────
+
+ORIGINAL = "original"
+
+# variant -> suffix, media type, download name and the ffmpeg output options
+VARIANTS = {
+    "poster": {
+        "suffix":     ".jpg",
+        "media_type": "image/jpeg",
+        "filename":   "animated_video_poster.jpg",
+        "input":      ["-ss", str(POSTER_AT)],
+        "output":     ["-frames:v", "1", "-q:v", "3"],
+    },
+    "preview": {
+        "suffix":     ".webp",
+        "media_type": "image/webp",
+        "filename":   "animated_video_preview.webp",
+        "input":      [],
+        "output":     ["-vf", f"fps={PREVIEW_FPS},scale={PREVIEW_WIDTH}:-2:flags=lanczos",
+                       "-c:v", "libwebp_anim", "-quality", "60", "-compression_level", "4",
+                       "-loop", "0", "-an"],
+    },
+    "mobile": {
+        "suffix":     ".mp4",
+        "media_type": "video/mp4",
+        "filename":   "animated_video_mobile.mp4",
+        "input":      [],
+        "output":     ["-vf", f"scale=-2:{MOBILE_HEIGHT}", "-c:v", "libx264", "-preset", "veryfast",
+                       "-crf", str(MOBILE_CRF), "-maxrate", MOBILE_MAXRATE,
+                       "-bufsize", MOBILE_BUFSIZE,
+                       "-pix_fmt", "yuv420p", "-movflags", "+faststart", "-an"],
+    },
+}
+
+
+class TranscodeFailed(Exception):
+    """ffmpeg is missing, failed or ran out of time."""
+
+
+# Looked up once: shutil.which() walks PATH, too slow to repeat on every request
+_ffmpeg_found = shutil.which(FFMPEG_PATH) is not None
+
+
+def available() -> bool:
+    return _ffmpeg_found
+
+
+def variant_key(key: str, variant: str) -> str:
+    """Cache key of a variant: the original's key plus the variant's ffmpeg settings."""
+    spec = VARIANTS[variant]
+    return derive_key(hashlib.sha256(key.encode()), variant=variant, input=spec["input"], output=spec["output"])
+
+
+def ffmpeg_command(src_path: str, dst_path: str, variant: str) -> list:
+    spec = VARIANTS[variant]
+    return [FFMPEG_PATH, "-nostdin", "-v", "error", "-y", *spec["input"], "-i", src_path,
+            *spec["output"], dst_path]
+
+
+def transcode(src_path: str, dst_path: str, variant: str) -> float:
+    """Write one variant of src_path to dst_path. Runs inside a pool worker;
+    returns the seconds ffmpeg took."""
+    start = time.perf_counter()
+    try:
+        subprocess.run(ffmpeg_command(src_path, dst_path, variant), check=True,
+                       capture_output=True, timeout=TRANSCODE_TIMEOUT)
+    except FileNotFoundError:
+        raise TranscodeFailed(f"{FFMPEG_PATH} not found")
+    except subprocess.TimeoutExpired:
+        raise TranscodeFailed(f"{variant} took longer than {TRANSCODE_TIMEOUT:.0f}s")
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode(errors="replace").strip().splitlines()
+        raise TranscodeFailed(f"ffmpeg failed on {variant}: {stderr[-1] if stderr else e.returncode}")
+    return time.perf_counter() - start
+
+
+async def variant_path(key: str, original_path: str, variant: str) -> str:
+    """
+    Path of a variant of the cached video stored under key, transcoding it
+    on first use. Raises TranscodeFailed or a PoolError.
+    """
+    vkey = variant_key(key, variant)
+    with metrics.stage("video", "cache_lookup"):
+        cached_path = await video_cache.apath(vkey)
+    if cached_path:
+        return cached_path
+    return await video_flights.run(vkey, lambda: _render(vkey, original_path, variant))
+
+
+def _temp_path(suffix: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+
+async def _render(vkey: str, original_path: str, variant: str) -> str:
+    temp_path = await fileio.run(_temp_path, VARIANTS[variant]["suffix"])
+    start = time.perf_counter()
+    try:
+        ffmpeg_seconds = await video_pool.run(transcode, original_path, temp_path, variant,
+                                              timeout=TRANSCODE_TIMEOUT + 5)
+        metrics.STAGE_SECONDS.observe(ffmpeg_seconds, op="video", stage=f"transcode_{variant}")
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - start - ffmpeg_seconds, op="video", stage="pool_wait")
+        path = await video_cache.aput_file(vkey, temp_path, suffix=VARIANTS[variant]["suffix"])
+        temp_path = None
+        print(f"Video {variant} variant saved: {path}")
+        return path
+    finally:
+        await fileio.remove(temp_path)
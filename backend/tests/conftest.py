@@ -0,0 +1,21 @@
+# backend/tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# Import the app's packages (services, bench) the way main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: end-to-end load run against real servers (BENCHMARKS=1)")
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.getenv("BENCHMARKS"):
+        return
+    skip = pytest.mark.skip(reason="benchmark: set BENCHMARKS=1 to run it")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
@@ -0,0 +1,330 @@
+# backend/tests/test_loop_lag.py
+"""
+No route may block the event loop.
+
+The app runs in this process, reached through httpx.ASGITransport, with the
+Replicate stub (bench/replicate_stub.py) as the upstream and the process pools
+swapped for thread pools: the image work still runs off the loop, without
+spawning workers. Every callback the loop runs is timed in the loop thread's
+CPU time (time.thread_time()), so other threads, the stub and the scheduler
+don't count — only work done on the loop itself: hashing, SQLite, file I/O,
+a decode. Each route, driven CONCURRENCY at a time, must keep every callback
+within LOOP_STEP_LIMIT_MS. The client shares the loop, so its side of each
+request counts too. The cyclic garbage collector is held off while measuring:
+a collection lands on whichever callback happens to allocate, and says
+nothing about the route.
+
+test_loop_lag_under_load is the end-to-end version against real servers
+(bench/load.py). It measures wall-clock lag, so CPU contention shows up in
+it: it is a benchmark, run with BENCHMARKS=1.
+"""
+import io
+import os
+import gc
+import json
+import time
+import asyncio
+import zipfile
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+from bench import images, load
+
+LOOP_STEP_LIMIT_MS = float(os.getenv("LOOP_STEP_LIMIT_MS", 10))
+CONCURRENCY        = 4
+
+LOOP_LAG_P99_MS = float(os.getenv("LOOP_LAG_P99_MS", 10))
+LOOP_LAG_MAX_MS = float(os.getenv("LOOP_LAG_MAX_MS", 100))
+REQUESTS        = 32
+# Driver, stub, API and pool each want a core; fewer and the stalls stretch
+CONTENTION      = max(1.0, 4 / (os.cpu_count() or 1))
+
+ENHANCE = "enh=65&sharp=60&clarity=60"
+
+
+# ─── App under test ───────────────────────────────────────────────────────────
+
+def _thread_executor(self):
+    # WorkerPool._get_executor() with threads standing in for worker processes
+    if self._executor is None:
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._jobs[self._executor] = set()
+    return self._executor
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    """(loop, client): main.app started on a loop of its own, for the module."""
+    workdir = tmp_path_factory.mktemp("loop-lag")
+    stub = load.Server("bench.replicate_stub:app", {"STUB_LATENCY": "0.1", "STUB_JITTER": "0", "STUB_VIDEO_MB": "1"},
+                       str(workdir / "stub.log"))
+    env = {
+        "REPLICATE_BASE_URL":      stub.url,
+        "REPLICATE_API_TOKEN":     "test",
+        "REPLICATE_POLL_INTERVAL": "0.05",
+        "RESULTS_DIR":             str(workdir / "results"),
+        "JOBS_DB_PATH":            str(workdir / "results" / "jobs" / "jobs.db"),
+        "JOB_POLL_INTERVAL":       "0.05",
+        "ADMISSION_SMILE_RATE":    "0",
+        "ADMISSION_VIDEO_RATE":    "0",
+        # Room for every client at once: this test is about the loop, not the bounds
+        "ENHANCE_POOL_MAX_QUEUE":    "32",
+        "ENHANCE_POOL_TIMEOUT":      "300",
+        "ENHANCE_SESSION_MAX_QUEUE": "32",
+        "THUMBNAIL_POOL_TIMEOUT":    "300",
+    }
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    with stub, pytest.MonkeyPatch.context() as mp:
+        from services import pool
+        mp.setattr(pool.WorkerPool, "_get_executor", _thread_executor)
+        main = importlib.import_module("main")
+
+        loop = asyncio.new_event_loop()
+        lifespan = main.app.router.lifespan_context(main.app)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test", timeout=120)
+        loop.run_until_complete(lifespan.__aenter__())
+        try:
+            yield loop, client
+        finally:
+            loop.run_until_complete(client.aclose())
+            loop.run_until_complete(lifespan.__aexit__(None, None, None))
+            loop.close()
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+@pytest.fixture(scope="module")
+def photo():
+    return images.encoded("2mp")
+
+
+_uploads = iter(range(1 << 62))
+
+
+def unique(payload: bytes) -> bytes:
+    # Trailing bytes after the JPEG end marker: a new cache key, the same image
+    return payload + next(_uploads).to_bytes(8, "big")
+
+
+class LoopSteps:
+    """Times every callback the event loop runs, in the loop thread's CPU time."""
+
+    def __init__(self):
+        self.worst     = 0.0
+        self.culprit   = None
+        self.measuring = False
+
+    def install(self, monkeypatch):
+        run = asyncio.events.Handle._run
+        steps = self
+
+        def timed(handle):
+            start = time.thread_time()
+            try:
+                run(handle)
+            finally:
+                spent = time.thread_time() - start
+                if steps.measuring and spent > steps.worst:
+                    steps.worst, steps.culprit = spent, repr(handle)
+
+        monkeypatch.setattr(asyncio.events.Handle, "_run", timed)
+        return self
+
+
+def measure(loop, monkeypatch, scenario, *args) -> LoopSteps:
+    """One unmeasured run (first-call imports, pool threads), then CONCURRENCY at once."""
+    steps = LoopSteps().install(monkeypatch)
+
+    async def drive():
+        await scenario(*args)
+        gc.collect()
+        gc.disable()
+        await asyncio.sleep(0)  # the collection's callback is not measured
+        steps.measuring = True
+        try:
+            await asyncio.gather(*(scenario(*args) for _ in range(CONCURRENCY)))
+        finally:
+            steps.measuring = False
+            gc.enable()
+
+    loop.run_until_complete(drive())
+    return steps
+
+
+# ─── Scenarios: one client's worth of requests on a route ─────────────────────
+
+async def enhance(client, photo):
+    response = await client.post(f"/api/enhance/?{ENHANCE}&binary=true", files={"file": ("a.jpg", unique(photo))})
+    assert response.status_code == 200, response.text
+
+
+async def enhance_json(client, photo):
+    response = await client.post(f"/api/enhance/?{ENHANCE}&format=jpeg", files={"file": ("a.jpg", unique(photo))})
+    assert response.status_code == 200, response.text
+    assert response.json()["image"]
+
+
+async def preview(client, photo):
+    response = await client.post(f"/api/enhance/?{ENHANCE}&binary=true&preview=true&format=jpeg",
+                                 files={"file": ("a.jpg", unique(photo))})
+    assert response.status_code == 200, response.text
+
+
+async def upscale(client, photo):
+    response = await client.post("/api/enhance/upscale?scale=2&format=jpeg&binary=true",
+                                 files={"file": ("a.jpg", unique(photo))})
+    assert response.status_code == 200, response.text
+
+
+async def session(client, photo):
+    response = await client.post("/api/enhance/sessions", files={"file": ("a.jpg", unique(photo))})
+    assert response.status_code == 201, response.text
+    path = f"/api/enhance/sessions/{response.json()['session_id']}"
+    for query in (f"{ENHANCE}&preview=true&format=jpeg", f"{ENHANCE}&format=jpeg&binary=true"):
+        response = await client.get(f"{path}?{query}")
+        assert response.status_code == 200, response.text
+    response = await client.delete(path)
+    assert response.status_code == 204, response.text
+
+
+async def smile(client, photo):
+    response = await client.post("/api/animate/smile", files={"file": ("a.jpg", unique(photo))})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "image/webp"
+
+
+async def smile_fallback(client, photo):
+    # Replicate refusing the input: animator._save_original() returns the photo
+    response = await client.post("/api/animate/smile", files={"file": ("a.jpg", unique(photo))})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "image/jpeg"
+
+
+async def smile_animation(client, inputs):
+    from services import animator
+
+    assert os.path.exists(await animator.generate_smile_animation(inputs.pop(), "smile_a"))
+
+
+async def smile_batch(client, photo):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("b.jpg", unique(photo))
+    files = [("files", ("a.jpg", unique(photo))), ("files", ("b.zip", archive.getvalue()))]
+    response = await client.post("/api/animate/smile/batch", files=files)
+    assert response.status_code == 200, response.text
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[-1] == {"status": "done", "total": 2, "succeeded": 2, "failed": 0}, lines
+    for line in lines[:-1]:
+        response = await client.get(line["result_url"])
+        assert response.status_code == 200, response.text
+
+
+async def video(client, photo):
+    response = await client.post("/api/animate/video", files={"file": ("a.jpg", unique(photo))})
+    assert response.status_code == 200, response.text
+    assert len(response.content) == 1024 * 1024
+
+
+async def video_failure(client, photo):
+    response = await client.post("/api/animate/video", files={"file": ("a.jpg", unique(photo))})
+    assert response.status_code == 500, response.text
+
+
+async def video_job(client, photo):
+    response = await client.post("/api/animate/video/jobs", files={"file": ("a.jpg", unique(photo))})
+    assert response.status_code == 202, response.text
+    path = f"/api/jobs/{response.json()['job_id']}"
+    for _ in range(600):
+        job = (await client.get(path)).json()
+        if job["status"] not in ("queued", "running"):
+            break
+        await asyncio.sleep(0.05)
+    assert job["status"] == "succeeded", job
+    response = await client.get(f"{path}/result")
+    assert response.status_code == 200, response.text
+    assert len(response.content) == 1024 * 1024
+
+
+async def results(client, photo):
+    from services.store import file_store, new_key
+
+    path = await file_store.aput(new_key(), unique(photo), suffix=".jpg")
+    response = await client.get(f"/results/{os.path.basename(path)}")
+    assert response.status_code == 200, response.text
+
+
+SCENARIOS = {
+    "enhance": enhance, "enhance_json": enhance_json, "preview": preview, "upscale": upscale,
+    "session": session, "smile": smile, "smile_batch": smile_batch, "video": video,
+    "video_job": video_job, "results": results,
+}
+
+
+async def _refuse(*args, **kwargs):
+    from replicate.exceptions import ReplicateError
+    raise ReplicateError(status=422, detail="input rejected")
+
+
+def _check(steps: LoopSteps, route: str):
+    assert steps.worst * 1000 <= LOOP_STEP_LIMIT_MS, (
+        f"{route}: the loop ran one callback for {steps.worst * 1000:.1f} ms of CPU "
+        f"(limit {LOOP_STEP_LIMIT_MS:g} ms): {steps.culprit}"
+    )
+
+
+@pytest.mark.parametrize("route", SCENARIOS)
+def test_route_never_blocks_the_loop(route, app, photo, monkeypatch):
+    loop, client = app
+    _check(measure(loop, monkeypatch, SCENARIOS[route], client, photo), route)
+
+
+@pytest.mark.parametrize("route", ["smile_fallback", "video_failure"])
+def test_failure_paths_never_block_the_loop(route, app, photo, monkeypatch):
+    from services import replicate_client
+
+    loop, client = app
+    monkeypatch.setattr(replicate_client, "run", _refuse)
+    scenario = {"smile_fallback": smile_fallback, "video_failure": video_failure}[route]
+    _check(measure(loop, monkeypatch, scenario, client, photo), route)
+
+
+def test_generate_smile_animation_never_blocks_the_loop(app, photo, monkeypatch, tmp_path):
+    loop, client = app
+    inputs = []
+    for i in range(CONCURRENCY + 1):
+        inputs.append(str(tmp_path / f"{i}.jpg"))
+        with open(inputs[-1], "wb") as f:
+            f.write(unique(photo))
+    _check(measure(loop, monkeypatch, smile_animation, client, inputs), "generate_smile_animation")
+
+
+# ─── Benchmark: real servers, wall-clock lag ──────────────────────────────────
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("route", ["preview", "smile", "video"])
+def test_loop_lag_under_load(route, tmp_path):
+    p99_limit, max_limit = LOOP_LAG_P99_MS * CONTENTION, LOOP_LAG_MAX_MS * CONTENTION
+    rows = load.run(
+        routes=(route,), size="2mp", concurrency=(8,), requests=REQUESTS, warmup=2,
+        stub_env={"STUB_LATENCY": "0.3", "STUB_VIDEO_MB": "1"},
+        server_env={"LOOP_LAG_INTERVAL": "0.005"},
+        max_loop_lag_ms=max_limit, workdir=str(tmp_path), log=lambda *args: None,
+    )
+
+    row = rows[0]
+    assert row["statuses"] == {"200": REQUESTS}
+    assert row["loop_lag_probes"] > 0
+    assert row["loop_lag_p99_ms"] is not None and row["loop_lag_p99_ms"] <= p99_limit, (
+        f"{route}: p99 event-loop stall {row['loop_lag_p99_ms']} ms under load (limit {p99_limit:g} ms)"
+    )
+    assert row["loop_lag_ok"], (
+        f"{route}: event loop stalled up to {row['loop_lag_max_ms']} ms under load (limit {max_limit:g} ms)"
+    )
@@ -12,69 +12,113 @@ const resultImage = document.getElementById("resultImage");
 const spinner = document.getElementById("spinner");
 const downloadBtn = document.getElementById("downloadBtn");
 
+const API = "http://127.0.0.1:8000/api/enhance";
+
 let currentFile = null;
+let session = null;  // { file, id: Promise<session id> }
 let debounceTimer;
 
+// The image is uploaded once into an enhance session; slider changes only
+// send the settings, and the server reruns just the stages that changed.
+function openSession(file) {
+  const formData = new FormData();
+  formData.append("file", file);
+  const id = fetch(`${API}/sessions`, { method: "POST", body: formData })
+    .then((response) => {
+      if (!response.ok) throw new Error("Upload failed!");
+      return response.json();
+    })
+    .then((data) => data.session_id);
+  id.catch(() => {});  // reported by whoever awaits it
+  session = { file, id };
+  return id;
+}
+
+function closeSession() {
+  if (!session) return;
+  session.id
+    .then((id) => fetch(`${API}/sessions/${id}`, { method: "DELETE" }))
+    .catch(() => {});
+  session = null;
+}
+
 // Store selected image
 imageInput.addEventListener("change", () => {
   currentFile = imageInput.files[0];
   if (!currentFile) return;
+  closeSession();
+  openSession(currentFile);
   resultImage.style.display = "block";
   downloadBtn.style.display = "none";
 });
 
-// Function to send image to backend
-async function updateImage() {
-  if (!currentFile) return;
+let latestRequest = 0;
 
-  spinner.style.display = "block";        // show spinner
-  downloadBtn.style.display = "none";     // hide download button
+// Function to send image to backend.
+// preview=true asks for a fast low-resolution render (slider drags).
+async function updateImage(preview = false) {
+  if (!currentFile) return;
+  const request = ++latestRequest;
 
-  const formData = new FormData();
-  formData.append("file", currentFile);
+  if (!preview) {
+    spinner.style.display = "block";        // show spinner
+    downloadBtn.style.display = "none";     // hide download button
+  }
 
-  const url = `http://127.0.0.1:8000/api/enhance/?enh=${enhSlider.value}&sharp=${sharpSlider.value}&clarity=${claritySlider.value}`;
+  let query = `enh=${enhSlider.value}&sharp=${sharpSlider.value}&clarity=${claritySlider.value}`;
+  if (preview) query += "&preview=true&format=jpeg&quality=85";
 
   try {
-    const response = await fetch(url, { method: "POST", body: formData });
+    let id = await (session && session.file === currentFile ? session.id : openSession(currentFile));
+    let response = await fetch(`${API}/sessions/${id}?${query}`);
+    if (response.status === 404) {
+      // Session expired on the server — upload the image again
+      id = await openSession(currentFile);
+      response = await fetch(`${API}/sessions/${id}?${query}`);
+    }
     if (!response.ok) throw new Error("Enhancement failed!");
 
     const data = await response.json();
-    resultImage.src = "data:image/png;base64," + data.image;
+    if (request !== latestRequest) return;  // superseded by a newer request
+    resultImage.src = `data:image/${data.format};base64,` + data.image;
     resultImage.style.display = "block";
 
-    spinner.style.display = "none";        // hide spinner
-    downloadBtn.style.display = "inline";  // show download button
+    if (!preview) {
+      spinner.style.display = "none";        // hide spinner
+      downloadBtn.style.display = "inline";  // show download button
+    }
 
   } catch (err) {
     console.error(err);
-    spinner.style.display = "none";
-    alert("Error connecting to backend!");
+    if (!preview) {
+      spinner.style.display = "none";
+      alert("Error connecting to backend!");
+    }
   }
 }
 
-// Debounce function
+// Debounce function: previews while dragging, full size once released
 function debounceUpdate() {
   clearTimeout(debounceTimer);
-  debounceTimer = setTimeout(updateImage, 300); // wait 300ms
+  debounceTimer = setTimeout(() => updateImage(true), 50);
+}
+
+function commitUpdate() {
+  clearTimeout(debounceTimer);
+  updateImage(false);
 }
 
 // Update displayed values and call debounced update
-enhSlider.addEventListener("input", () => {
-  enhValue.textContent = enhSlider.value;
-  debounceUpdate();
-});
-sharpSlider.addEventListener("input", () => {
-  sharpValue.textContent = sharpSlider.value;
-  debounceUpdate();
-});
-claritySlider.addEventListener("input", () => {
-  clarityValue.textContent = claritySlider.value;
-  debounceUpdate();
-});
+for (const [slider, label] of [[enhSlider, enhValue], [sharpSlider, sharpValue], [claritySlider, clarityValue]]) {
+  slider.addEventListener("input", () => {
+    label.textContent = slider.value;
+    debounceUpdate();
+  });
+  slider.addEventListener("change", commitUpdate);
+}
 
 // Optional Enhance button
-enhanceBtn.addEventListener("click", updateImage);
+enhanceBtn.addEventListener("click", () => updateImage(false));
 
 // Download button
 downloadBtn.addEventListener("click", () => {
@@ -12,36 +12,89 @@ export default function Enhancement() {
   const [dragOver, setDragOver] = useState(false);
   const fileRef = useRef();
   const debounceRef = useRef();
+  const previewRef = useRef();
+  const requestRef = useRef(0);
+  const sessionRef = useRef(null); // { file, id: Promise<session id> }
 
+  // While a slider moves, fetch cheap low-res previews; once it settles,
+  // render the full-size result.
   useEffect(() => {
     if (!file) return;
+    clearTimeout(previewRef.current);
     clearTimeout(debounceRef.current);
-    debounceRef.current = setTimeout(() => sendImage(), 400);
-    return () => clearTimeout(debounceRef.current);
+    previewRef.current = setTimeout(() => sendImage(true), 60);
+    debounceRef.current = setTimeout(() => sendImage(false), 600);
+    return () => {
+      clearTimeout(previewRef.current);
+      clearTimeout(debounceRef.current);
+    };
   }, [enh, sharp, clarity]);
 
-  async function sendImage() {
-    if (!file) return;
-    setLoading(true);
+  // Each result is an object URL: free it once it's replaced or cleared, or
+  // the page unmounts
+  useEffect(() => {
+    if (!enhancedSrc) return;
+    return () => URL.revokeObjectURL(enhancedSrc);
+  }, [enhancedSrc]);
+
+  // The image is uploaded once into an enhance session; slider changes only
+  // send the settings, and the server reruns just the stages that changed.
+  function openSession(f) {
     const form = new FormData();
-    form.append("file", file);
-    const url = `${API_BASE}/api/enhance/?enh=${enh}&sharp=${sharp}&clarity=${clarity}`;
+    form.append("file", f);
+    const id = fetch(`${API_BASE}/api/enhance/sessions`, { method: "POST", body: form })
+      .then((res) => {
+        if (!res.ok) throw new Error("Upload failed");
+        return res.json();
+      })
+      .then((data) => data.session_id);
+    id.catch(() => {}); // reported by whoever awaits it
+    sessionRef.current = { file: f, id };
+    return id;
+  }
+
+  function closeSession() {
+    const session = sessionRef.current;
+    sessionRef.current = null;
+    if (!session) return;
+    session.id
+      .then((id) => fetch(`${API_BASE}/api/enhance/sessions/${id}`, { method: "DELETE" }))
+      .catch(() => {});
+  }
+
+  async function sendImage(preview = false) {
+    if (!file) return;
+    const request = ++requestRef.current;
+    if (!preview) setLoading(true);
+    const query = preview
+      ? `enh=${enh}&sharp=${sharp}&clarity=${clarity}&binary=true&preview=true&format=jpeg&quality=85`
+      : `enh=${enh}&sharp=${sharp}&clarity=${clarity}&binary=true`;
     try {
-      const res = await fetch(url, { method: "POST", body: form });
+      const session = sessionRef.current;
+      let id = await (session && session.file === file ? session.id : openSession(file));
+      let res = await fetch(`${API_BASE}/api/enhance/sessions/${id}?${query}`);
+      if (res.status === 404) {
+        // Session expired on the server — upload the image again
+        id = await openSession(file);
+        res = await fetch(`${API_BASE}/api/enhance/sessions/${id}?${query}`);
+      }
       if (!res.ok) throw new Error("Enhance failed");
-      const data = await res.json();
-      setEnhancedSrc("data:image/png;base64," + data.image);
+      const blob = await res.blob();
+      if (request !== requestRef.current) return; // a newer request superseded this one
+      setEnhancedSrc(URL.createObjectURL(blob));
     } catch (e) {
       console.error(e);
-      alert("Could not reach backend.");
+      if (!preview) alert("Could not reach backend.");
     } finally {
-      setLoading(false);
+      if (!preview && request === requestRef.current) setLoading(false);
     }
   }
 
   function onFileChange(e) {
     const f = e.target.files && e.target.files[0];
     if (!f) return;
+    closeSession();
+    openSession(f);
     setFile(f);
     setEnhancedSrc("");
     const reader = new FileReader();
@@ -54,6 +107,8 @@ export default function Enhancement() {
     setDragOver(false);
     const f = e.dataTransfer.files[0];
     if (!f || !f.type.startsWith("image/")) return;
+    closeSession();
+    openSession(f);
     setFile(f);
     setEnhancedSrc("");
     const reader = new FileReader();
@@ -70,6 +125,7 @@ export default function Enhancement() {
   }
 
   function reset() {
+    closeSession();
     setFile(null);
     setOriginalSrc("");
     setEnhancedSrc("");